@@ -0,0 +1,120 @@
+import heapq, logging, threading, time, uuid
+from datetime import datetime, timezone
+from domain.models import EventResult, EventType, PayloadType, ResvStatus, LockerEvent, to_timestamp
+from domain.repositories import Projection
+
+# Issues ReservationExpired for reservations still CREATED `ttl_seconds` after their ReservationCreated.
+#   - deadlines are kept in a min-heap of (deadline, reservation_id, locker_id, compartment_id),
+#   - a deposit or pickup does not touch the heap: an entry is checked against the projection when it
+#     comes due and dropped if the reservation moved on (lazy deletion),
+#   - expiries are applied through LockerService.expire_reservations in batches, which checks the status
+#     again under the locker lock, with event ids derived from the reservation id, so an expiry issued
+#     twice (e.g. around a restart) is a duplicate,
+#   - a batch that fails goes back on the heap and is retried at the next check.
+# The owner wires the scheduler into the service (service.expiry_scheduler), which then hands over
+# accepted ReservationCreated events and asks for a reschedule after rebuilds.
+
+logger = logging.getLogger("locker.expiry")
+
+# namespace of the uuid5 event ids of issued expiries
+EXPIRY_NAMESPACE = uuid.UUID("6f1c2a64-3e0b-4f57-9a55-2f4d8a3c9b10")
+
+class ExpiryScheduler:
+    def __init__(self, service, ttl_seconds: float, batch_size: int = 500, check_interval: float = 1.0):
+        self.service = service
+        self.ttl_seconds = ttl_seconds
+        self.batch_size = batch_size
+        self.check_interval = check_interval
+        self._heap: list[tuple[float, str, str, str]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def schedule(self, events: list[LockerEvent]) -> None:
+        entries = []
+        for event in events:
+            if event.type != EventType.RESERVATION_CREATED:
+                continue
+            created_at = to_timestamp(event.occurred_at)
+            if created_at is None:
+                continue
+            entries.append((created_at + self.ttl_seconds, event.payload[PayloadType.RESERVATION_ID],
+                            event.locker_id, event.payload[PayloadType.COMPARTMENT_ID]))
+        if entries:
+            with self._lock:
+                for entry in entries:
+                    heapq.heappush(self._heap, entry)
+
+    # the heap from the reservations of a rebuilt projection
+    def reschedule(self, projection: Projection) -> None:
+        heap = [(reservation.created_at + self.ttl_seconds, reservation.reservation_id, locker_id, compartment_id)
+                for locker_id, compartment_id, reservation in projection.iter_reservations()
+                if reservation.status == ResvStatus.CREATED and reservation.created_at is not None]
+        heapq.heapify(heap)
+        with self._lock:
+            self._heap = heap
+
+    # expire every reservation due at `now`, returns the number of ReservationExpired events issued
+    def run_due(self, now: float | None = None) -> int:
+        now = time.time() if now is None else now
+        issued = 0
+        while True:
+            entries, batch = self._take_due(now)
+            if not batch:
+                return issued
+            try:
+                results = self.service.expire_reservations(batch)
+            except BaseException:
+                # popped already, they would never be issued otherwise
+                self._push(entries)
+                raise
+            issued += results.count(EventResult.SUCCESS)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target = self._run, daemon = True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.check_interval):
+            # e.g. a failed log write, the thread keeps running and the batch is retried at the next check
+            try:
+                self.run_due()
+            except Exception:
+                logger.exception("issuing due reservation expiries failed")
+
+    def _push(self, entries: list[tuple[float, str, str, str]]) -> None:
+        with self._lock:
+            for entry in entries:
+                heapq.heappush(self._heap, entry)
+
+    # the heap entries and ReservationExpired events of up to `batch_size` due reservations
+    def _take_due(self, now: float) -> tuple[list[tuple[float, str, str, str]], list[LockerEvent]]:
+        entries = []
+        batch = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                entry = heapq.heappop(self._heap)
+                deadline, reservation_id, locker_id, compartment_id = entry
+                reservation = self.service.get_reservation_state(reservation_id)
+                # deposited, picked up or already expired since it was scheduled
+                if reservation is None or reservation.status != ResvStatus.CREATED:
+                    continue
+                entries.append(entry)
+                batch.append(LockerEvent(
+                        str(uuid.uuid5(EXPIRY_NAMESPACE, reservation_id)),
+                        datetime.fromtimestamp(deadline, timezone.utc).isoformat(),
+                        locker_id,
+                        EventType.RESERVATION_EXPIRED,
+                        {PayloadType.COMPARTMENT_ID: compartment_id, PayloadType.RESERVATION_ID: reservation_id}
+                    ))
+        return entries, batch
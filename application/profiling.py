@@ -0,0 +1,139 @@
+import cProfile, contextvars, logging, marshal, pstats, threading, time
+from collections import deque
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+# Opt-in request tracing and profiling, both off until switched on at runtime:
+#   - tracing: the layers record timed spans into the trace of the current request and
+#     requests slower than `slow_request_ms` are logged with their spans,
+#   - profiling: cProfile runs around the handling of a sample of the next N requests and
+#     the merged stats can be downloaded as a pstats file.
+
+logger = logging.getLogger("locker.slow_requests")
+
+class Trace:
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans: dict[str, float] = {} # seconds per layer, summed over repeated spans
+        self.attributes: dict = {}
+
+    def add_span(self, span: str, seconds: float) -> None:
+        self.spans[span] = self.spans.get(span, 0.0) + seconds
+
+# the trace of the request handled by this context, None when tracing is off
+_current_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar("current_trace", default = None)
+
+def record_span(span: str, seconds: float) -> None:
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(span, seconds)
+
+# a span from the start of the request until now, e.g. the request parsing and validation
+def record_span_since_start(span: str) -> None:
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(span, time.perf_counter() - trace.start)
+
+def annotate(**attributes) -> None:
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+class Profiler:
+    def __init__(self, slow_request_ms: float = 0, keep_slow_requests: int = 100,
+                 describe: Callable[[dict], dict] | None = None):
+        # requests slower than this are logged, 0 turns tracing off
+        self.slow_request_ms = slow_request_ms
+        # extra fields of a slow request from its attributes, only paid for requests that are logged
+        self.describe = describe
+        self.slow_requests: deque[dict] = deque(maxlen = keep_slow_requests)
+        self._lock = threading.Lock()
+        # cProfile runs for one request at a time, overlapping requests are not sampled
+        self._profiling = threading.Lock()
+        self._remaining = 0
+        self._sample_every = 1
+        self._seen = 0
+        self._profiled = 0
+        self._stats: pstats.Stats | None = None
+
+    @property
+    def tracing(self) -> bool:
+        return self.slow_request_ms > 0
+
+    @contextmanager
+    def trace(self, name: str) -> Iterator[Trace]:
+        trace = Trace(name)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            duration_ms = (time.perf_counter() - trace.start) * 1000
+            if duration_ms >= self.slow_request_ms:
+                entry = {
+                        "request": trace.name,
+                        "duration_ms": round(duration_ms, 3),
+                        "spans_ms": {span: round(seconds * 1000, 3) for span, seconds in trace.spans.items()},
+                        **trace.attributes
+                    }
+                if self.describe:
+                    entry.update(self.describe(trace.attributes))
+                self.slow_requests.append(entry)
+                logger.warning("slow request %s", entry)
+
+    # profile the next `requests` sampled requests, one in every `sample_every`
+    def start_profile(self, requests: int, sample_every: int = 1) -> None:
+        with self._lock:
+            self._remaining = requests
+            self._sample_every = max(sample_every, 1)
+            self._seen = 0
+            self._profiled = 0
+            self._stats = None
+
+    @contextmanager
+    def profile(self) -> Iterator[None]:
+        if not self._remaining or not self._take_sample():
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+                self._profiled += 1
+            self._profiling.release()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                    "slow_request_ms": self.slow_request_ms,
+                    "profile_remaining": self._remaining,
+                    "profile_sample_every": self._sample_every,
+                    "profiled_requests": self._profiled
+                }
+
+    # the merged stats in the format written by pstats.Stats.dump_stats, None before any sample
+    def dump_stats(self) -> bytes | None:
+        with self._lock:
+            if self._stats is None:
+                return None
+            return marshal.dumps(self._stats.stats)
+
+    def _take_sample(self) -> bool:
+        with self._lock:
+            if not self._remaining:
+                return False
+            self._seen += 1
+            if (self._seen - 1) % self._sample_every:
+                return False
+            if not self._profiling.acquire(blocking = False):
+                return False
+            self._remaining -= 1
+            return True
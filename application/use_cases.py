@@ -1,19 +1,149 @@
-from domain.models import EventResult, LockerEvent, Locker, Compartment, Reservation
-from domain.repositories import EventStore, Projection
+import threading, time
+from application.locking import KeyedLocks, ReadWriteLock
+from application.metrics import EVENTS_TOTAL, HANDLE_EVENT_SECONDS, HANDLE_EVENTS_SECONDS, REBUILD_SECONDS
+from domain.models import (EventResult, LockerEvent, Locker, LockerCounts, Compartment, Reservation, Snapshot,
+                           SnapshotCapture, CompartmentFilter, PayloadType, ResvStatus)
+from domain.repositories import EventStore, SnapshotStore, Projection
+
+# handle_event/handle_events may be called concurrently:
+#   - events of the same locker are serialized by a per-locker lock, so a locker's apply order
+#     and log order are the same; events of different lockers run in parallel
+#   - an event_id is claimed before it is applied, so a concurrent retry of an in-flight event
+#     is reported as a duplicate instead of being applied twice
+#   - an event is applied before it is appended; when the append fails, its locker is reloaded from
+#     the log before the locker lock is released
+#   - rebuilds, compactions and the start of a snapshot hold the state lock exclusively, so they never see
+#     an event that is applied but not yet in the log; a snapshot then reads each locker under its lock
 
 class LockerService:
-    def __init__(self, projection: Projection, event_store: EventStore):
+    def __init__(self, projection: Projection, event_store: EventStore,
+                 snapshot_store: SnapshotStore | None = None, snapshot_interval: int = 0):
         self.projection = projection
         self.event_store = event_store
+        self.snapshot_store = snapshot_store
+        # take a snapshot every `snapshot_interval` accepted events, 0 disables periodic snapshots
+        self.snapshot_interval = snapshot_interval
+        self._events_since_snapshot = 0
+        self._last_event_id: str | None = None
+        self._snapshot_thread: threading.Thread | None = None
+        self._snapshot_guard = threading.Lock()
+        self._state_lock = ReadWriteLock()
+        self._locker_locks = KeyedLocks()
+        self._inflight: set[str] = set() # event ids being applied
+        self._inflight_guard = threading.Lock()
+        # an ExpiryScheduler wired in by the owner, told about accepted events and rebuilds
+        self.expiry_scheduler = None
 
     def rebuild_events(self) -> int:
-        return self.projection.rebuild(self.event_store)
+        with self._state_lock.exclusive(), REBUILD_SECONDS.time():
+            self._events_since_snapshot = 0
+            result = self.projection.rebuild(self.event_store, self.snapshot_store)
+            if self.expiry_scheduler is not None:
+                self.expiry_scheduler.reschedule(self.projection)
+            return result
 
     def handle_event(self, event: LockerEvent) -> int:
-        result = self.projection.apply(event, self.event_store)
-        if result != EventResult.SUCCESS:
-            return result
-        return self.event_store.append(event)
+        start = time.perf_counter()
+        result = self._handle_event(event)
+        HANDLE_EVENT_SECONDS.observe(time.perf_counter() - start, result.name)
+        EVENTS_TOTAL.inc(result.name)
+        return result
+
+    # apply the events in order and persist every accepted one with a single append_batch
+    def handle_events(self, events: list[LockerEvent]) -> list[int]:
+        with HANDLE_EVENTS_SECONDS.time():
+            results = self._handle_events(events)
+        for result in results:
+            EVENTS_TOTAL.inc(result.name)
+        return results
+
+    # handle_events for the ReservationExpired events of the expiry scheduler: a reservation that is no longer
+    # CREATED once its locker is locked, e.g. deposited or picked up since it came due, is skipped as a
+    # DOMAIN_VIOLATION instead of being expired
+    def expire_reservations(self, events: list[LockerEvent]) -> list[int]:
+        with HANDLE_EVENTS_SECONDS.time():
+            results = self._handle_events(events, only_created = True)
+        for result in results:
+            EVENTS_TOTAL.inc(result.name)
+        return results
+
+    def _handle_event(self, event: LockerEvent) -> int:
+        with self._state_lock.shared(), self._locker_locks.hold([event.locker_id]):
+            # re-sending the same event_id must not change state
+            if not self._claim([event])[0]:
+                return EventResult.DUPLICATE
+            try:
+                if self.event_store.contains(event.event_id):
+                    return EventResult.DUPLICATE
+                result = self.projection.apply(event)
+                if result != EventResult.SUCCESS:
+                    return result
+                try:
+                    result = self.event_store.append(event)
+                except BaseException:
+                    self._reload_lockers([event])
+                    raise
+            finally:
+                self._release([event])
+        if result == EventResult.SUCCESS:
+            self._after_append([event])
+        return result
+
+    def _handle_events(self, events: list[LockerEvent], only_created: bool = False) -> list[int]:
+        with self._state_lock.shared(), self._locker_locks.hold(event.locker_id for event in events):
+            claimed = self._claim(events)
+            appended = []
+            try:
+                results, accepted = self._apply_batch(events, claimed, only_created)
+                if accepted:
+                    try:
+                        append_results = self.event_store.append_batch([event for _, event in accepted])
+                    except BaseException:
+                        self._reload_lockers([event for _, event in accepted])
+                        raise
+                    for (index, event), result in zip(accepted, append_results):
+                        results[index] = result
+                        if result == EventResult.SUCCESS:
+                            appended.append(event)
+            finally:
+                self._release([event for event, is_claimed in zip(events, claimed) if is_claimed])
+        self._after_append(appended)
+        return results
+
+    def take_snapshot(self) -> threading.Thread | None:
+        if not self.snapshot_store:
+            return None
+        with self._snapshot_guard:
+            # a previous snapshot is still being written
+            if self._snapshot_thread and self._snapshot_thread.is_alive():
+                return None
+
+            # only the start of the capture holds events off: it records the lockers and the log position,
+            # the lockers are then copied one at a time on the background thread while events keep arriving
+            with self._state_lock.exclusive():
+                position, last_event_id = self.event_store.get_position(), self._last_event_id
+                capture = self.projection.begin_snapshot()
+            self._events_since_snapshot = 0
+            self._snapshot_thread = threading.Thread(target=self._write_snapshot,
+                                                     args=(position, last_event_id, capture), daemon=True)
+            self._snapshot_thread.start()
+            return self._snapshot_thread
+
+    def _write_snapshot(self, position: int, last_event_id: str | None, capture: SnapshotCapture) -> None:
+        lockers = []
+        for locker_id in capture.locker_ids:
+            # the locker's lock keeps its events out while its row is read, the shared state lock keeps rebuilds out
+            with self._state_lock.shared(), self._locker_locks.hold([locker_id]):
+                # a rebuild replaced the state since the capture began, the next interval takes a new one
+                if capture.cancelled:
+                    return
+                lockers.append(self.projection.snapshot_locker(capture, locker_id))
+        self.snapshot_store.save(Snapshot(position, last_event_id, self.projection.end_snapshot(capture, lockers)))
+
+    # fold lockers that are done into the event store's checkpoint, returns the records dropped
+    def compact(self) -> int:
+        with self._state_lock.exclusive():
+            return self.event_store.compact(self.projection)
 
     def get_locker_state(self, locker_id: str) -> Locker:
         return self.projection.query_locker(locker_id)
@@ -22,4 +152,81 @@ class LockerService:
         return self.projection.query_compartment(locker_id, compartment_id)
 
     def get_reservation_state(self, reservation_id: str) -> Reservation:
-        return self.projection.query_reservation(reservation_id)
\ No newline at end of file
+        return self.projection.query_reservation(reservation_id)
+
+    def get_lockers_state(self, locker_ids: list[str]) -> list[Locker | None]:
+        return self.projection.query_lockers(locker_ids)
+
+    # the counters and state_hash of each locker, without building its compartments
+    def get_locker_counts(self, locker_ids: list[str]) -> list[LockerCounts | None]:
+        return self.projection.query_locker_counts(locker_ids)
+
+    def list_compartments(self, locker_id: str, compartment_filter: CompartmentFilter | None = None,
+                          offset: int = 0, limit: int = 100) -> tuple[list[Compartment], int] | None:
+        return self.projection.query_compartments(locker_id, compartment_filter, offset, limit)
+
+    # candidates for the next ReservationCreated of the locker
+    def get_free_compartments(self, locker_id: str, count: int = 1) -> tuple[list[str], int] | None:
+        return self.projection.query_free_compartments(locker_id, count)
+
+    def get_state_hash(self, locker_id: str) -> str | None:
+        return self.projection.query_state_hash(locker_id)
+
+    def _apply_batch(self, events: list[LockerEvent], claimed: list[bool],
+                     only_created: bool = False) -> tuple[list[int], list[tuple[int, LockerEvent]]]:
+        results = []
+        accepted = []
+        for index, event in enumerate(events):
+            # re-sending the same event_id, also within the batch, must not change state
+            if not claimed[index] or self.event_store.contains(event.event_id):
+                results.append(EventResult.DUPLICATE)
+                continue
+            if only_created:
+                reservation = self.projection.query_reservation(event.payload.get(PayloadType.RESERVATION_ID))
+                if reservation is None or reservation.status != ResvStatus.CREATED:
+                    results.append(EventResult.DOMAIN_VIOLATION)
+                    continue
+            result = self.projection.apply(event)
+            results.append(result)
+            if result == EventResult.SUCCESS:
+                accepted.append((index, event))
+        return results, accepted
+
+    # the events were applied but did not reach the log: their lockers are put back to the log's state
+    # while their locks are still held, so no later event is validated against state the log never had
+    def _reload_lockers(self, events: list[LockerEvent]) -> None:
+        for locker_id in dict.fromkeys(event.locker_id for event in events):
+            self.projection.reload_locker(locker_id, self.event_store)
+
+    # claim each event id for this call, False for ids already claimed or repeated in `events`
+    def _claim(self, events: list[LockerEvent]) -> list[bool]:
+        claimed = []
+        with self._inflight_guard:
+            for event in events:
+                is_claimed = event.event_id not in self._inflight
+                self._inflight.add(event.event_id)
+                claimed.append(is_claimed)
+        return claimed
+
+    def _release(self, events: list[LockerEvent]) -> None:
+        with self._inflight_guard:
+            for event in events:
+                self._inflight.discard(event.event_id)
+
+    # follow-up work for events that are in the log
+    def _after_append(self, appended: list[LockerEvent]) -> None:
+        if self.expiry_scheduler is not None and appended:
+            self.expiry_scheduler.schedule(appended)
+        self._maybe_snapshot(appended)
+
+    def _maybe_snapshot(self, appended: list[LockerEvent]) -> None:
+        if not appended:
+            return
+        with self._snapshot_guard:
+            self._last_event_id = appended[-1].event_id
+            if not self.snapshot_interval:
+                return
+            self._events_since_snapshot += len(appended)
+            if self._events_since_snapshot < self.snapshot_interval:
+                return
+        self.take_snapshot()
@@ -0,0 +1,74 @@
+# Log size and rebuild speed of each FileEventStore codec.
+#   python -m benchmarks.bench_codec --events 200000
+import argparse, tempfile, time, uuid
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+from pathlib import Path
+from domain.models import EventType, PayloadType, LockerEvent
+from infrastructure.file_event_store import FileEventStore
+from infrastructure.in_memory_projection import InMemoryProjection
+from infrastructure.log_codec import CODECS
+
+# every compartment is registered once and then goes through reservation cycles
+def iter_events(count: int, lockers: int = 100, compartments: int = 20) -> Iterator[LockerEvent]:
+    start = datetime(2026, 1, 1)
+    produced = 0
+    cycle = 0
+    while True:
+        for locker in range(lockers):
+            for compartment in range(compartments):
+                if produced == count:
+                    return
+                locker_id, compartment_id = f"L{locker}", f"C{compartment}"
+                if cycle == 0:
+                    event_type = EventType.COMPARTMENT_REGISTERED
+                    payload = {PayloadType.COMPARTMENT_ID: compartment_id}
+                elif cycle <= 3:
+                    # a compartment keeps its first reservation, later cycles only move that one
+                    event_type = [EventType.RESERVATION_CREATED, EventType.PARCEL_DEPOSITED, EventType.PARCEL_PICKED_UP][cycle - 1]
+                    payload = {PayloadType.COMPARTMENT_ID: compartment_id,
+                               PayloadType.RESERVATION_ID: f"R-{locker_id}-{compartment_id}"}
+                else:
+                    event_type = EventType.FAULT_REPORTED
+                    payload = {PayloadType.COMPARTMENT_ID: compartment_id, PayloadType.SEVERITY: 1}
+                yield LockerEvent(str(uuid.uuid4()), (start + timedelta(seconds = produced)).isoformat(),
+                                  locker_id, event_type, payload)
+                produced += 1
+        cycle += 1
+
+def make_events(count: int) -> list[LockerEvent]:
+    return list(iter_events(count))
+
+def run(codec: str, events: list[LockerEvent]) -> tuple[int, float, float]:
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "events.log"
+        store = FileEventStore(str(path), durability = "none", codec = codec)
+        for start in range(0, len(events), 1000):
+            store.append_batch(events[start:start + 1000])
+        size = sum(segment.stat().st_size for segment in store.get_segment_paths().values())
+        store.close()
+
+        store = FileEventStore(str(path))
+        start = time.perf_counter()
+        for _ in store.iter_all():
+            pass
+        decode_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        InMemoryProjection().rebuild(store)
+        rebuild_seconds = time.perf_counter() - start
+        store.close()
+    return size, decode_seconds, rebuild_seconds
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type = int, default = 200000)
+    args = parser.parse_args()
+
+    events = make_events(args.events)
+    print(f"{'codec':<8}{'bytes':>14}{'bytes/event':>13}{'decode s':>10}{'rebuild s':>11}")
+    for codec in CODECS:
+        size, decode_seconds, rebuild_seconds = run(codec, events)
+        print(f"{codec:<8}{size:>14}{size / len(events):>13.1f}{decode_seconds:>10.2f}{rebuild_seconds:>11.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# Append latency, dedup cost and rebuild time of FileEventStore and SqliteEventStore.
+#   python -m benchmarks.bench_event_store --sizes 100000 1000000 10000000
+import argparse, itertools, statistics, tempfile, time
+from pathlib import Path
+from domain.models import EventType, PayloadType, LockerEvent
+from domain.repositories import EventStore
+from infrastructure.file_event_store import FileEventStore
+from infrastructure.in_memory_projection import InMemoryProjection
+from infrastructure.sqlite_event_store import SqliteEventStore
+from benchmarks.bench_codec import iter_events
+
+def open_store(backend: str, directory: str, durability: str) -> EventStore:
+    if backend == "sqlite":
+        return SqliteEventStore(str(Path(directory) / "events.db"), durability = durability)
+    return FileEventStore(str(Path(directory) / "events.jsonl"), durability = durability)
+
+# microseconds per call
+def latencies(call, items: list) -> list[float]:
+    samples = []
+    for item in items:
+        start = time.perf_counter()
+        call(item)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+def run(backend: str, size: int, samples: int, durability: str) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        # the history is loaded in large unsynced batches, only the measured appends use `durability`
+        store = open_store(backend, directory, "none")
+        events = iter_events(size)
+        start = time.perf_counter()
+        while batch := list(itertools.islice(events, 10000)):
+            store.append_batch(batch)
+        load_seconds = time.perf_counter() - start
+        stored = store.load_by_locker("L0")[:samples]
+        store.close()
+
+        store = open_store(backend, directory, durability)
+        new_events = [LockerEvent(f"bench-{i}", "2026-01-01T00:00:00", "L-bench", EventType.COMPARTMENT_REGISTERED,
+                                  {PayloadType.COMPARTMENT_ID: f"C{i}"}) for i in range(samples)]
+        append = latencies(store.append, new_events)
+        dedup = latencies(store.append, stored)
+        start = time.perf_counter()
+        InMemoryProjection().rebuild(store)
+        rebuild_seconds = time.perf_counter() - start
+        store.close()
+    return {
+            "load_s": load_seconds,
+            "append_p50_us": statistics.median(append),
+            "append_p99_us": statistics.quantiles(append, n = 100)[98],
+            "dedup_p50_us": statistics.median(dedup),
+            "rebuild_s": rebuild_seconds
+        }
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type = int, nargs = "+", default = [100000])
+    parser.add_argument("--samples", type = int, default = 1000)
+    parser.add_argument("--durability", default = "always")
+    args = parser.parse_args()
+
+    columns = ["load_s", "append_p50_us", "append_p99_us", "dedup_p50_us", "rebuild_s"]
+    print(f"{'store':<8}{'events':>10}" + "".join(f"{column:>15}" for column in columns))
+    for size in args.sizes:
+        for backend in ("file", "sqlite"):
+            result = run(backend, size, args.samples, args.durability)
+            print(f"{backend:<8}{size:>10}" + "".join(f"{result[column]:>15.2f}" for column in columns))
+
+if __name__ == "__main__":
+    main()
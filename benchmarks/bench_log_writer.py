@@ -0,0 +1,40 @@
+# Append throughput of FileEventStore under each durability mode.
+#   python -m benchmarks.bench_log_writer --events 20000 --threads 16
+import argparse, tempfile, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from domain.models import EventType, PayloadType, LockerEvent
+from infrastructure.file_event_store import FileEventStore
+from infrastructure.log_writer import DURABILITY_MODES
+
+def make_events(count: int) -> list[LockerEvent]:
+    return [
+        LockerEvent(str(uuid.uuid4()), datetime.now().isoformat(), f"L{i % 100}",
+                    EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: f"C{i}"})
+        for i in range(count)
+    ]
+
+def run(durability: str, events: list[LockerEvent], threads: int) -> float:
+    with tempfile.TemporaryDirectory() as directory:
+        store = FileEventStore(str(Path(directory) / "events.jsonl"), durability = durability)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers = threads) as pool:
+            list(pool.map(store.append, events))
+        elapsed = time.perf_counter() - start
+        store.close()
+    return len(events) / elapsed
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type = int, default = 20000)
+    parser.add_argument("--threads", type = int, default = 16)
+    args = parser.parse_args()
+
+    events = make_events(args.events)
+    print(f"{'durability':<12}{'events/s':>12}")
+    for durability in DURABILITY_MODES:
+        print(f"{durability:<12}{run(durability, events, args.threads):>12.0f}")
+
+if __name__ == "__main__":
+    main()
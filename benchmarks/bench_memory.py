@@ -0,0 +1,70 @@
+# Memory held per compartment and per reservation, by the domain model alone and by each projection.
+#   python -m benchmarks.bench_memory --lockers 1000 --compartments 100
+import argparse, gc, tracemalloc, uuid
+from domain.models import EventType, PayloadType, LockerEvent, Locker
+from infrastructure.columnar_projection import ColumnarProjection
+from infrastructure.in_memory_projection import InMemoryProjection
+
+# ids are built the way they arrive in events, as new string objects per event
+def compartment_ids(count: int) -> list[str]:
+    return [f"C{compartment}" for compartment in range(count)]
+
+def measure(build) -> tuple[int, object]:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size, kept
+
+def model_sizes(lockers: int, compartments: int) -> tuple[float, float]:
+    def register():
+        registered = [Locker(f"L{locker}") for locker in range(lockers)]
+        for locker in registered:
+            for compartment_id in compartment_ids(compartments):
+                locker.add_compartment(compartment_id)
+        return registered
+    compartment_bytes, registered = measure(register)
+
+    def reserve():
+        for locker in registered:
+            for compartment_id in compartment_ids(compartments):
+                locker.add_reservation(compartment_id, f"R-{locker.locker_id}-{compartment_id}")
+                locker.deposite_parcel(compartment_id, f"R-{locker.locker_id}-{compartment_id}")
+    reservation_bytes, _ = measure(reserve)
+    count = lockers * compartments
+    return compartment_bytes / count, reservation_bytes / count
+
+def projection_sizes(projection_class: type, lockers: int, compartments: int) -> tuple[float, float]:
+    projection = projection_class()
+
+    def apply(event_type: EventType, with_reservation: bool):
+        for locker in range(lockers):
+            for compartment_id in compartment_ids(compartments):
+                payload = {PayloadType.COMPARTMENT_ID: compartment_id}
+                if with_reservation:
+                    payload[PayloadType.RESERVATION_ID] = f"R-L{locker}-{compartment_id}"
+                projection.apply(LockerEvent(str(uuid.uuid4()), "2026-01-01T00:00:00", f"L{locker}", event_type, payload))
+
+    compartment_bytes, _ = measure(lambda: apply(EventType.COMPARTMENT_REGISTERED, False))
+    reservation_bytes, _ = measure(lambda: apply(EventType.RESERVATION_CREATED, True))
+    count = lockers * compartments
+    return compartment_bytes / count, reservation_bytes / count
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lockers", type = int, default = 1000)
+    parser.add_argument("--compartments", type = int, default = 100)
+    args = parser.parse_args()
+
+    print(f"{'state':<12}{'bytes/compartment':>19}{'bytes/reservation':>19}")
+    compartment_bytes, reservation_bytes = model_sizes(args.lockers, args.compartments)
+    print(f"{'model':<12}{compartment_bytes:>19.1f}{reservation_bytes:>19.1f}")
+    for name, projection_class in (("memory", InMemoryProjection), ("columnar", ColumnarProjection)):
+        compartment_bytes, reservation_bytes = projection_sizes(projection_class, args.lockers, args.compartments)
+        print(f"{name:<12}{compartment_bytes:>19.1f}{reservation_bytes:>19.1f}")
+
+if __name__ == "__main__":
+    main()
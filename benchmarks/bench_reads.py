@@ -0,0 +1,55 @@
+# Latency of the locker reads served by each projection, per call.
+#   python -m benchmarks.bench_reads --lockers 200 --compartments 1000
+# `locker` builds the whole Locker with its compartments, `counts` is what GET /lockers/{id} and
+# GET /lockers?ids= read, `state_hash` is the ETag check of every locker and compartment GET.
+import argparse, time
+from domain.models import EventType, PayloadType, LockerEvent
+from infrastructure.columnar_projection import ColumnarProjection
+from infrastructure.in_memory_projection import InMemoryProjection
+
+OCCURRED_AT = "2024-01-01T00:00:00+00:00"
+
+def build(projection_class: type, lockers: int, compartments: int):
+    projection = projection_class()
+    projection.record_metrics = False
+    for locker in range(lockers):
+        for compartment in range(compartments):
+            payload = {PayloadType.COMPARTMENT_ID: f"C{compartment}"}
+            projection.apply(LockerEvent(f"E{locker}-{compartment}", OCCURRED_AT, f"L{locker}",
+                                         EventType.COMPARTMENT_REGISTERED, payload))
+            # every other compartment holds a reservation
+            if compartment % 2:
+                payload = {**payload, PayloadType.RESERVATION_ID: f"R{locker}-{compartment}"}
+                projection.apply(LockerEvent(f"E{locker}-{compartment}-R", OCCURRED_AT, f"L{locker}",
+                                             EventType.RESERVATION_CREATED, payload))
+    return projection
+
+def time_reads(read, locker_ids: list[str], rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for locker_id in locker_ids:
+            read(locker_id)
+    return (time.perf_counter() - start) / (rounds * len(locker_ids)) * 1e6
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lockers", type = int, default = 200)
+    parser.add_argument("--compartments", type = int, default = 1000, help = "compartments per locker")
+    parser.add_argument("--rounds", type = int, default = 5)
+    args = parser.parse_args()
+
+    locker_ids = [f"L{locker}" for locker in range(args.lockers)]
+    reads = {
+            "locker": lambda projection: projection.query_locker,
+            "counts": lambda projection: lambda locker_id: projection.query_locker_counts([locker_id]),
+            "state_hash": lambda projection: projection.query_state_hash,
+            "compartment": lambda projection: lambda locker_id: projection.query_compartment(locker_id, "C1"),
+        }
+    print(f"{'projection':>12}" + "".join(f"{name + ' us':>16}" for name in reads))
+    for name, projection_class in (("memory", InMemoryProjection), ("columnar", ColumnarProjection)):
+        projection = build(projection_class, args.lockers, args.compartments)
+        timings = [time_reads(read(projection), locker_ids, args.rounds) for read in reads.values()]
+        print(f"{name:>12}" + "".join(f"{timing:>16.2f}" for timing in timings))
+
+if __name__ == "__main__":
+    main()
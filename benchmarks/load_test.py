@@ -0,0 +1,215 @@
+# End-to-end load test: starts interface.api:app with uvicorn on a fresh log and drives it with
+# concurrent clients replaying synthetic locker lifecycles, retries and reads.
+#   python -m benchmarks.load_test --clients 32 --lockers 200 --events 20000
+# Server CPU and memory are sampled from /proc, so they are only reported on Linux.
+import argparse, json, os, random, socket, statistics, subprocess, sys, tempfile, threading, time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import httpx
+from domain.models import PayloadType, LockerEvent
+from benchmarks.workload import DEFAULT_MIX, Workload, parse_mix
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(port: int, directory: str, extra_env: dict[str, str]) -> subprocess.Popen:
+    env = {**os.environ, "LOG_PATH": str(Path(directory) / "events.jsonl"),
+           "SQLITE_PATH": str(Path(directory) / "events.db"),
+           "SNAPSHOT_DIR": str(Path(directory) / "snapshots"), **extra_env}
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "interface.api:app", "--port", str(port),
+                             "--log-level", "warning"], cwd = ROOT, env = env)
+
+def wait_until_ready(base_url: str, server: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with status {server.returncode}")
+        try:
+            httpx.get(f"{base_url}/lockers/ready-check", timeout = 1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+# CPU seconds and resident memory of a process, read from /proc
+class ProcessSampler:
+    def __init__(self, pid: int, interval: float = 0.25):
+        self.pid = pid
+        self.interval = interval
+        self.samples: list[tuple[float, float, int]] = [] # (time, cpu seconds, rss bytes)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target = self._run, daemon = True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> dict:
+        self._stop.set()
+        self._thread.join()
+        if len(self.samples) < 2:
+            return {}
+        (start, start_cpu, _), (end, end_cpu, _) = self.samples[0], self.samples[-1]
+        return {
+                "cpu_percent": 100 * (end_cpu - start_cpu) / (end - start),
+                "rss_peak_mb": max(rss for _, _, rss in self.samples) / (1 << 20),
+                "rss_end_mb": self.samples[-1][2] / (1 << 20)
+            }
+
+    def _run(self) -> None:
+        ticks = os.sysconf("SC_CLK_TCK")
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        while not self._stop.is_set():
+            try:
+                fields = Path(f"/proc/{self.pid}/stat").read_text().rsplit(")", 1)[1].split()
+                rss_pages = int(Path(f"/proc/{self.pid}/statm").read_text().split()[1])
+            except (OSError, IndexError, ValueError):
+                return
+            # utime and stime are fields 14 and 15 of /proc/<pid>/stat, counted after the command name
+            cpu_seconds = (int(fields[11]) + int(fields[12])) / ticks
+            self.samples.append((time.monotonic(), cpu_seconds, rss_pages * page_size))
+            self._stop.wait(self.interval)
+
+def to_json(event: LockerEvent) -> dict:
+    return {"event_id": event.event_id, "occurred_at": event.occurred_at, "locker_id": event.locker_id,
+            "type": event.type.value, "payload": {str(key.value if isinstance(key, PayloadType) else key): value
+                                                  for key, value in event.payload.items()}}
+
+# one connection per client thread, the async httpx client is slower under many concurrent requests
+class LoadClient:
+    def __init__(self, http: httpx.Client, rng: random.Random, duplicate_rate: float, read_rate: float):
+        self.http = http
+        self.rng = rng
+        # share of accepted events that are sent again, as a client retrying after a lost response
+        self.duplicate_rate = duplicate_rate
+        # reads issued per event sent
+        self.read_rate = read_rate
+        self.latencies: dict[tuple[str, str, int], list[float]] = defaultdict(list) # (method, endpoint, status)
+
+    def request(self, method: str, endpoint: str, url: str, **kwargs) -> None:
+        start = time.perf_counter()
+        response = self.http.request(method, url, **kwargs)
+        self.latencies[(method, endpoint, response.status_code)].append(time.perf_counter() - start)
+
+    # events of one locker are sent in order, so the server sees the same history as the generator
+    def replay(self, events: list[LockerEvent]) -> None:
+        for event in events:
+            body = to_json(event)
+            self.request("POST", "/events", "/events", json = body)
+            if self.rng.random() < self.duplicate_rate:
+                self.request("POST", "/events", "/events", json = body)
+            if self.rng.random() < self.read_rate:
+                self.read(event)
+
+    def read(self, event: LockerEvent) -> None:
+        choice = self.rng.randrange(3)
+        compartment_id = event.payload.get(PayloadType.COMPARTMENT_ID)
+        reservation_id = event.payload.get(PayloadType.RESERVATION_ID)
+        if choice == 0 or not compartment_id:
+            self.request("GET", "/lockers/{locker_id}", f"/lockers/{event.locker_id}")
+        elif choice == 1 or not reservation_id:
+            self.request("GET", "/lockers/{locker_id}/compartments/{compartment_id}",
+                         f"/lockers/{event.locker_id}/compartments/{compartment_id}")
+        else:
+            self.request("GET", "/reservations/{reservation_id}", f"/reservations/{reservation_id}")
+
+def drive(base_url: str, workload: Workload, clients: int, duplicate_rate: float, read_rate: float,
+          seed: int) -> tuple[list[LoadClient], float]:
+    # every client owns a set of lockers and replays their events in log order
+    per_client: list[list[LockerEvent]] = [[] for _ in range(clients)]
+    owners: dict[str, int] = {}
+    for event in workload.iter_events():
+        owner = owners.setdefault(event.locker_id, len(owners) % clients)
+        per_client[owner].append(event)
+
+    load_clients = [LoadClient(httpx.Client(base_url = base_url, timeout = 60), random.Random(seed + index),
+                               duplicate_rate, read_rate) for index in range(clients)]
+    try:
+        with ThreadPoolExecutor(max_workers = clients) as pool:
+            start = time.perf_counter()
+            for future in [pool.submit(client.replay, events) for client, events in zip(load_clients, per_client)]:
+                future.result()
+            elapsed = time.perf_counter() - start
+    finally:
+        for client in load_clients:
+            client.http.close()
+    return load_clients, elapsed
+
+def summarize(load_clients: list[LoadClient], elapsed: float) -> list[dict]:
+    merged: dict[tuple[str, str, int], list[float]] = defaultdict(list)
+    for client in load_clients:
+        for key, samples in client.latencies.items():
+            merged[key].extend(samples)
+    rows = []
+    for (method, endpoint, status_code), samples in sorted(merged.items()):
+        cuts = statistics.quantiles(samples, n = 100) if len(samples) > 1 else samples * 99
+        rows.append({
+                "method": method,
+                "endpoint": endpoint,
+                "status": status_code,
+                "requests": len(samples),
+                "throughput_per_s": len(samples) / elapsed,
+                "p50_ms": cuts[49] * 1000,
+                "p95_ms": cuts[94] * 1000,
+                "p99_ms": cuts[98] * 1000
+            })
+    return rows
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type = int, default = 16)
+    parser.add_argument("--lockers", type = int, default = 100)
+    parser.add_argument("--compartments", type = int, default = 20)
+    parser.add_argument("--events", type = int, default = 8000)
+    parser.add_argument("--mix", type = parse_mix, default = dict(DEFAULT_MIX))
+    parser.add_argument("--fault-rate", type = float, default = 0.05)
+    parser.add_argument("--duplicate-rate", type = float, default = 0.05)
+    parser.add_argument("--read-rate", type = float, default = 0.5)
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--env", action = "append", default = [], help = "server setting as NAME=VALUE, repeatable")
+    parser.add_argument("--output", help = "write the results as JSON")
+    args = parser.parse_args()
+
+    workload = Workload(args.lockers, args.compartments, args.events, args.mix, args.fault_rate, args.seed)
+    extra_env = dict(entry.split("=", 1) for entry in args.env)
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as directory:
+        server = start_server(port, directory, extra_env)
+        try:
+            wait_until_ready(base_url, server)
+            sampler = ProcessSampler(server.pid)
+            sampler.start()
+            load_clients, elapsed = drive(base_url, workload, args.clients, args.duplicate_rate,
+                                          args.read_rate, args.seed)
+            server_usage = sampler.stop()
+        finally:
+            server.terminate()
+            server.wait()
+
+    rows = summarize(load_clients, elapsed)
+    total = sum(row["requests"] for row in rows)
+    print(f"{total} requests in {elapsed:.1f}s, {total / elapsed:.0f} requests/s")
+    print(f"{'request':<58}{'status':>7}{'count':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for row in rows:
+        request = f"{row['method']} {row['endpoint']}"
+        print(f"{request:<58}{row['status']:>7}{row['requests']:>8}{row['throughput_per_s']:>9.0f}"
+              f"{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}")
+    if server_usage:
+        print(f"server cpu {server_usage['cpu_percent']:.0f}%, rss peak {server_usage['rss_peak_mb']:.1f} MB, "
+              f"rss end {server_usage['rss_end_mb']:.1f} MB")
+    if args.output:
+        Path(args.output).write_text(json.dumps({
+                "config": {"workload": workload.to_dict(), "clients": args.clients,
+                           "duplicate_rate": args.duplicate_rate, "read_rate": args.read_rate, "env": extra_env},
+                "elapsed_s": elapsed,
+                "requests": rows,
+                "server": server_usage
+            }, indent = 2))
+
+if __name__ == "__main__":
+    main()
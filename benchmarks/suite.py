@@ -0,0 +1,149 @@
+# Ingest, rebuild, query and memory benchmark of LockerService on a synthetic workload,
+# written as JSON and compared with a stored baseline:
+#   python -m benchmarks.suite --output bench_results.json
+#   python -m benchmarks.suite --lockers 1000 --compartments 50 --events 200000 --baseline none
+#   python -m benchmarks.suite --update-baseline
+import argparse, json, platform, random, statistics, sys, tempfile, time, tracemalloc
+from pathlib import Path
+from application.use_cases import LockerService
+from domain.models import EventType, PayloadType
+from infrastructure.columnar_projection import ColumnarProjection
+from infrastructure.file_event_store import FileEventStore
+from infrastructure.in_memory_projection import InMemoryProjection
+from benchmarks.workload import DEFAULT_MIX, Workload, parse_mix
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+PROJECTIONS = {"memory": InMemoryProjection, "columnar": ColumnarProjection}
+
+# metric -> True when a larger value is better
+METRICS = {
+    "ingest_events_per_s": True,
+    "rebuild_s": False,
+    "query_locker_p50_us": False,
+    "query_locker_p99_us": False,
+    "query_compartment_p50_us": False,
+    "query_reservation_p50_us": False,
+    "peak_memory_mb": False,
+}
+DEFAULT_TOLERANCE = 0.25
+
+def percentile(samples: list[float], percent: int) -> float:
+    return statistics.quantiles(samples, n = 100)[percent - 1]
+
+# microseconds per call
+def latencies(call, arguments: list[tuple]) -> list[float]:
+    samples = []
+    for argument in arguments:
+        start = time.perf_counter()
+        call(*argument)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+def run(workload: Workload, projection: str, durability: str, queries: int) -> dict:
+    events = list(workload.iter_events())
+    with tempfile.TemporaryDirectory() as directory:
+        store = FileEventStore(str(Path(directory) / "events.jsonl"), durability = durability)
+        service = LockerService(PROJECTIONS[projection](), store)
+        start = time.perf_counter()
+        for event in events:
+            service.handle_event(event)
+        ingest_seconds = time.perf_counter() - start
+
+        # tracing slows the rebuild down, so time and peak memory are taken in separate passes
+        start = time.perf_counter()
+        service.rebuild_events()
+        rebuild_seconds = time.perf_counter() - start
+        tracemalloc.start()
+        service.rebuild_events()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        rng = random.Random(workload.seed)
+        lockers = [(f"L{rng.randrange(workload.lockers)}",) for _ in range(queries)]
+        compartments = [(f"L{rng.randrange(workload.lockers)}", f"C{rng.randrange(workload.compartments)}")
+                        for _ in range(queries)]
+        reservation_ids = [event.payload[PayloadType.RESERVATION_ID] for event in events
+                           if event.type == EventType.RESERVATION_CREATED]
+        reservations = [(rng.choice(reservation_ids),) for _ in range(queries)] if reservation_ids else [("R-none",)]
+        locker_samples = latencies(service.get_locker_state, lockers)
+        compartment_samples = latencies(service.get_compartment_state, compartments)
+        reservation_samples = latencies(service.get_reservation_state, reservations)
+        store.close()
+
+    return {
+            "ingest_events_per_s": len(events) / ingest_seconds,
+            "rebuild_s": rebuild_seconds,
+            "query_locker_p50_us": statistics.median(locker_samples),
+            "query_locker_p99_us": percentile(locker_samples, 99),
+            "query_compartment_p50_us": statistics.median(compartment_samples),
+            "query_reservation_p50_us": statistics.median(reservation_samples),
+            "peak_memory_mb": peak_bytes / (1 << 20),
+        }
+
+# one entry per metric present in both, a regression is a change in the bad direction beyond the tolerance
+def compare(metrics: dict, baseline: dict) -> list[dict]:
+    tolerances = baseline.get("tolerances", {})
+    rows = []
+    for metric, higher_is_better in METRICS.items():
+        if metric not in metrics or metric not in baseline["metrics"]:
+            continue
+        expected, actual = baseline["metrics"][metric], metrics[metric]
+        tolerance = tolerances.get(metric, DEFAULT_TOLERANCE)
+        change = (actual - expected) / expected if expected else 0.0
+        regressed = change < -tolerance if higher_is_better else change > tolerance
+        rows.append({"metric": metric, "baseline": expected, "actual": actual, "change": change,
+                     "tolerance": tolerance, "regressed": regressed})
+    return rows
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lockers", type = int, default = 100)
+    parser.add_argument("--compartments", type = int, default = 20)
+    parser.add_argument("--events", type = int, default = 8000)
+    parser.add_argument("--mix", type = parse_mix, default = dict(DEFAULT_MIX),
+                        help = "weights of the reservation steps, e.g. reserve=4,deposit=3,pick_up=2,expire=1")
+    parser.add_argument("--fault-rate", type = float, default = 0.05)
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--projection", choices = PROJECTIONS, default = "memory")
+    parser.add_argument("--durability", default = "none")
+    parser.add_argument("--queries", type = int, default = 2000)
+    parser.add_argument("--output", default = "bench_results.json")
+    parser.add_argument("--baseline", default = str(BASELINE_PATH), help = "baseline file, or none to skip the comparison")
+    parser.add_argument("--update-baseline", action = "store_true")
+    args = parser.parse_args()
+
+    workload = Workload(args.lockers, args.compartments, args.events, args.mix, args.fault_rate, args.seed)
+    config = {"workload": workload.to_dict(), "projection": args.projection, "durability": args.durability}
+    metrics = run(workload, args.projection, args.durability, args.queries)
+    results = {
+            "config": config,
+            "environment": {"python": platform.python_version(), "platform": platform.platform()},
+            "metrics": metrics
+        }
+    Path(args.output).write_text(json.dumps(results, indent = 2))
+    for metric, value in metrics.items():
+        print(f"{metric:<28}{value:>14.2f}")
+
+    if args.update_baseline:
+        previous = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+        results["tolerances"] = previous.get("tolerances", {metric: DEFAULT_TOLERANCE for metric in METRICS})
+        BASELINE_PATH.write_text(json.dumps(results, indent = 2) + "\n")
+        print(f"baseline written to {BASELINE_PATH}")
+        return
+    if args.baseline == "none" or not Path(args.baseline).exists():
+        return
+
+    baseline = json.loads(Path(args.baseline).read_text())
+    if baseline["config"] != config:
+        print("baseline was recorded with a different configuration, not comparing")
+        return
+    rows = compare(metrics, baseline)
+    print(f"\n{'metric':<28}{'baseline':>14}{'actual':>14}{'change':>9}")
+    for row in rows:
+        flag = "  REGRESSION" if row["regressed"] else ""
+        print(f"{row['metric']:<28}{row['baseline']:>14.2f}{row['actual']:>14.2f}{row['change']:>+9.0%}{flag}")
+    if any(row["regressed"] for row in rows):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# Deterministic synthetic locker workloads: the same settings and seed always produce the same events.
+import random, uuid
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+from domain.models import EventType, PayloadType, LockerEvent
+
+# relative weights of the reservation lifecycle steps
+DEFAULT_MIX = {"reserve": 4, "deposit": 3, "pick_up": 2, "expire": 1}
+
+def parse_mix(text: str) -> dict[str, int]:
+    mix = {}
+    for entry in text.split(","):
+        step, weight = entry.split("=")
+        if step not in DEFAULT_MIX:
+            raise ValueError(f"unknown workload step: {step}")
+        mix[step] = int(weight)
+    return mix
+
+class Workload:
+    def __init__(self, lockers: int = 100, compartments: int = 20, events: int = 8000,
+                 mix: dict[str, int] | None = None, fault_rate: float = 0.05, seed: int = 1):
+        self.lockers = lockers
+        self.compartments = compartments
+        # history length, including the registration of every compartment; a compartment takes at
+        # most three reservation steps, events beyond that are fault reports
+        self.events = events
+        self.mix = mix or dict(DEFAULT_MIX)
+        # share of events that report or clear a fault
+        self.fault_rate = fault_rate
+        self.seed = seed
+
+    def to_dict(self) -> dict:
+        return {
+                "lockers": self.lockers,
+                "compartments": self.compartments,
+                "events": self.events,
+                "mix": self.mix,
+                "fault_rate": self.fault_rate,
+                "seed": self.seed
+            }
+
+    def iter_events(self) -> Iterator[LockerEvent]:
+        # Compartments are registered first, then every event is a valid step for the state
+        # generated so far: a step without a candidate compartment falls back to a fault report.
+        rng = random.Random(self.seed)
+        start = datetime(2026, 1, 1)
+        produced = 0
+
+        def event(locker_id: str, event_type: EventType, payload: dict) -> LockerEvent:
+            nonlocal produced
+            occurred_at = (start + timedelta(seconds = produced)).isoformat()
+            produced += 1
+            return LockerEvent(str(uuid.UUID(int = rng.getrandbits(128), version = 4)), occurred_at,
+                               locker_id, event_type, payload)
+
+        slots = [(f"L{locker}", f"C{compartment}")
+                 for locker in range(self.lockers) for compartment in range(self.compartments)]
+        for locker_id, compartment_id in slots:
+            if produced == self.events:
+                return
+            yield event(locker_id, EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: compartment_id})
+
+        # a compartment keeps its first reservation, so it moves free -> created -> deposited -> done
+        free, created, deposited = list(slots), [], []
+        degraded, open_faults = set(), []
+        reservations = {}
+        steps, weights = list(self.mix), list(self.mix.values())
+        while produced < self.events:
+            if rng.random() < self.fault_rate:
+                if open_faults and rng.random() < 0.5:
+                    slot, reported_event_id = open_faults.pop(rng.randrange(len(open_faults)))
+                    degraded.discard(slot)
+                    yield event(slot[0], EventType.FAULT_CLEARED, {PayloadType.COMPARTMENT_ID: slot[1],
+                                                                   PayloadType.REPORTED_EVENT_ID: reported_event_id})
+                    continue
+                yield self._report_fault(rng, event, slots, degraded, open_faults)
+                continue
+
+            step = rng.choices(steps, weights)[0]
+            pool = {"reserve": free, "deposit": created, "pick_up": deposited, "expire": created}[step]
+            # degraded compartments cannot be reserved
+            slot = self._take(rng, pool, degraded if step == "reserve" else set())
+            if slot is None:
+                yield self._report_fault(rng, event, slots, degraded, open_faults)
+                continue
+            locker_id, compartment_id = slot
+            if step == "reserve":
+                reservations[slot] = f"R-{locker_id}-{compartment_id}"
+                created.append(slot)
+                event_type = EventType.RESERVATION_CREATED
+            elif step == "deposit":
+                deposited.append(slot)
+                event_type = EventType.PARCEL_DEPOSITED
+            elif step == "pick_up":
+                event_type = EventType.PARCEL_PICKED_UP
+            else:
+                event_type = EventType.RESERVATION_EXPIRED
+            yield event(locker_id, event_type, {PayloadType.COMPARTMENT_ID: compartment_id,
+                                                PayloadType.RESERVATION_ID: reservations[slot]})
+
+    def _report_fault(self, rng: random.Random, event, slots: list, degraded: set, open_faults: list) -> LockerEvent:
+        slot = slots[rng.randrange(len(slots))]
+        severity = rng.randint(1, 5)
+        if severity >= 3:
+            degraded.add(slot)
+        reported = event(slot[0], EventType.FAULT_REPORTED, {PayloadType.COMPARTMENT_ID: slot[1],
+                                                             PayloadType.SEVERITY: severity})
+        open_faults.append((slot, reported.event_id))
+        return reported
+
+    # remove and return a random element of `pool` that is not in `excluded`, None after a few misses
+    @staticmethod
+    def _take(rng: random.Random, pool: list, excluded: set) -> tuple[str, str] | None:
+        for _ in range(8):
+            if not pool:
+                return None
+            index = rng.randrange(len(pool))
+            if pool[index] in excluded:
+                continue
+            pool[index], pool[-1] = pool[-1], pool[index]
+            return pool.pop()
+        return None
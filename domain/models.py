@@ -1,4 +1,7 @@
 from __future__ import annotations
+import sys
+from datetime import datetime
+from itertools import islice
 from typing import Any
 from enum import Enum
 
@@ -23,6 +26,32 @@ class ResvStatus(str, Enum):
     PICKED_UP = "PICKED_UP"
     EXPIRED = "EXPIRED"
 
+# reservations store the index of their status, a small int shared by every instance
+RESV_STATUSES = tuple(ResvStatus)
+RESV_STATUS_CODES = {status: code for code, status in enumerate(RESV_STATUSES)}
+OPEN_RESV_STATUS_CODES = (RESV_STATUS_CODES[ResvStatus.CREATED], RESV_STATUS_CODES[ResvStatus.DEPOSITED])
+
+# states a compartment listing can be filtered by, a compartment can be in several at once
+class CompartmentFilter(str, Enum):
+    DEGRADED = "degraded"
+    FAULTED = "faulted"
+    FREE = "free" # can take a new reservation: never reserved and not degraded
+    RESERVED = "reserved" # holds a reservation that is not picked up or expired yet
+
+COMPARTMENT_FILTERS = tuple(CompartmentFilter)
+
+def compartment_filters(fault: bool, degraded: bool, status_code: int | None) -> list[CompartmentFilter]:
+    filters = []
+    if degraded:
+        filters.append(CompartmentFilter.DEGRADED)
+    if fault:
+        filters.append(CompartmentFilter.FAULTED)
+    if status_code is None and not degraded:
+        filters.append(CompartmentFilter.FREE)
+    if status_code in OPEN_RESV_STATUS_CODES:
+        filters.append(CompartmentFilter.RESERVED)
+    return filters
+
 class PayloadType(str, Enum):
     COMPARTMENT_ID = "compartment_id"
     RESERVATION_ID = "reservation_id"
@@ -30,34 +59,82 @@ class PayloadType(str, Enum):
     SEVERITY = "severity"
     REPORTED_EVENT_ID = "reported_event_id"
 
+# Domain objects use __slots__ and share one string object per locker and compartment id,
+# fleets keep millions of them in memory.
 class LockerEvent:
+    __slots__ = ("event_id", "occurred_at", "locker_id", "type", "payload")
+
     def __init__(self, event_id: str, occurred_at: str, locker_id: str, type: EventType, payload: dict[str, Any]):
         self.event_id = str(event_id)
         self.occurred_at = occurred_at
-        self.locker_id = locker_id
+        self.locker_id = sys.intern(locker_id) if isinstance(locker_id, str) else locker_id
         self.type = type
         self.payload = payload
 
+# projection state covering every event before `position` in the event store
+class Snapshot:
+    def __init__(self, position: int, last_event_id: str | None, state: dict):
+        self.position = position
+        self.last_event_id = last_event_id
+        self.state = state
+
+# a snapshot read one locker at a time while events keep being applied, see Projection.begin_snapshot
+class SnapshotCapture:
+    def __init__(self, hash_mode: str, locker_ids: list[str], open_faults: list[list[str]]):
+        self.hash_mode = hash_mode
+        self.locker_ids = locker_ids # the lockers that existed at begin_snapshot
+        self.open_faults = open_faults
+        # snapshot rows of the lockers changed since begin_snapshot, as they were before the change
+        self.preserved: dict[str, dict] = {}
+        # set when a rebuild or a hash mode change replaced the state being captured
+        self.cancelled = False
+
 # Aggregate Root
 class Locker:
+    __slots__ = ("locker_id", "num_compartment", "num_reservation", "num_degraded", "state_hash", "_compartments",
+                 "_free")
+
     def __init__(self, locker_id: str):
-        self.locker_id = locker_id
+        self.locker_id = sys.intern(locker_id)
         self.num_compartment: int = 0
         self.num_reservation: int = 0
         self.num_degraded: int = 0
         self.state_hash: str = ""
         self._compartments: dict[str, Compartment] = {}  # {"compartment_id", Compartment}
+        # compartments that can take a new reservation (no reservation, not degraded), as an ordered set
+        self._free: dict[str, None] = {}
 
     def get_compartment(self, compartment_id: str) -> Compartment | None:
         return self._compartments.get(compartment_id)
 
+    def get_compartment_ids(self) -> list[str]:
+        return list(self._compartments)
+
+    # the first `count` free compartments, longest free first; copied in one call so a
+    # concurrent event of this locker cannot interrupt the iteration
+    def get_free_compartment_ids(self, count: int | None = None) -> list[str]:
+        return list(islice(self._free, count))
+
+    @property
+    def num_free(self) -> int:
+        return len(self._free)
+
+    # re-derive the compartment's place in the free set, also after its fields were set directly
+    def refresh_free(self, compartment_id: str) -> None:
+        compartment = self._compartments[compartment_id]
+        if compartment.reservation is None and not compartment.degraded:
+            self._free.setdefault(compartment.compartment_id)
+        else:
+            self._free.pop(compartment_id, None)
+
     def add_compartment(self, compartment_id: str) -> int:
         # compartment already exists
         if compartment_id in self._compartments:
             return EventResult.DOMAIN_VIOLATION
 
         compartment = Compartment(compartment_id)
-        self._compartments[compartment_id] = compartment
+        self._compartments[compartment.compartment_id] = compartment
+        self._free[compartment.compartment_id] = None
         self.num_compartment += 1
         return EventResult.SUCCESS
 
@@ -72,6 +149,7 @@ class Locker:
         if severity >= 3:
             compartment.degraded = True
             self.num_degraded += 1
+            self.refresh_free(compartment_id)
         return EventResult.SUCCESS
 
     def clear_fault_compartment(self, compartment_id: str) -> int:
@@ -82,6 +160,7 @@ class Locker:
         compartment = self._compartments[compartment_id]
         compartment.fault = False        
         compartment.degraded = False
+        self.refresh_free(compartment_id)
         return EventResult.SUCCESS
 
     def get_reservation(self, compartment_id: str) -> Reservation | None:
@@ -91,7 +170,12 @@ class Locker:
         compartment = self._compartments[compartment_id]
         return compartment.reservation
 
-    def add_reservation(self, compartment_id: str, reservation_id: str) -> int:
+    # a reservation that can still change, i.e. not picked up or expired yet
+    def has_open_reservation(self) -> bool:
+        return any(compartment.reservation and compartment.reservation.status_code in OPEN_RESV_STATUS_CODES
+                   for compartment in self._compartments.values())
+
+    def add_reservation(self, compartment_id: str, reservation_id: str, created_at: float | None = None) -> int:
         # reservation can only exist for an existing compartment
         if compartment_id not in self._compartments:
             return EventResult.DOMAIN_VIOLATION
@@ -105,9 +189,10 @@ class Locker:
         if compartment.degraded:
             return EventResult.DOMAIN_VIOLATION
 
-        reservation = Reservation(reservation_id)
+        reservation = Reservation(reservation_id, created_at)
         compartment.reservation = reservation
         self.num_reservation += 1
+        self.refresh_free(compartment_id)
         return EventResult.SUCCESS
 
     def deposite_parcel(self, compartment_id: str, reservation_id: str) -> int:
@@ -145,6 +230,8 @@ class Locker:
                 return EventResult.DOMAIN_VIOLATION
 
         compartment.reservation.status = status
+        # a picked up or expired reservation stays on its compartment, so it does not become free
+        self.refresh_free(compartment_id)
         return EventResult.SUCCESS
     
     def get_locker_dict(self) -> dict:
@@ -169,14 +256,50 @@ class Locker:
         }
         return locker_dict
 
+# a locker's counters and state_hash without its compartments, for summary reads
+class LockerCounts:
+    __slots__ = ("locker_id", "num_compartment", "num_reservation", "num_degraded", "state_hash")
+
+    def __init__(self, locker_id: str, num_compartment: int, num_reservation: int, num_degraded: int,
+                 state_hash: str):
+        self.locker_id = locker_id
+        self.num_compartment = num_compartment
+        self.num_reservation = num_reservation
+        self.num_degraded = num_degraded
+        self.state_hash = state_hash
+
 class Compartment:
+    __slots__ = ("compartment_id", "fault", "degraded", "reservation")
+
     def __init__(self, compartment_id: str):
-        self.compartment_id = compartment_id
+        self.compartment_id = sys.intern(compartment_id)
         self.fault: bool = False
         self.degraded: bool = False
         self.reservation: Reservation | None = None
 
+# reservation ids are unique, interning them would only grow the intern table
 class Reservation:
-    def __init__(self, reservation_id: str):
+    __slots__ = ("reservation_id", "status_code", "created_at")
+
+    def __init__(self, reservation_id: str, created_at: float | None = None):
         self.reservation_id = reservation_id
-        self.status: ResvStatus = ResvStatus.CREATED
+        self.status_code: int = RESV_STATUS_CODES[ResvStatus.CREATED]
+        # occurred_at of the ReservationCreated event in seconds since the epoch, None when it was not readable
+        self.created_at = created_at
+
+    @property
+    def status(self) -> ResvStatus:
+        return RESV_STATUSES[self.status_code]
+
+    @status.setter
+    def status(self, status: ResvStatus) -> None:
+        self.status_code = RESV_STATUS_CODES[status]
+
+# occurred_at is a datetime from the API and an ISO 8601 string when read back from a log;
+# naive values are taken as local time, like datetime.timestamp() does
+def to_timestamp(occurred_at: Any) -> float | None:
+    try:
+        moment = occurred_at if isinstance(occurred_at, datetime) else datetime.fromisoformat(str(occurred_at))
+        return moment.timestamp()
+    except (ValueError, OverflowError, OSError):
+        return None
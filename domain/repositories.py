@@ -1,22 +1,89 @@
 from abc import ABC, abstractmethod
-from domain.models import LockerEvent, Locker, Compartment, Reservation
+from collections.abc import Iterator
+from domain.models import (CompartmentFilter, LockerEvent, Locker, LockerCounts, Compartment, Reservation, Snapshot,
+                           SnapshotCapture)
 
 class EventStore(ABC):
     @abstractmethod
-    def load_all(self) -> list[LockerEvent]: ...
+    def load_all(self, from_position: int = 0) -> list[LockerEvent]: ...
     @abstractmethod
     def load_by_locker(self, locker_id: str) -> list[LockerEvent]: ...
     @abstractmethod
+    def iter_all(self, from_position: int | None = None) -> Iterator[LockerEvent]: ...
+    @abstractmethod
+    def iter_by_locker(self, locker_id: str) -> Iterator[LockerEvent]: ...
+    @abstractmethod
     def append(self, event: LockerEvent) -> int: ...
+    @abstractmethod
+    def append_batch(self, events: list[LockerEvent]) -> list[int]: ...
+    @abstractmethod
+    def contains(self, event_id: str) -> bool: ...
+    @abstractmethod
+    def get_position(self) -> int: ...
+    @abstractmethod
+    def load_checkpoint(self) -> Snapshot | None: ...
+    @abstractmethod
+    def compact(self, projection: "Projection") -> int: ...
+    # {"events": events accepted so far, including compacted ones, "bytes": size on disk}
+    @abstractmethod
+    def get_stats(self) -> dict[str, int]: ...
+
+class SnapshotStore(ABC):
+    @abstractmethod
+    def save(self, snapshot: Snapshot) -> None: ...
+    @abstractmethod
+    def load_all(self) -> Iterator[Snapshot]: ...
 
 class Projection(ABC):
     @abstractmethod
-    def rebuild(self, event_store: EventStore) -> int: ...
+    def rebuild(self, event_store: EventStore, snapshot_store: SnapshotStore | None = None) -> int: ...
+    @abstractmethod
+    def snapshot(self, locker_ids: set[str] | None = None) -> dict: ...
     @abstractmethod
-    def apply(self, event: LockerEvent, event_store: EventStore) -> int: ...
+    def restore(self, state: dict) -> None: ...
+    # copy-on-write snapshot: begin_snapshot is O(lockers) and runs while no event is applied,
+    # snapshot_locker then reads one locker at a time as of begin_snapshot while events keep being
+    # applied; the caller holds the locker's event lock around snapshot_locker
+    @abstractmethod
+    def begin_snapshot(self) -> SnapshotCapture: ...
+    @abstractmethod
+    def snapshot_locker(self, capture: SnapshotCapture, locker_id: str) -> dict: ...
+    # the snapshot state from the rows of capture.locker_ids
+    @abstractmethod
+    def end_snapshot(self, capture: SnapshotCapture, lockers: list[dict]) -> dict: ...
+    @abstractmethod
+    def apply(self, event: LockerEvent) -> int: ...
+    # put one locker back to what `event_store` holds, e.g. after applied events failed to reach the log;
+    # the caller keeps the locker's events out meanwhile
+    @abstractmethod
+    def reload_locker(self, locker_id: str, event_store: EventStore) -> None: ...
     @abstractmethod
     def query_locker(self, locker_id: str) -> Locker | None: ...
     @abstractmethod
     def query_compartment(self, locker_id: str, compartment_id: str) -> Compartment | None: ...
     @abstractmethod
-    def query_reservation(self, reservation_id: str) -> Reservation | None: ...
\ No newline at end of file
+    def query_reservation(self, reservation_id: str) -> Reservation | None: ...
+    # one entry per id, None for an unknown locker
+    @abstractmethod
+    def query_lockers(self, locker_ids: list[str]) -> list[Locker | None]: ...
+    # like query_lockers without the compartments, O(1) per locker
+    @abstractmethod
+    def query_locker_counts(self, locker_ids: list[str]) -> list[LockerCounts | None]: ...
+    # a page of the locker's compartments in `compartment_filter` (all when None) and the size of the
+    # whole listing, None for an unknown locker
+    @abstractmethod
+    def query_compartments(self, locker_id: str, compartment_filter: CompartmentFilter | None,
+                           offset: int, limit: int) -> tuple[list[Compartment], int] | None: ...
+    # up to `count` compartment ids that can take a new reservation and the number of free compartments,
+    # None for an unknown locker; O(count), it never looks at the other compartments
+    @abstractmethod
+    def query_free_compartments(self, locker_id: str, count: int) -> tuple[list[str], int] | None: ...
+    # (locker_id, compartment_id, reservation) of every reservation in the projection
+    @abstractmethod
+    def iter_reservations(self) -> Iterator[tuple[str, str, Reservation]]: ...
+    # the locker's current state_hash without building the locker, None for an unknown locker
+    @abstractmethod
+    def query_state_hash(self, locker_id: str) -> str | None: ...
+    # {"lockers": lockers, "reservations": reservations tracked by id}
+    @abstractmethod
+    def get_stats(self) -> dict[str, int]: ...
@@ -0,0 +1,563 @@
+import math, sys, threading, time
+from array import array
+from collections.abc import Iterator
+from itertools import islice
+from application.metrics import APPLY_SECONDS, STATE_HASH_SECONDS
+from application.profiling import record_span
+from domain.models import (EventResult, EventType, PayloadType, ResvStatus, LockerEvent, Locker, LockerCounts,
+                           Compartment, Reservation, RESV_STATUSES, RESV_STATUS_CODES, OPEN_RESV_STATUS_CODES,
+                           CompartmentFilter, compartment_filters, to_timestamp)
+from infrastructure.replay_projection import ReplayProjection
+from infrastructure.state_hash import (HASH_MODE_INCREMENTAL, HASH_MODE_LEGACY, HASH_MODES,
+                                       legacy_state_hash, compartment_digest, combine_digests,
+                                       incremental_state_hash)
+
+# Projection state held in parallel columns instead of one object per compartment and reservation:
+#   - lockers, compartments and reservations are numbered in the order they are first seen,
+#   - a compartment is a bit in the fault and degraded bitsets and a reservation slot,
+#   - a reservation is an id and a status code.
+# Queries build detached Locker/Compartment/Reservation objects from the columns.
+# Compartment digests are recomputed from the columns instead of being stored.
+
+NO_RESERVATION = -1
+STATUS_CREATED = RESV_STATUS_CODES[ResvStatus.CREATED]
+STATUS_DEPOSITED = RESV_STATUS_CODES[ResvStatus.DEPOSITED]
+STATUS_PICKED_UP = RESV_STATUS_CODES[ResvStatus.PICKED_UP]
+STATUS_EXPIRED = RESV_STATUS_CODES[ResvStatus.EXPIRED]
+
+class BitSet:
+    __slots__ = ("_bytes",)
+
+    def __init__(self):
+        self._bytes = bytearray()
+
+    def get(self, index: int) -> bool:
+        byte = index >> 3
+        return byte < len(self._bytes) and bool(self._bytes[byte] >> (index & 7) & 1)
+
+    def set(self, index: int, value: bool) -> None:
+        byte = index >> 3
+        if byte >= len(self._bytes):
+            self._bytes.extend(bytes(byte + 1 - len(self._bytes)))
+        if value:
+            self._bytes[byte] |= 1 << (index & 7)
+        else:
+            self._bytes[byte] &= ~(1 << (index & 7)) & 0xFF
+
+    def count(self) -> int:
+        return int.from_bytes(self._bytes, "little").bit_count()
+
+class ColumnarProjection(ReplayProjection):
+    def __init__(self, hash_mode: str = HASH_MODE_INCREMENTAL, rebuild_workers: int = 1):
+        super().__init__(hash_mode, rebuild_workers)
+        # columns are shared by all lockers, so apply and queries are serialized
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self) -> None:
+        with self._lock:
+            self._cancel_snapshot()
+            self._locker_index: dict[str, int] = {} # key = locker_id
+            self._locker_ids: list[str] = []
+            self._num_compartment = array("l")
+            self._num_reservation = array("l")
+            self._num_degraded = array("l")
+            self._state_hashes: list[str] = []
+            self._locker_digests: list[int] = [] # combined compartment digests
+            self._compartments: list[dict[str, int]] = [] # per locker, key = compartment_id, compartment number
+            # per locker, compartments that can take a new reservation as an ordered set, the same order as Locker
+            self._free: list[dict[str, None]] = []
+            self._fault = BitSet()
+            self._degraded = BitSet()
+            self._reservation_of = array("l") # per compartment, reservation number or NO_RESERVATION
+            self._reservation_index: dict[str, int] = {} # key = reservation_id
+            self._reservation_ids: list[str] = []
+            self._status = bytearray() # per reservation, index into RESV_STATUSES
+            self._created_at = array("d") # per reservation, seconds since the epoch or NaN when unknown
+            self._open_faults: set[tuple[str, str, str]] = set() # (locker_id, compartment_id, reported_event_id)
+            # compartment and reservation slots of removed lockers, see _remove_locker
+            self._retired_compartments = 0
+            self._retired_reservations = 0
+
+    def get_stats(self) -> dict[str, int]:
+        return {"lockers": len(self._locker_ids), "reservations": len(self._reservation_ids) - self._retired_reservations}
+
+    # fleet-wide counts computed over whole columns
+    def fleet_totals(self) -> dict:
+        with self._lock:
+            return {
+                    "lockers": len(self._locker_ids),
+                    "compartments": len(self._reservation_of) - self._retired_compartments,
+                    "faulty_compartments": self._fault.count(),
+                    "degraded_compartments": self._degraded.count(),
+                    "active_reservations": sum(self._status.count(code) for code in OPEN_RESV_STATUS_CODES)
+                }
+
+    def _snapshot_locker(self, locker_id: str) -> dict | None:
+        with self._lock:
+            locker = self._locker_index.get(locker_id)
+            if locker is None:
+                return None
+            compartments = []
+            for compartment_id, compartment in self._compartments[locker].items():
+                reservation = self._reservation_of[compartment]
+                compartments.append([
+                        compartment_id,
+                        self._fault.get(compartment),
+                        self._degraded.get(compartment),
+                        self._reservation_ids[reservation] if reservation != NO_RESERVATION else None,
+                        RESV_STATUSES[self._status[reservation]].value if reservation != NO_RESERVATION else None,
+                        self._created_at_of(reservation) if reservation != NO_RESERVATION else None
+                    ])
+            return {
+                    "locker_id": locker_id,
+                    "num_compartment": self._num_compartment[locker],
+                    "num_reservation": self._num_reservation[locker],
+                    "num_degraded": self._num_degraded[locker],
+                    "state_hash": self._state_hashes[locker],
+                    "compartments": compartments
+                }
+
+    def _snapshot_locker_ids(self) -> list[str]:
+        with self._lock:
+            return list(self._locker_ids)
+
+    def _snapshot_open_faults(self, locker_ids: set[str] | None = None) -> list[list[str]]:
+        with self._lock:
+            return [list(fault_key) for fault_key in self._open_faults
+                    if locker_ids is None or fault_key[0] in locker_ids]
+
+    def snapshot(self, locker_ids: set[str] | None = None) -> dict:
+        with self._lock:
+            return super().snapshot(locker_ids)
+
+    def restore(self, state: dict) -> None:
+        with self._lock:
+            self._clear()
+            for locker_data in state["lockers"]:
+                self._add_locker_row(locker_data)
+            self._open_faults.update(tuple(fault_key) for fault_key in state["open_faults"])
+
+            # digests are not stored, recomputing them also verifies the stored hashes
+            stored_hashes = list(self._state_hashes)
+            self.set_hash_mode(self.hash_mode)
+            if state["hash_mode"] == self.hash_mode:
+                for locker, locker_id in enumerate(self._locker_ids):
+                    if self._state_hashes[locker] != stored_hashes[locker]:
+                        raise ValueError(f"snapshot state_hash mismatch for locker {locker_id}")
+
+    def _add_locker_row(self, locker_data: dict) -> int:
+        locker = self._add_locker(locker_data["locker_id"])
+        # rows written before reservations kept created_at have five fields
+        for compartment_id, fault, degraded, reservation_id, status, *created_at in locker_data["compartments"]:
+            compartment = self._add_compartment(locker, compartment_id)
+            self._fault.set(compartment, fault)
+            self._degraded.set(compartment, degraded)
+            if reservation_id is not None:
+                self._add_reservation(compartment, reservation_id, RESV_STATUS_CODES[ResvStatus(status)],
+                                      created_at[0] if created_at else None)
+            self._refresh_free(locker, compartment_id, compartment)
+        self._num_compartment[locker] = locker_data["num_compartment"]
+        self._num_reservation[locker] = locker_data["num_reservation"]
+        self._num_degraded[locker] = locker_data["num_degraded"]
+        self._state_hashes[locker] = locker_data["state_hash"]
+        return locker
+
+    def _restore_locker(self, locker_data: dict, open_faults: list[list[str]]) -> None:
+        with self._lock:
+            locker = self._add_locker_row(locker_data)
+            self._open_faults.update(tuple(fault_key) for fault_key in open_faults)
+            self._rehash_locker(locker)
+
+    # The locker's row in the per-locker columns is taken by the last locker. Its compartment and reservation
+    # slots cannot be renumbered, they are retired until the next rebuild: cleared, unreachable from any id
+    # and left out of the counts.
+    def _remove_locker(self, locker_id: str) -> None:
+        with self._lock:
+            locker = self._locker_index.pop(locker_id, None)
+            if locker is None:
+                return
+            for compartment in self._compartments[locker].values():
+                self._fault.set(compartment, False)
+                self._degraded.set(compartment, False)
+                reservation = self._reservation_of[compartment]
+                if reservation != NO_RESERVATION:
+                    del self._reservation_index[self._reservation_ids[reservation]]
+                    # a retired reservation does not count as open
+                    self._status[reservation] = STATUS_EXPIRED
+                    self._reservation_of[compartment] = NO_RESERVATION
+                    self._retired_reservations += 1
+                self._retired_compartments += 1
+            columns = (self._locker_ids, self._num_compartment, self._num_reservation, self._num_degraded,
+                       self._state_hashes, self._locker_digests, self._compartments, self._free)
+            last = len(self._locker_ids) - 1
+            if locker != last:
+                self._locker_index[self._locker_ids[last]] = locker
+                for column in columns:
+                    column[locker] = column[last]
+            for column in columns:
+                column.pop()
+            self._open_faults.difference_update([fault_key for fault_key in self._open_faults
+                                                 if fault_key[0] == locker_id])
+
+    # the whole reload holds the lock, no query sees the locker while it is taken apart
+    def _reload_locker(self, locker_id: str, locker_data: dict | None, open_faults: list[list[str]],
+                       events: list[LockerEvent]) -> None:
+        with self._lock:
+            super()._reload_locker(locker_id, locker_data, open_faults, events)
+
+    def apply(self, event: LockerEvent) -> int:
+        start = time.perf_counter()
+        result = self._apply(event)
+        if self.record_metrics:
+            apply_seconds = time.perf_counter() - start
+            APPLY_SECONDS.observe(apply_seconds, getattr(event.type, "value", event.type), result.name)
+            record_span("apply", apply_seconds)
+        return result
+
+    def _apply(self, event: LockerEvent) -> int:
+        comp_id = event.payload.get(PayloadType.COMPARTMENT_ID)
+        # Compartment ID required
+        if not comp_id:
+            return EventResult.VALIDATION_ERROR
+
+        with self._lock:
+            if self._capture is not None:
+                self._preserve(event.locker_id)
+            locker = self._locker_index.get(event.locker_id)
+            compartment = self._compartments[locker].get(comp_id) if locker is not None else None
+            old_digest = 0
+            if compartment is not None and self.hash_mode == HASH_MODE_INCREMENTAL:
+                old_digest = self._compartment_digest(comp_id, compartment)
+
+            if event.type == EventType.COMPARTMENT_REGISTERED:
+                result = self._register_compartment(event, locker, compartment, comp_id)
+            elif event.type == EventType.RESERVATION_CREATED:
+                result = self._create_reservation(event, locker, compartment)
+            elif event.type == EventType.PARCEL_DEPOSITED:
+                result = self._update_reservation(event, locker, compartment, STATUS_DEPOSITED)
+            elif event.type == EventType.PARCEL_PICKED_UP:
+                result = self._update_reservation(event, locker, compartment, STATUS_PICKED_UP)
+            elif event.type == EventType.RESERVATION_EXPIRED:
+                result = self._update_reservation(event, locker, compartment, STATUS_EXPIRED)
+            elif event.type == EventType.FAULT_REPORTED:
+                result = self._report_fault(event, locker, compartment, comp_id)
+            elif event.type == EventType.FAULT_CLEARED:
+                result = self._clear_fault(event, locker, compartment, comp_id)
+            else:
+                result = EventResult.VALIDATION_ERROR
+            if result == EventResult.SUCCESS:
+                locker = self._locker_index[event.locker_id]
+                self._refresh_free(locker, comp_id, self._compartments[locker][comp_id])
+                hash_start = time.perf_counter()
+                self._update_state_hash(locker, comp_id, old_digest)
+                if self.record_metrics:
+                    hash_seconds = time.perf_counter() - hash_start
+                    STATE_HASH_SECONDS.observe(hash_seconds, self.hash_mode)
+                    record_span("hash", hash_seconds)
+            return result
+
+    def query_locker(self, locker_id: str) -> Locker | None:
+        with self._lock:
+            locker = self._locker_index.get(locker_id)
+            if locker is None:
+                return None
+            return self._build_locker(locker)
+
+    def query_compartment(self, locker_id: str, compartment_id: str) -> Compartment | None:
+        with self._lock:
+            locker = self._locker_index.get(locker_id)
+            if locker is None:
+                return None
+            compartment = self._compartments[locker].get(compartment_id)
+            if compartment is None:
+                return None
+            return self._build_compartment(compartment_id, compartment)
+
+    def query_reservation(self, reservation_id: str) -> Reservation | None:
+        with self._lock:
+            reservation = self._reservation_index.get(reservation_id)
+            if reservation is None:
+                return None
+            return self._build_reservation(reservation)
+
+    def query_lockers(self, locker_ids: list[str]) -> list[Locker | None]:
+        with self._lock:
+            return [self.query_locker(locker_id) for locker_id in locker_ids]
+
+    # read from the per-locker columns, no compartment is built
+    def query_locker_counts(self, locker_ids: list[str]) -> list[LockerCounts | None]:
+        counts = []
+        with self._lock:
+            for locker_id in locker_ids:
+                locker = self._locker_index.get(locker_id)
+                counts.append(None if locker is None else LockerCounts(
+                        locker_id, self._num_compartment[locker], self._num_reservation[locker],
+                        self._num_degraded[locker], self._state_hashes[locker]))
+        return counts
+
+    # besides the free set there is no secondary index: the filter reads the locker's bits and status
+    # codes, never other lockers
+    def query_compartments(self, locker_id: str, compartment_filter: CompartmentFilter | None,
+                           offset: int, limit: int) -> tuple[list[Compartment], int] | None:
+        with self._lock:
+            locker = self._locker_index.get(locker_id)
+            if locker is None:
+                return None
+            compartments = self._compartments[locker]
+            if compartment_filter == CompartmentFilter.FREE:
+                matches = [(compartment_id, compartments[compartment_id]) for compartment_id in self._free[locker]]
+            else:
+                matches = [(compartment_id, compartment) for compartment_id, compartment in compartments.items()
+                           if compartment_filter is None or compartment_filter in self._filters_of(compartment)]
+            page = [self._build_compartment(compartment_id, compartment)
+                    for compartment_id, compartment in matches[offset:offset + limit]]
+            return page, len(matches)
+
+    def _filters_of(self, compartment: int) -> list[CompartmentFilter]:
+        reservation = self._reservation_of[compartment]
+        return compartment_filters(self._fault.get(compartment), self._degraded.get(compartment),
+                                   self._status[reservation] if reservation != NO_RESERVATION else None)
+
+    def query_free_compartments(self, locker_id: str, count: int) -> tuple[list[str], int] | None:
+        with self._lock:
+            locker = self._locker_index.get(locker_id)
+            if locker is None:
+                return None
+            return list(islice(self._free[locker], count)), len(self._free[locker])
+
+    # built one locker at a time, the lock is not held while the caller consumes them
+    def iter_reservations(self) -> Iterator[tuple[str, str, Reservation]]:
+        for locker in range(len(self._locker_ids)):
+            with self._lock:
+                # a locker reload moves the last locker into a lower row
+                if locker >= len(self._locker_ids):
+                    return
+                locker_id = self._locker_ids[locker]
+                reservations = [(compartment_id, self._build_reservation(self._reservation_of[compartment]))
+                                for compartment_id, compartment in self._compartments[locker].items()
+                                if self._reservation_of[compartment] != NO_RESERVATION]
+            for compartment_id, reservation in reservations:
+                yield locker_id, compartment_id, reservation
+
+    def query_state_hash(self, locker_id: str) -> str | None:
+        with self._lock:
+            locker = self._locker_index.get(locker_id)
+            return self._state_hashes[locker] if locker is not None else None
+
+    def _register_compartment(self, event: LockerEvent, locker: int | None, compartment: int | None,
+                              comp_id: str) -> int:
+        # if a locker cannot be found, it is treated as a new locker and added
+        if locker is None:
+            locker = self._add_locker(event.locker_id)
+        # compartment already exists
+        if compartment is not None:
+            return EventResult.DOMAIN_VIOLATION
+        self._add_compartment(locker, comp_id)
+        self._num_compartment[locker] += 1
+        return EventResult.SUCCESS
+
+    def _create_reservation(self, event: LockerEvent, locker: int | None, compartment: int | None) -> int:
+        resv_id = event.payload.get(PayloadType.RESERVATION_ID)
+        # Reservation ID required
+        if not resv_id:
+            return EventResult.VALIDATION_ERROR
+        # Locker not found
+        if locker is None:
+            return EventResult.VALIDATION_ERROR
+        # Reservation ID duplicates
+        if resv_id in self._reservation_index:
+            return EventResult.VALIDATION_ERROR
+        # reservation can only exist for an existing compartment
+        if compartment is None:
+            return EventResult.DOMAIN_VIOLATION
+        # compartment can have at most one active reservation at a time
+        if self._reservation_of[compartment] != NO_RESERVATION:
+            return EventResult.DOMAIN_VIOLATION
+        # a degraded compartment cannot accept new reservations
+        if self._degraded.get(compartment):
+            return EventResult.DOMAIN_VIOLATION
+        self._add_reservation(compartment, resv_id, STATUS_CREATED, to_timestamp(event.occurred_at))
+        self._num_reservation[locker] += 1
+        return EventResult.SUCCESS
+
+    def _update_reservation(self, event: LockerEvent, locker: int | None, compartment: int | None,
+                            status: int) -> int:
+        resv_id = event.payload.get(PayloadType.RESERVATION_ID)
+        # Reservation ID required
+        if not resv_id:
+            return EventResult.VALIDATION_ERROR
+        # Locker not found
+        if locker is None:
+            return EventResult.VALIDATION_ERROR
+        # a reservation can only exist for an existing compartment
+        if compartment is None:
+            return EventResult.DOMAIN_VIOLATION
+        # reservation can only be updated for an existing reservation
+        reservation = self._reservation_of[compartment]
+        if reservation == NO_RESERVATION:
+            return EventResult.DOMAIN_VIOLATION
+        # reservation id does not match
+        if self._reservation_ids[reservation] != resv_id:
+            return EventResult.DOMAIN_VIOLATION
+        # parcel deposit is only valid after reservation creation and before pickup or expiration
+        if status == STATUS_DEPOSITED and self._status[reservation] in (STATUS_PICKED_UP, STATUS_EXPIRED):
+            return EventResult.DOMAIN_VIOLATION
+        # parcel pickup is only valid after deposit
+        if status == STATUS_PICKED_UP and self._status[reservation] != STATUS_DEPOSITED:
+            return EventResult.DOMAIN_VIOLATION
+        self._status[reservation] = status
+        return EventResult.SUCCESS
+
+    def _report_fault(self, event: LockerEvent, locker: int | None, compartment: int | None, comp_id: str) -> int:
+        severity = event.payload.get(PayloadType.SEVERITY)
+        # Severity required
+        if not severity:
+            return EventResult.VALIDATION_ERROR
+        # Locker not found
+        if locker is None:
+            return EventResult.VALIDATION_ERROR
+        # compartment not found
+        if compartment is None:
+            return EventResult.DOMAIN_VIOLATION
+        self._fault.set(compartment, True)
+        # a compartment with fault of severity ≥ 3 are degraded
+        if severity >= 3:
+            self._degraded.set(compartment, True)
+            self._num_degraded[locker] += 1
+        self._open_faults.add((event.locker_id, comp_id, str(event.event_id)))
+        return EventResult.SUCCESS
+
+    def _clear_fault(self, event: LockerEvent, locker: int | None, compartment: int | None, comp_id: str) -> int:
+        reported_event_id = event.payload.get(PayloadType.REPORTED_EVENT_ID)
+        # a `FaultCleared` event must reference a prior `FaultReported.event_id`
+        if not reported_event_id:
+            return EventResult.VALIDATION_ERROR
+        # Locker not found
+        if locker is None:
+            return EventResult.VALIDATION_ERROR
+        # the referenced fault must belong to the same compartment,
+        # clearing a non-existing or already-cleared fault is invalid
+        fault_key = (event.locker_id, comp_id, str(reported_event_id))
+        if fault_key not in self._open_faults:
+            return EventResult.VALIDATION_ERROR
+        # compartment not found
+        if compartment is None:
+            return EventResult.DOMAIN_VIOLATION
+        self._fault.set(compartment, False)
+        self._degraded.set(compartment, False)
+        self._open_faults.discard(fault_key)
+        return EventResult.SUCCESS
+
+    def _add_locker(self, locker_id: str) -> int:
+        locker = len(self._locker_ids)
+        locker_id = sys.intern(locker_id)
+        self._locker_index[locker_id] = locker
+        self._locker_ids.append(locker_id)
+        self._num_compartment.append(0)
+        self._num_reservation.append(0)
+        self._num_degraded.append(0)
+        self._state_hashes.append("")
+        self._locker_digests.append(0)
+        self._compartments.append({})
+        self._free.append({})
+        return locker
+
+    def _add_compartment(self, locker: int, compartment_id: str) -> int:
+        compartment = len(self._reservation_of)
+        self._compartments[locker][sys.intern(compartment_id)] = compartment
+        self._reservation_of.append(NO_RESERVATION)
+        return compartment
+
+    def _refresh_free(self, locker: int, compartment_id: str, compartment: int) -> None:
+        if self._reservation_of[compartment] == NO_RESERVATION and not self._degraded.get(compartment):
+            self._free[locker].setdefault(sys.intern(compartment_id))
+        else:
+            self._free[locker].pop(compartment_id, None)
+
+    def _add_reservation(self, compartment: int, reservation_id: str, status: int, created_at: float | None) -> None:
+        reservation = len(self._reservation_ids)
+        self._reservation_index[reservation_id] = reservation
+        self._reservation_ids.append(reservation_id)
+        self._status.append(status)
+        self._created_at.append(math.nan if created_at is None else created_at)
+        self._reservation_of[compartment] = reservation
+
+    def _created_at_of(self, reservation: int) -> float | None:
+        created_at = self._created_at[reservation]
+        return None if math.isnan(created_at) else created_at
+
+    def _build_reservation(self, reservation: int) -> Reservation:
+        built = Reservation(self._reservation_ids[reservation], self._created_at_of(reservation))
+        built.status_code = self._status[reservation]
+        return built
+
+    def _build_compartment(self, compartment_id: str, compartment: int) -> Compartment:
+        built = Compartment(compartment_id)
+        built.fault = self._fault.get(compartment)
+        built.degraded = self._degraded.get(compartment)
+        reservation = self._reservation_of[compartment]
+        if reservation != NO_RESERVATION:
+            built.reservation = self._build_reservation(reservation)
+        return built
+
+    def _build_locker(self, locker: int) -> Locker:
+        built = Locker(self._locker_ids[locker])
+        built.num_compartment = self._num_compartment[locker]
+        built.num_reservation = self._num_reservation[locker]
+        built.num_degraded = self._num_degraded[locker]
+        built.state_hash = self._state_hashes[locker]
+        for compartment_id, compartment in self._compartments[locker].items():
+            built._compartments[compartment_id] = self._build_compartment(compartment_id, compartment)
+        built._free = dict(self._free[locker])
+        return built
+
+    # recompute every state_hash in the given mode
+    def set_hash_mode(self, hash_mode: str) -> None:
+        if hash_mode not in HASH_MODES:
+            raise ValueError(f"unknown state hash mode: {hash_mode}")
+        with self._lock:
+            self._cancel_snapshot()
+            self.hash_mode = hash_mode
+            for locker in range(len(self._locker_ids)):
+                self._rehash_locker(locker)
+
+    def _rehash_locker(self, locker: int) -> None:
+        if self.hash_mode == HASH_MODE_LEGACY:
+            self._state_hashes[locker] = legacy_state_hash(self._build_locker(locker).get_locker_dict())
+            return
+        combined = 0
+        for compartment_id, compartment in self._compartments[locker].items():
+            combined = combine_digests(combined, 0, self._compartment_digest(compartment_id, compartment))
+        self._locker_digests[locker] = combined
+        self._update_locker_hash(locker)
+
+    def _update_state_hash(self, locker: int, comp_id: str, old_digest: int) -> None:
+        if self.hash_mode == HASH_MODE_LEGACY:
+            self._state_hashes[locker] = legacy_state_hash(self._build_locker(locker).get_locker_dict())
+            return
+
+        # every event type targets a single compartment, only that one is rehashed
+        compartment = self._compartments[locker][comp_id]
+        new_digest = self._compartment_digest(comp_id, compartment)
+        self._locker_digests[locker] = combine_digests(self._locker_digests[locker], old_digest, new_digest)
+        self._update_locker_hash(locker)
+
+    def _compartment_digest(self, compartment_id: str, compartment: int) -> int:
+        reservation = self._reservation_of[compartment]
+        return compartment_digest(
+                compartment_id,
+                self._fault.get(compartment),
+                self._degraded.get(compartment),
+                self._reservation_ids[reservation] if reservation != NO_RESERVATION else None,
+                RESV_STATUSES[self._status[reservation]] if reservation != NO_RESERVATION else None
+            )
+
+    def _update_locker_hash(self, locker: int) -> None:
+        self._state_hashes[locker] = incremental_state_hash(
+                self._locker_ids[locker],
+                self._num_compartment[locker],
+                self._num_reservation[locker],
+                self._num_degraded[locker],
+                self._locker_digests[locker]
+            )
@@ -0,0 +1,26 @@
+# Re-encode an event log with another codec into a new log, e.g. from JSON to binary:
+#   python -m infrastructure.convert_log events.jsonl events.bin --codec binary
+# Snapshots hold positions of the source log, start the API on the new log with an empty SNAPSHOT_DIR.
+import argparse
+from infrastructure.file_event_store import FileEventStore
+from infrastructure.log_codec import CODECS
+
+def convert_log(source_path: str, target_path: str, codec: str) -> int:
+    source = FileEventStore(source_path)
+    try:
+        return source.export(target_path, codec)
+    finally:
+        source.close()
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source")
+    parser.add_argument("target")
+    parser.add_argument("--codec", choices = CODECS, required = True)
+    args = parser.parse_args()
+
+    copied = convert_log(args.source, args.target, args.codec)
+    print(f"copied {copied} records from {args.source} to {args.target} ({args.codec})")
+
+if __name__ == "__main__":
+    main()
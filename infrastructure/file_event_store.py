@@ -1,52 +1,567 @@
-import json
+import json, mmap, os, threading, time
+from collections.abc import Iterator
 from pathlib import Path
-from domain.models import EventResult, LockerEvent
-from domain.repositories import EventStore
+from domain.models import EventResult, LockerEvent, Snapshot
+from domain.repositories import EventStore, Projection
+from application.metrics import APPEND_SECONDS, APPENDS_TOTAL
+from application.profiling import record_span
+from infrastructure.log_codec import CODEC_JSON, EventCodec, new_codec
+from infrastructure.log_writer import DURABILITY_ALWAYS, GroupCommitWriter, PendingWrite
+
+# The log is a list of segment files recorded in a manifest next to `file_path`. A position packs
+# the segment id and the byte offset inside that segment, so positions keep growing across
+# segments and an unsegmented log is segment 0 with its byte offsets unchanged.
+SEGMENT_BITS = 40
+
+def make_position(segment_id: int, offset: int) -> int:
+    return (segment_id << SEGMENT_BITS) | offset
+
+def split_position(position: int) -> tuple[int, int]:
+    return position >> SEGMENT_BITS, position & ((1 << SEGMENT_BITS) - 1)
 
 class FileEventStore(EventStore):
-    def __init__(self, file_path: str = "events.jsonl"):
+    def __init__(self, file_path: str = "events.jsonl",
+                 durability: str = DURABILITY_ALWAYS, sync_interval_ms: int = 50, sync_interval_events: int = 1000,
+                 segment_max_bytes: int = 64 << 20, codec: str | None = None):
         self.file_path = Path(file_path)
-        self.file_path.touch(exist_ok=True)
+        # a new segment is started once the active one would grow past this size
+        self.segment_max_bytes = segment_max_bytes
+        # {"generation": int, "codec": name, "segments": [[segment_id, file_name], ...], "checkpoint": file_name | None}
+        self.manifest_path = Path(str(self.file_path) + ".manifest")
+        self._lock = threading.RLock()
+        self._manifest = self._load_manifest()
+        self._segment_path(self._active_segment_id()).touch(exist_ok=True)
+        self._set_codec(codec)
+        # codec state of each segment after its last indexed record, key = segment_id
+        self._codecs: dict[int, EventCodec] = {}
+        # the active segment may hold a partial record after a failed write, the next append starts a new one
+        self._roll_pending = False
+        # sidecar next to the log, one JSON line [event_id, locker_id, position, end_position] per record
+        self.index_path = Path(str(self.file_path) + ".idx")
+        self._index_file = self.index_path.open("ab")
+        self._writer: GroupCommitWriter | None = None
+        self._event_ids: set[str] = set()
+        self._locker_offsets: dict[str, list[int]] = {} # key = locker_id, record positions in log order
+        self._indexed_position: int = 0
+        self._load_index()
+
+        # drop a partially written last record so new records start on a record boundary
+        active_path = self._segment_path(self._active_segment_id())
+        if active_path.stat().st_size > self._indexed_end_in_active():
+            with active_path.open("r+b") as f:
+                f.truncate(self._indexed_end_in_active())
+            self._codecs.pop(self._active_segment_id(), None)
+        # the writer keeps the active segment open and batches concurrent appends into group commits
+        self._writer = GroupCommitWriter(active_path, durability, sync_interval_ms, sync_interval_events)
+
+    @property
+    def codec(self) -> str:
+        return self._manifest["codec"]
+
+    def load_all(self, from_position: int = 0) -> list[LockerEvent]:
+        return list(self.iter_all(from_position))
 
-    def load_all(self) -> list[LockerEvent]:
-        events = self._load_event()
-        return events
-    
     def load_by_locker(self, locker_id: str) -> list[LockerEvent]:
-        events = self._load_event(locker_id)
-        return events
-    
+        return list(self.iter_by_locker(locker_id))
+
+    def iter_all(self, from_position: int | None = None) -> Iterator[LockerEvent]:
+        # only records complete when the iteration starts are read, a record being written is left alone
+        end_segment, end_offset = split_position(self.get_position())
+        start_segment, start_offset = split_position(from_position or 0)
+        for segment_id, path in self.get_segment_paths().items():
+            # segments before the start position are not opened at all
+            if segment_id < start_segment:
+                continue
+            if segment_id > end_segment:
+                break
+            offset = start_offset if segment_id == start_segment else 0
+            end = end_offset if segment_id == end_segment else path.stat().st_size
+            # a segment read from its start builds its codec state on the way, one read from the middle
+            # decodes with a copy, the shared codec is only used under the lock
+            if offset:
+                with self._lock:
+                    codec = self._segment_codec(segment_id).copy()
+            else:
+                codec = new_codec(self.codec)
+            for _, _, frame in codec.scan(self._map(path), offset, end):
+                event = codec.decode(frame)
+                if event is not None:
+                    yield event
+
+    def iter_by_locker(self, locker_id: str) -> Iterator[LockerEvent]:
+        # read under the lock, compaction rewrites the segments the positions point into
+        with self._lock:
+            self._sync_index()
+            positions = list(self._locker_offsets.get(locker_id, []))
+            # seek straight to the locker's records instead of parsing the whole log
+            codecs = {segment_id: self._segment_codec(segment_id) for segment_id, _ in self._manifest["segments"]}
+            events = [event for _, event in self.read_records(self.get_segment_paths(), positions, codecs)]
+        yield from events
+
+    # record positions of every locker, in log order
+    def get_locker_offsets(self) -> dict[str, list[int]]:
+        with self._lock:
+            self._sync_index()
+            return {locker_id: list(offsets) for locker_id, offsets in self._locker_offsets.items()}
+
+    # key = segment_id, in log order
+    def get_segment_paths(self) -> dict[int, Path]:
+        with self._lock:
+            return {segment_id: self.file_path.parent / file_name for segment_id, file_name in self._manifest["segments"]}
+
+    # codecs able to decode any indexed record of each segment, key = segment_id; copies the caller
+    # can decode with while records are appended
+    def get_segment_codecs(self) -> dict[int, EventCodec]:
+        with self._lock:
+            return {segment_id: self._segment_codec(segment_id).copy() for segment_id, _ in self._manifest["segments"]}
+
+    # (position, event) for the records starting at `positions`; a static method so worker
+    # processes can read a shard of the log without loading the index
+    @staticmethod
+    def read_records(segment_paths: dict[int, str | Path], positions: list[int],
+                     codecs: dict[int, EventCodec]) -> Iterator[tuple[int, LockerEvent]]:
+        data = None
+        current_segment = None
+        for position in positions:
+            segment_id, offset = split_position(position)
+            if segment_id != current_segment:
+                data = FileEventStore._map(segment_paths[segment_id])
+                current_segment = segment_id
+            # only the frames of the requested record are looked at
+            yield position, codecs[segment_id].read_record(data, offset)
+
     def append(self, event: LockerEvent) -> int:
-        for load_event in self.load_all():
+        start = time.perf_counter()
+        with self._lock:
+            self._sync_index()
             # event_id already exists
-            if event.event_id == load_event.event_id:
+            if event.event_id in self._event_ids:
+                dedup_seconds = time.perf_counter() - start
+                APPEND_SECONDS.observe(dedup_seconds, "dedup")
+                record_span("dedup", dedup_seconds)
+                APPENDS_TOTAL.inc(EventResult.DUPLICATE.name)
                 return EventResult.DUPLICATE
-        self._append_event(event)
+            written = time.perf_counter()
+            APPEND_SECONDS.observe(written - start, "dedup")
+            record_span("dedup", written - start)
+            pending = self._append_events([event])
+        # acknowledged once the writer's durability guarantee is met
+        self._wait(pending, [event])
+        write_seconds = time.perf_counter() - written
+        APPEND_SECONDS.observe(write_seconds, "write")
+        record_span("write", write_seconds)
+        APPENDS_TOTAL.inc(EventResult.SUCCESS.name)
         return EventResult.SUCCESS
 
-    def _load_event(self, locker_id: str | None = None) -> list[LockerEvent]:
-        events = []
-        with self.file_path.open("r", encoding="utf-8") as f:
-            for line in f:
-                if line.strip():
-                    data = json.loads(line)
-                    event = LockerEvent(
-                            data["event_id"],
-                            data["occurred_at"], 
-                            data["locker_id"], 
-                            data["type"],
-                            data["payload"]
-                        )
-                    if not locker_id or (locker_id and locker_id == data["locker_id"]):
-                        events.append(event)
-        return events 
-
-    def _append_event(self, event: LockerEvent) -> None:
-        with self.file_path.open("a", encoding="utf-8") as f:
-            f.write(json.dumps({
-                    "event_id": str(event.event_id),
-                    "occurred_at": str(event.occurred_at),
-                    "locker_id": event.locker_id,
-                    "type": event.type,
-                    "payload": event.payload
-                }) + "\n")
+    # one buffered write and one durability barrier for every accepted event of the batch
+    def append_batch(self, events: list[LockerEvent]) -> list[int]:
+        results = []
+        accepted = []
+        start = time.perf_counter()
+        with self._lock:
+            self._sync_index()
+            batch_ids = set()
+            for event in events:
+                # event_id already exists, in the log or earlier in the batch
+                if event.event_id in self._event_ids or event.event_id in batch_ids:
+                    results.append(EventResult.DUPLICATE)
+                    continue
+                batch_ids.add(event.event_id)
+                accepted.append(event)
+                results.append(EventResult.SUCCESS)
+            written = time.perf_counter()
+            APPEND_SECONDS.observe(written - start, "dedup")
+            record_span("dedup", written - start)
+            APPENDS_TOTAL.inc(EventResult.DUPLICATE.name, amount = len(events) - len(accepted))
+            if not accepted:
+                return results
+            pending = self._append_events(accepted)
+        self._wait(pending, accepted)
+        write_seconds = time.perf_counter() - written
+        APPEND_SECONDS.observe(write_seconds, "write")
+        record_span("write", write_seconds)
+        APPENDS_TOTAL.inc(EventResult.SUCCESS.name, amount = len(accepted))
+        return results
+
+    def contains(self, event_id: str) -> bool:
+        with self._lock:
+            self._sync_index()
+            return str(event_id) in self._event_ids
+
+    def get_stats(self) -> dict[str, int]:
+        with self._lock:
+            self._sync_index()
+            events = len(self._event_ids)
+            paths = list(self.get_segment_paths().values())
+        return {"events": events, "bytes": sum(path.stat().st_size for path in paths if path.exists())}
+
+    # position just past the last complete record
+    def get_position(self) -> int:
+        with self._lock:
+            self._sync_index()
+            return self._indexed_position
+
+    # projection state of the lockers folded by compaction, their records are no longer in the log
+    def load_checkpoint(self) -> Snapshot | None:
+        with self._lock:
+            checkpoint = self._read_checkpoint()
+        if not checkpoint:
+            return None
+        return Snapshot(checkpoint["position"], None, checkpoint["state"])
+
+    # Fold the closed segments: a locker whose records all lie in closed segments and whose
+    # reservations are all terminal moves into the checkpoint, and its records are dropped from
+    # the segments. `projection` must reflect exactly this log and no event may be appended or
+    # applied meanwhile. Returns the number of records dropped.
+    def compact(self, projection: Projection) -> int:
+        with self._lock:
+            self._sync_index()
+            active_id = self._active_segment_id()
+            boundary = make_position(active_id, 0)
+            checkpoint = self._read_checkpoint() or {"position": 0, "state": None, "event_ids": []}
+            checkpoint_state = checkpoint["state"] or {"lockers": [], "open_faults": []}
+
+            folded_lockers = set()
+            for locker_id in {entry["locker_id"] for entry in checkpoint_state["lockers"]} | set(self._locker_offsets):
+                positions = self._locker_offsets.get(locker_id)
+                if positions and positions[-1] >= boundary:
+                    continue
+                locker = projection.query_locker(locker_id)
+                if locker and not locker.has_open_reservation():
+                    folded_lockers.add(locker_id)
+            if not folded_lockers:
+                return 0
+
+            # rewrite the closed segments without the folded lockers' records
+            generation = self._manifest["generation"] + 1
+            folded_event_ids = list(checkpoint["event_ids"])
+            segments = []
+            for segment_id, file_name in self._manifest["segments"]:
+                if segment_id == active_id:
+                    segments.append([segment_id, file_name])
+                    continue
+                kept_name = f"{self.file_path.name}.{segment_id:06d}.g{generation}"
+                kept_records = 0
+                # records are re-encoded, a stateful codec starts the rewritten segment with a fresh state
+                reader, writer = new_codec(self.codec), new_codec(self.codec)
+                with (self.file_path.parent / kept_name).open("wb") as dst:
+                    for _, _, frame in reader.scan(self._map(self.file_path.parent / file_name)):
+                        event = reader.decode(frame)
+                        if event is None:
+                            continue
+                        if event.locker_id in folded_lockers:
+                            folded_event_ids.append(str(event.event_id))
+                            continue
+                        dst.write(writer.encode(event))
+                        kept_records += 1
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                # a segment left without records is dropped from the log
+                if kept_records:
+                    segments.append([segment_id, kept_name])
+                else:
+                    (self.file_path.parent / kept_name).unlink()
+
+            state = projection.snapshot(folded_lockers)
+            state["lockers"].extend(entry for entry in checkpoint_state["lockers"]
+                                    if entry["locker_id"] not in folded_lockers)
+            state["open_faults"].extend(fault_key for fault_key in checkpoint_state["open_faults"]
+                                        if fault_key[0] not in folded_lockers)
+            checkpoint_name = f"{self.file_path.name}.checkpoint.g{generation}"
+            self._write_atomic(self.file_path.parent / checkpoint_name, {
+                    "position": boundary,
+                    "state": state,
+                    "event_ids": folded_event_ids
+                })
+
+            # the sidecar positions become stale with the new manifest, it is emptied first so
+            # a crash in between leaves a sidecar that is rebuilt on the next start
+            self._index_file.truncate(0)
+            old_files = {file_name for _, file_name in self._manifest["segments"]}
+            if self._manifest["checkpoint"]:
+                old_files.add(self._manifest["checkpoint"])
+            self._manifest = {"generation": generation, "codec": self.codec, "segments": segments,
+                              "checkpoint": checkpoint_name}
+            # switching the manifest commits the compaction, older files are only removed afterwards
+            self._write_atomic(self.manifest_path, self._manifest)
+            live_files = {file_name for _, file_name in segments} | {checkpoint_name}
+            for file_name in old_files - live_files:
+                (self.file_path.parent / file_name).unlink(missing_ok=True)
+
+            self._rebuild_index()
+            return len(folded_event_ids) - len(checkpoint["event_ids"])
+
+    # write a copy of the log encoded with `codec` to `target_path`, returns the number of records copied
+    def export(self, target_path: str, codec: str) -> int:
+        target = Path(target_path)
+        manifest_path = Path(str(target) + ".manifest")
+        if manifest_path.exists() or (target.exists() and target.stat().st_size):
+            raise ValueError(f"{target} already holds a log")
+        # a sidecar left next to the target would not match the copy
+        Path(str(target) + ".idx").unlink(missing_ok=True)
+        copied = 0
+        with self._lock:
+            self._sync_index()
+            end_segment, end_offset = split_position(self._indexed_position)
+            segments = []
+            for segment_id, path in self.get_segment_paths().items():
+                name = target.name if segment_id == 0 else f"{target.name}.{segment_id:06d}"
+                reader, writer = new_codec(self.codec), new_codec(codec)
+                # only records complete when the export starts are copied
+                end = end_offset if segment_id == end_segment else (0 if segment_id > end_segment else None)
+                with (target.parent / name).open("wb") as dst:
+                    for _, _, frame in reader.scan(self._map(path), 0, end):
+                        event = reader.decode(frame)
+                        if event is not None:
+                            dst.write(writer.encode(event))
+                            copied += 1
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                segments.append([segment_id, name])
+
+            # segment ids are kept, so the checkpoint position stays valid in the copy
+            generation = self._manifest["generation"]
+            checkpoint = self._read_checkpoint()
+            checkpoint_name = None
+            if checkpoint:
+                checkpoint_name = f"{target.name}.checkpoint.g{generation}"
+                self._write_atomic(target.parent / checkpoint_name, checkpoint)
+            self._write_atomic(manifest_path, {"generation": generation, "codec": codec, "segments": segments,
+                                               "checkpoint": checkpoint_name})
+        return copied
+
+    def close(self) -> None:
+        if self._writer:
+            self._writer.close()
+        self._index_file.close()
+
+    # called with the lock held; event ids are claimed once the write is queued so concurrent duplicates
+    # are rejected, positions are indexed on the writer thread once the records reached the log
+    def _append_events(self, events: list[LockerEvent]) -> PendingWrite:
+        segment_id = self._active_segment_id()
+        records = self._encode_records(segment_id, events)
+
+        # roll over to a new segment, a record never spans two segments
+        new_path = None
+        size = sum(len(record) for record in records)
+        if self._roll_pending or (self._writer.end and self._writer.end + size > self.segment_max_bytes):
+            segment_id = self._add_segment()
+            new_path = self._segment_path(segment_id)
+            records = self._encode_records(segment_id, events)
+            self._roll_pending = False
+
+        def on_written(offset: int) -> None:
+            with self._lock:
+                entries = []
+                for event, record in zip(events, records):
+                    position = make_position(segment_id, offset)
+                    entries.append(self._index_record(str(event.event_id), event.locker_id, position, position + len(record)))
+                    offset += len(record)
+                self._write_index_entries(entries)
+
+        pending = self._writer.submit(b"".join(records), on_written, new_path)
+        for event in events:
+            self._event_ids.add(event.event_id)
+        return pending
+
+    def _encode_records(self, segment_id: int, events: list[LockerEvent]) -> list[bytes]:
+        codec = self._segment_codec(segment_id)
+        return [codec.encode(event) for event in events]
+
+    def _wait(self, pending: PendingWrite, events: list[LockerEvent]) -> None:
+        try:
+            pending.wait()
+        except BaseException:
+            # the records never reached the log, release their event ids
+            with self._lock:
+                for event in events:
+                    self._event_ids.discard(event.event_id)
+                # the codec state of the active segment may count records that were not written
+                self._roll_pending = True
+            raise
+
+    def _load_manifest(self) -> dict:
+        if self.manifest_path.exists():
+            manifest = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+            # manifests written before codecs were configurable hold JSON segments
+            manifest.setdefault("codec", CODEC_JSON)
+            return manifest
+        # a log without manifest is a single JSON segment
+        return {"generation": 0, "codec": CODEC_JSON, "segments": [[0, self.file_path.name]], "checkpoint": None}
+
+    # None keeps the codec of the log, an empty log takes the requested codec,
+    # an existing one must be converted first
+    def _set_codec(self, codec: str | None) -> None:
+        if codec is None or codec == self.codec:
+            return
+        new_codec(codec)
+        if self._manifest["checkpoint"] or any(path.stat().st_size for path in self.get_segment_paths().values()):
+            raise ValueError(f"{self.file_path} is encoded as {self.codec}, convert it with "
+                             f"python -m infrastructure.convert_log before opening it as {codec}")
+        self._manifest["codec"] = codec
+        self._write_atomic(self.manifest_path, self._manifest)
+
+    def _active_segment_id(self) -> int:
+        return self._manifest["segments"][-1][0]
+
+    def _segment_path(self, segment_id: int) -> Path:
+        for known_id, file_name in self._manifest["segments"]:
+            if known_id == segment_id:
+                return self.file_path.parent / file_name
+        raise KeyError(f"unknown segment {segment_id}")
+
+    # codec state of a segment, read from the segment the first time it is needed
+    def _segment_codec(self, segment_id: int) -> EventCodec:
+        codec = self._codecs.get(segment_id)
+        if codec is None:
+            codec = new_codec(self.codec)
+            if codec.stateful:
+                for _, _, frame in codec.scan(self._map(self._segment_path(segment_id))):
+                    codec.decode(frame)
+            self._codecs[segment_id] = codec
+        return codec
+
+    def _add_segment(self) -> int:
+        segment_id = self._active_segment_id() + 1
+        file_name = f"{self.file_path.name}.{segment_id:06d}"
+        (self.file_path.parent / file_name).touch(exist_ok=True)
+        self._manifest["segments"].append([segment_id, file_name])
+        try:
+            self._write_atomic(self.manifest_path, self._manifest)
+        except BaseException:
+            # the manifest on disk does not list the segment, so neither does the one in memory
+            self._manifest["segments"].pop()
+            raise
+        self._codecs[segment_id] = new_codec(self.codec)
+        return segment_id
+
+    # The segment mapped read-only up to its current size. Bytes appended later are not part of
+    # the mapping, so a record still being written is at most seen as a partial frame. The mapping
+    # is released with the last frame sliced from it.
+    @staticmethod
+    def _map(path: str | Path) -> mmap.mmap | bytes:
+        with Path(path).open("rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            # an empty file cannot be mapped
+            if not size:
+                return b""
+            return mmap.mmap(f.fileno(), size, access = mmap.ACCESS_READ)
+
+    def _read_checkpoint(self) -> dict | None:
+        if not self._manifest["checkpoint"]:
+            return None
+        return json.loads((self.file_path.parent / self._manifest["checkpoint"]).read_text(encoding="utf-8"))
+
+    @staticmethod
+    def _write_atomic(path: Path, content: dict) -> None:
+        tmp_path = path.with_name(path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            f.write(json.dumps(content))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _write_index_entries(self, entries: list[str]) -> None:
+        if entries:
+            self._index_file.write("".join(entries).encode("utf-8"))
+            self._index_file.flush()
+
+    def _index_record(self, event_id: str, locker_id: str, position: int, end: int) -> str:
+        self._event_ids.add(event_id)
+        self._locker_offsets.setdefault(locker_id, []).append(position)
+        self._indexed_position = end
+        return json.dumps([event_id, locker_id, position, end]) + "\n"
+
+    def _load_index(self) -> None:
+        # restore the dedup state from the sidecar, then validate it against the log
+        self._reset_index()
+        valid_bytes = 0
+        if self.index_path.exists():
+            with self.index_path.open("rb") as f:
+                for line in f:
+                    # a partially written entry ends the usable part of the sidecar
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        event_id, locker_id, position, end = json.loads(line)
+                    except ValueError:
+                        break
+                    self._index_record(event_id, locker_id, position, end)
+                    valid_bytes += len(line)
+            if valid_bytes != self.index_path.stat().st_size:
+                self._index_file.truncate(valid_bytes)
+
+        if not self._covers_log_prefix():
+            self._rebuild_index()
+        else:
+            self._sync_index()
+
+    def _reset_index(self) -> None:
+        self._event_ids.clear()
+        self._locker_offsets.clear()
+        self._indexed_position = 0
+        self._codecs.clear()
+        # event ids of folded records stay known, so retries of them are still duplicates
+        checkpoint = self._read_checkpoint()
+        if checkpoint:
+            self._event_ids.update(checkpoint["event_ids"])
+
+    def _covers_log_prefix(self) -> bool:
+        # the sidecar is only trusted if the log still ends a record where the sidecar stops
+        if self._indexed_position == 0:
+            return True
+        segment_id, offset = split_position(self._indexed_position)
+        try:
+            path = self._segment_path(segment_id)
+        except KeyError:
+            return False
+        if not path.exists() or offset == 0 or path.stat().st_size < offset:
+            return False
+        return new_codec(self.codec).ends_frame(self._map(path), offset)
+
+    def _rebuild_index(self) -> None:
+        self._reset_index()
+        self._index_file.truncate(0)
+        self._index_tail()
+
+    # end of the indexed records inside the active segment
+    def _indexed_end_in_active(self) -> int:
+        segment_id, offset = split_position(self._indexed_position)
+        return offset if segment_id == self._active_segment_id() else 0
+
+    def _sync_index(self) -> None:
+        # the active segment was truncated or rewritten behind our back,
+        # not supported while appends are in flight
+        indexed_end = self._indexed_end_in_active()
+        size = self._segment_path(self._active_segment_id()).stat().st_size
+        if size < indexed_end:
+            self._rebuild_index()
+            if self._writer:
+                self._writer.reposition()
+        # records appended by another writer, only checked while none of ours is in flight
+        elif size > indexed_end and (not self._writer or self._writer.end == indexed_end):
+            self._index_tail()
+            if self._writer:
+                self._writer.reposition()
+
+    def _index_tail(self) -> None:
+        entries = []
+        start_segment, start_offset = split_position(self._indexed_position)
+        for segment_id, path in self.get_segment_paths().items():
+            if segment_id < start_segment:
+                continue
+            offset = start_offset if segment_id == start_segment else 0
+            if not offset:
+                self._codecs[segment_id] = new_codec(self.codec)
+            codec = self._segment_codec(segment_id)
+            record_start = offset
+            # a partially written last record is skipped
+            for _, end, frame in codec.scan(self._map(path), offset):
+                event = codec.decode(frame)
+                if event is None:
+                    continue
+                entries.append(self._index_record(str(event.event_id), event.locker_id,
+                                                  make_position(segment_id, record_start),
+                                                  make_position(segment_id, end)))
+                record_start = end
+        self._write_index_entries(entries)
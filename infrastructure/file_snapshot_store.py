@@ -0,0 +1,47 @@
+import json, hashlib, os
+from collections.abc import Iterator
+from pathlib import Path
+from domain.models import Snapshot
+from domain.repositories import SnapshotStore
+
+class FileSnapshotStore(SnapshotStore):
+    def __init__(self, directory: str = "snapshots", keep: int = 3):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.keep = keep
+
+    def save(self, snapshot: Snapshot) -> None:
+        state_json = json.dumps(snapshot.state, sort_keys=True)
+        content = json.dumps({
+                "position": snapshot.position,
+                "last_event_id": snapshot.last_event_id,
+                "checksum": hashlib.sha256(state_json.encode()).hexdigest(),
+                "state": snapshot.state
+            }, sort_keys=True)
+        # write to a temporary file first so a crash never leaves a half-written snapshot
+        path = self.directory / f"snapshot-{snapshot.position:020d}.json"
+        tmp_path = path.with_suffix(".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        for old_path in self._snapshot_paths()[self.keep:]:
+            old_path.unlink(missing_ok=True)
+
+    # newest first and lazily, so older snapshots are only read when a newer one is rejected;
+    # snapshots that cannot be read or fail their checksum are skipped
+    def load_all(self) -> Iterator[Snapshot]:
+        for path in self._snapshot_paths():
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            state_json = json.dumps(data["state"], sort_keys=True)
+            if hashlib.sha256(state_json.encode()).hexdigest() != data["checksum"]:
+                continue
+            yield Snapshot(data["position"], data["last_event_id"], data["state"])
+
+    def _snapshot_paths(self) -> list[Path]:
+        return sorted(self.directory.glob("snapshot-*.json"), reverse=True)
@@ -1,22 +1,142 @@
-from domain.models import EventResult, EventType, PayloadType, LockerEvent, Locker, Compartment, Reservation
-from domain.repositories import EventStore, Projection
-import json, hashlib
-
-class InMemoryProjection(Projection):
-    def __init__(self):
+from domain.models import (EventResult, EventType, PayloadType, ResvStatus, LockerEvent, Locker, LockerCounts,
+                           Compartment, Reservation, CompartmentFilter, COMPARTMENT_FILTERS, compartment_filters,
+                           to_timestamp)
+import threading, time
+from collections.abc import Iterator
+from itertools import islice
+from application.metrics import APPLY_SECONDS, STATE_HASH_SECONDS
+from application.profiling import record_span
+from infrastructure.replay_projection import ReplayProjection
+from infrastructure.state_hash import (HASH_MODE_INCREMENTAL, HASH_MODE_LEGACY, HASH_MODES,
+                                       legacy_state_hash, compartment_digest, combine_digests,
+                                       incremental_state_hash)
+
+INDEXED_FILTERS = tuple(compartment_filter for compartment_filter in COMPARTMENT_FILTERS
+                        if compartment_filter != CompartmentFilter.FREE)
+
+class InMemoryProjection(ReplayProjection):
+    def __init__(self, hash_mode: str = HASH_MODE_INCREMENTAL, rebuild_workers: int = 1):
+        super().__init__(hash_mode, rebuild_workers)
         self._lockers: dict[str, Locker] = {} # key = locker_id
         self._reservations: dict[str, Reservation] = {} # key = reservation_id
-
-    def rebuild(self, event_store: EventStore) -> int:
+        # reservation ids are unique across lockers, the only check that is not scoped to one locker;
+        # reentrant, a locker reload holds it around the applies of its events
+        self._reservations_lock = threading.RLock()
+        self._open_faults: set[tuple[str, str, str]] = set() # (locker_id, compartment_id, reported_event_id)
+        self._compartment_digests: dict[tuple[str, str], int] = {} # key = (locker_id, compartment_id)
+        self._locker_digests: dict[str, int] = {} # key = locker_id, combined compartment digests
+        # secondary indexes for filtered listings: locker_id -> filter -> compartment ids in the order they
+        # entered the state (dicts as ordered sets), maintained by apply so a listing only reads its own set;
+        # free compartments are the Locker's own free set
+        self._compartment_index: dict[str, dict[CompartmentFilter, dict[str, None]]] = {}
+
+    # copy the state into plain lists so it can be serialized off the request path,
+    # limited to `locker_ids` when given
+    def _snapshot_locker(self, locker_id: str) -> dict | None:
+        locker = self._lockers.get(locker_id)
+        if locker is None:
+            return None
+        compartments = []
+        for compartment_id in locker.get_compartment_ids():
+            compartment = locker.get_compartment(compartment_id)
+            reservation = compartment.reservation
+            compartments.append([
+                    compartment_id,
+                    compartment.fault,
+                    compartment.degraded,
+                    reservation.reservation_id if reservation else None,
+                    reservation.status.value if reservation else None,
+                    reservation.created_at if reservation else None
+                ])
+        return {
+                "locker_id": locker.locker_id,
+                "num_compartment": locker.num_compartment,
+                "num_reservation": locker.num_reservation,
+                "num_degraded": locker.num_degraded,
+                "state_hash": locker.state_hash,
+                "compartments": compartments
+            }
+
+    def _snapshot_locker_ids(self) -> list[str]:
+        return list(self._lockers)
+
+    def _snapshot_open_faults(self, locker_ids: set[str] | None = None) -> list[list[str]]:
+        return [list(fault_key) for fault_key in self._open_faults if locker_ids is None or fault_key[0] in locker_ids]
+
+    def restore(self, state: dict) -> None:
+        self._clear()
+        for locker_data in state["lockers"]:
+            self._add_locker_row(locker_data)
+        self._open_faults.update(tuple(fault_key) for fault_key in state["open_faults"])
+
+        # digests are not stored, recomputing them also verifies the stored hashes
+        stored_hashes = {locker_id: locker.state_hash for locker_id, locker in self._lockers.items()}
+        self.set_hash_mode(self.hash_mode)
+        if state["hash_mode"] == self.hash_mode:
+            for locker_id, locker in self._lockers.items():
+                if locker.state_hash != stored_hashes[locker_id]:
+                    raise ValueError(f"snapshot state_hash mismatch for locker {locker_id}")
+
+    def _add_locker_row(self, locker_data: dict) -> Locker:
+        locker = Locker(locker_data["locker_id"])
+        # rows written before reservations kept created_at have five fields
+        for compartment_id, fault, degraded, reservation_id, status, *created_at in locker_data["compartments"]:
+            locker.add_compartment(compartment_id)
+            compartment = locker.get_compartment(compartment_id)
+            compartment.fault = fault
+            compartment.degraded = degraded
+            if reservation_id is not None:
+                compartment.reservation = Reservation(reservation_id, created_at[0] if created_at else None)
+                compartment.reservation.status = ResvStatus(status)
+                self._reservations[reservation_id] = compartment.reservation
+        locker.num_compartment = locker_data["num_compartment"]
+        locker.num_reservation = locker_data["num_reservation"]
+        locker.num_degraded = locker_data["num_degraded"]
+        locker.state_hash = locker_data["state_hash"]
+        self._lockers[locker.locker_id] = locker
+        for compartment_id in locker.get_compartment_ids():
+            locker.refresh_free(compartment_id)
+            self._index_compartment(locker, compartment_id)
+        return locker
+
+    def _restore_locker(self, locker_data: dict, open_faults: list[list[str]]) -> None:
+        locker = self._add_locker_row(locker_data)
+        self._open_faults.update(tuple(fault_key) for fault_key in open_faults)
+        self._rehash_locker(locker)
+
+    def _remove_locker(self, locker_id: str) -> None:
+        locker = self._lockers.pop(locker_id, None)
+        if locker is None:
+            return
+        for compartment_id in locker.get_compartment_ids():
+            reservation = locker.get_reservation(compartment_id)
+            if reservation is not None:
+                self._reservations.pop(reservation.reservation_id, None)
+            self._compartment_digests.pop((locker_id, compartment_id), None)
+        self._locker_digests.pop(locker_id, None)
+        self._compartment_index.pop(locker_id, None)
+        self._open_faults.difference_update([fault_key for fault_key in self._open_faults if fault_key[0] == locker_id])
+
+    # the reservation ids of the locker are not in the index while it is rebuilt, the lock keeps
+    # other lockers from taking them meanwhile
+    def _reload_locker(self, locker_id: str, locker_data: dict | None, open_faults: list[list[str]],
+                       events: list[LockerEvent]) -> None:
+        with self._reservations_lock:
+            super()._reload_locker(locker_id, locker_data, open_faults, events)
+
+    def _clear(self) -> None:
+        self._cancel_snapshot()
         self._lockers.clear()
         self._reservations.clear()
-        for event in event_store.load_all():
-            result = self.apply(event, event_store)
-            if result != EventResult.SUCCESS:
-                return result
-        return EventResult.SUCCESS
-
-    def apply(self, event: LockerEvent, event_store: EventStore) -> int:
+        self._open_faults.clear()
+        self._compartment_digests.clear()
+        self._locker_digests.clear()
+        self._compartment_index.clear()
+
+    def apply(self, event: LockerEvent) -> int:
+        start = time.perf_counter()
+        if self._capture is not None:
+            self._preserve(event.locker_id)
         if event.type == EventType.COMPARTMENT_REGISTERED:
             result = self._register_compartment(event)
         elif event.type == EventType.RESERVATION_CREATED:
@@ -30,9 +150,19 @@ class InMemoryProjection(Projection):
         elif event.type == EventType.FAULT_REPORTED:
             result = self._report_fault(event)
         elif event.type == EventType.FAULT_CLEARED:
-            result = self._clear_fault(event, event_store)
+            result = self._clear_fault(event)
         if result == EventResult.SUCCESS:
+            self._index_compartment(self._lockers[event.locker_id], event.payload[PayloadType.COMPARTMENT_ID])
+            hash_start = time.perf_counter()
             result = self._update_state_hash(event)
+            if self.record_metrics:
+                hash_seconds = time.perf_counter() - hash_start
+                STATE_HASH_SECONDS.observe(hash_seconds, self.hash_mode)
+                record_span("hash", hash_seconds)
+        if self.record_metrics:
+            apply_seconds = time.perf_counter() - start
+            APPLY_SECONDS.observe(apply_seconds, getattr(event.type, "value", event.type), result.name)
+            record_span("apply", apply_seconds)
         return result
 
     def query_locker(self, locker_id: str) -> Locker | None:
@@ -47,6 +177,56 @@ class InMemoryProjection(Projection):
     def query_reservation(self, reservation_id: str) -> Reservation | None:
         return self._reservations.get(reservation_id)
 
+    def query_lockers(self, locker_ids: list[str]) -> list[Locker | None]:
+        return [self._lockers.get(locker_id) for locker_id in locker_ids]
+
+    def query_locker_counts(self, locker_ids: list[str]) -> list[LockerCounts | None]:
+        counts = []
+        for locker_id in locker_ids:
+            locker = self._lockers.get(locker_id)
+            counts.append(None if locker is None else LockerCounts(
+                    locker.locker_id, locker.num_compartment, locker.num_reservation, locker.num_degraded,
+                    locker.state_hash))
+        return counts
+
+    def query_compartments(self, locker_id: str, compartment_filter: CompartmentFilter | None,
+                           offset: int, limit: int) -> tuple[list[Compartment], int] | None:
+        locker = self._lockers.get(locker_id)
+        if locker is None:
+            return None
+        if compartment_filter is None:
+            compartment_ids = locker.get_compartment_ids()
+        elif compartment_filter == CompartmentFilter.FREE:
+            compartment_ids = locker.get_free_compartment_ids()
+        else:
+            # copied in one step, the set may change while the locker takes events
+            index = self._compartment_index.get(locker_id)
+            compartment_ids = list(index[compartment_filter]) if index else []
+        page = [locker.get_compartment(compartment_id)
+                for compartment_id in islice(compartment_ids, offset, offset + limit)]
+        return page, len(compartment_ids)
+
+    def query_free_compartments(self, locker_id: str, count: int) -> tuple[list[str], int] | None:
+        locker = self._lockers.get(locker_id)
+        if locker is None:
+            return None
+        return locker.get_free_compartment_ids(count), locker.num_free
+
+    # (locker_id, compartment_id, reservation) of every reservation, e.g. to reschedule expiries after a rebuild
+    def iter_reservations(self) -> Iterator[tuple[str, str, Reservation]]:
+        for locker in list(self._lockers.values()):
+            for compartment_id in locker.get_compartment_ids():
+                reservation = locker.get_reservation(compartment_id)
+                if reservation is not None:
+                    yield locker.locker_id, compartment_id, reservation
+
+    def query_state_hash(self, locker_id: str) -> str | None:
+        locker = self._lockers.get(locker_id)
+        return locker.state_hash if locker else None
+
+    def get_stats(self) -> dict[str, int]:
+        return {"lockers": len(self._lockers), "reservations": len(self._reservations)}
+
     def _register_compartment(self, event: LockerEvent) -> int:
         comp_id = event.payload.get(PayloadType.COMPARTMENT_ID)
         # Compartment ID required
@@ -76,15 +256,16 @@ class InMemoryProjection(Projection):
         if not locker:
             return EventResult.VALIDATION_ERROR
 
-        # Reservation ID duplicates
-        if resv_id in self._reservations:
-            return EventResult.VALIDATION_ERROR
+        with self._reservations_lock:
+            # Reservation ID duplicates
+            if resv_id in self._reservations:
+                return EventResult.VALIDATION_ERROR
 
-        result = locker.add_reservation(comp_id, resv_id)
-        if result != EventResult.SUCCESS:
-            return result
+            result = locker.add_reservation(comp_id, resv_id, to_timestamp(event.occurred_at))
+            if result != EventResult.SUCCESS:
+                return result
 
-        self._reservations[resv_id] = locker.get_reservation(comp_id)
+            self._reservations[resv_id] = locker.get_reservation(comp_id)
         return EventResult.SUCCESS
 
     def _deposite_parcel(self, event: LockerEvent) -> int:
@@ -168,9 +349,12 @@ class InMemoryProjection(Projection):
         if not locker:
             return EventResult.VALIDATION_ERROR
         
-        return locker.report_fault_compartment(comp_id, severity)
+        result = locker.report_fault_compartment(comp_id, severity)
+        if result == EventResult.SUCCESS:
+            self._open_faults.add((event.locker_id, comp_id, str(event.event_id)))
+        return result
 
-    def _clear_fault(self, event: LockerEvent, event_store: EventStore) -> int:
+    def _clear_fault(self, event: LockerEvent) -> int:
         comp_id = event.payload.get(PayloadType.COMPARTMENT_ID)
         # Compartment ID required
         if not comp_id:
@@ -186,34 +370,95 @@ class InMemoryProjection(Projection):
         if not locker:
             return EventResult.VALIDATION_ERROR
 
-        events = event_store.load_by_locker(event.locker_id) 
-        is_reported = False
-        is_cleared = False
-        for e in events:
-            # the referenced fault must belong to the same compartment
-            if e.type == EventType.FAULT_REPORTED:
-                if (e.payload.get(PayloadType.COMPARTMENT_ID) == comp_id
-                    and e.event_id  == reported_event_id):
-                    is_reported = True
-            elif e.type == EventType.FAULT_CLEARED:
-                if (e.payload.get(PayloadType.COMPARTMENT_ID) == comp_id
-                    and e.payload.get(PayloadType.REPORTED_EVENT_ID) == reported_event_id):
-                    is_cleared = True
-
-        # # clearing a non-existing or already-cleared fault is invalid
-        if (not is_reported or is_cleared):
+        # the referenced fault must belong to the same compartment,
+        # clearing a non-existing or already-cleared fault is invalid
+        fault_key = (event.locker_id, comp_id, str(reported_event_id))
+        if fault_key not in self._open_faults:
             return EventResult.VALIDATION_ERROR
 
-        return locker.clear_fault_compartment(comp_id)
+        result = locker.clear_fault_compartment(comp_id)
+        if result == EventResult.SUCCESS:
+            self._open_faults.discard(fault_key)
+        return result
     
+    # recompute every state_hash in the given mode, e.g. to migrate a live projection
+    # between the legacy and incremental formats without replaying the event store
+    def set_hash_mode(self, hash_mode: str) -> None:
+        if hash_mode not in HASH_MODES:
+            raise ValueError(f"unknown state hash mode: {hash_mode}")
+        self._cancel_snapshot()
+        self.hash_mode = hash_mode
+        self._compartment_digests.clear()
+        self._locker_digests.clear()
+        for locker in self._lockers.values():
+            self._rehash_locker(locker)
+
+    # the locker's state_hash from scratch, its digests must not be stored yet
+    def _rehash_locker(self, locker: Locker) -> None:
+        if self.hash_mode == HASH_MODE_LEGACY:
+            locker.state_hash = legacy_state_hash(locker.get_locker_dict())
+            return
+        for compartment_id in locker.get_compartment_ids():
+            self._update_compartment_digest(locker, compartment_id)
+        self._update_locker_hash(locker)
+
     def _update_state_hash(self, event: LockerEvent) -> str:
         locker = self.query_locker(event.locker_id)
         # Locker not found
         if not locker:
             return EventResult.VALIDATION_ERROR
-        
-        locker_dict = locker.get_locker_dict()
-        state_json = json.dumps(locker_dict, sort_keys=True)
-        locker.state_hash = hashlib.sha256(state_json.encode()).hexdigest()
+
+        if self.hash_mode == HASH_MODE_LEGACY:
+            locker.state_hash = legacy_state_hash(locker.get_locker_dict())
+            return EventResult.SUCCESS
+
+        # every event type targets a single compartment, only that one is rehashed
+        self._update_compartment_digest(locker, event.payload.get(PayloadType.COMPARTMENT_ID))
+        self._update_locker_hash(locker)
         return EventResult.SUCCESS
 
+    # move the compartment between the filter sets after an event changed it
+    def _index_compartment(self, locker: Locker, compartment_id: str) -> None:
+        compartment = locker.get_compartment(compartment_id)
+        reservation = compartment.reservation
+        current = compartment_filters(compartment.fault, compartment.degraded,
+                                      reservation.status_code if reservation else None)
+        index = self._compartment_index.get(locker.locker_id)
+        if index is None:
+            index = self._compartment_index[locker.locker_id] = {compartment_filter: {} for compartment_filter in INDEXED_FILTERS}
+        for compartment_filter in INDEXED_FILTERS:
+            if compartment_filter in current:
+                # setdefault keeps the position of a compartment that stays in the set
+                index[compartment_filter].setdefault(compartment.compartment_id)
+            else:
+                index[compartment_filter].pop(compartment.compartment_id, None)
+
+    def _update_compartment_digest(self, locker: Locker, compartment_id: str) -> None:
+        compartment = locker.get_compartment(compartment_id)
+        # Compartment not found
+        if not compartment:
+            return
+
+        reservation = compartment.reservation
+        new_digest = compartment_digest(
+                compartment_id,
+                compartment.fault,
+                compartment.degraded,
+                reservation.reservation_id if reservation else None,
+                reservation.status if reservation else None
+            )
+        key = (locker.locker_id, compartment.compartment_id)
+        old_digest = self._compartment_digests.get(key, 0)
+        self._compartment_digests[key] = new_digest
+        combined = self._locker_digests.get(locker.locker_id, 0)
+        self._locker_digests[locker.locker_id] = combine_digests(combined, old_digest, new_digest)
+
+    def _update_locker_hash(self, locker: Locker) -> None:
+        locker.state_hash = incremental_state_hash(
+                locker.locker_id,
+                locker.num_compartment,
+                locker.num_reservation,
+                locker.num_degraded,
+                self._locker_digests.get(locker.locker_id, 0)
+            )
+
@@ -0,0 +1,326 @@
+import functools, json, struct, uuid
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from datetime import datetime, timedelta, timezone
+from mmap import mmap
+from domain.models import EventType, PayloadType, LockerEvent
+
+CODEC_JSON = "json"
+CODEC_BINARY = "binary"
+CODECS = (CODEC_JSON, CODEC_BINARY)
+
+# bytes, a memoryview or a mapped segment
+Buffer = bytes | memoryview | mmap
+
+# A segment is a sequence of frames. A record is the frames written for one event: the event
+# frame, preceded by the frames carrying codec state it needs (e.g. interned strings).
+class EventCodec(ABC):
+    name: str
+    # whether decoding a frame depends on earlier frames of the same segment
+    stateful: bool = False
+
+    # bytes of one record, the codec state is updated as if they were written
+    @abstractmethod
+    def encode(self, event: LockerEvent) -> bytes: ...
+    # end of the frame starting at `offset`, None if `data` does not hold all of it
+    @abstractmethod
+    def frame_end(self, data: Buffer, offset: int) -> int | None: ...
+    # None for frames that only carry codec state
+    @abstractmethod
+    def decode(self, frame: Buffer) -> LockerEvent | None: ...
+    # a codec with the same state for another reader, decoding updates the state of a stateful codec
+    def copy(self) -> "EventCodec":
+        return self
+
+    # whether a complete frame ends right before `offset`, when the format allows checking it
+    def ends_frame(self, data: Buffer, offset: int) -> bool:
+        return True
+
+    # (start, end, frame) of the complete frames of `data` between `position` and `end`; frames
+    # are memoryview slices of `data`, so scanning a mapped segment copies nothing
+    def scan(self, data: Buffer, position: int = 0, end: int | None = None) -> Iterator[tuple[int, int, memoryview]]:
+        end = len(data) if end is None else min(end, len(data))
+        view = memoryview(data)
+        while (frame_end := self.frame_end(data, position)) is not None and frame_end <= end:
+            yield position, frame_end, view[position:frame_end]
+            position = frame_end
+
+    # the event of the record starting at `position`
+    def read_record(self, data: Buffer, position: int) -> LockerEvent:
+        for _, _, frame in self.scan(data, position):
+            event = self.decode(frame)
+            if event is not None:
+                return event
+        raise ValueError(f"incomplete record at {position}")
+
+def new_codec(name: str) -> EventCodec:
+    if name == CODEC_JSON:
+        return JsonCodec()
+    if name == CODEC_BINARY:
+        return BinaryCodec()
+    raise ValueError(f"unknown log codec: {name}")
+
+# one JSON object per line, the original format of events.jsonl
+class JsonCodec(EventCodec):
+    name = CODEC_JSON
+
+    def encode(self, event: LockerEvent) -> bytes:
+        return (json.dumps({
+                "event_id": str(event.event_id),
+                "occurred_at": str(event.occurred_at),
+                "locker_id": event.locker_id,
+                "type": event.type,
+                "payload": event.payload
+            }) + "\n").encode("utf-8")
+
+    def frame_end(self, data: Buffer, offset: int) -> int | None:
+        end = data.find(b"\n", offset)
+        return end + 1 if end >= 0 else None
+
+    def decode(self, frame: Buffer) -> LockerEvent | None:
+        # json.loads needs bytes, the one copy of a record made on the read path
+        line = bytes(frame)
+        # blank lines are skipped
+        if not line.strip():
+            return None
+        data = json.loads(line)
+        return LockerEvent(
+                data["event_id"],
+                data["occurred_at"],
+                data["locker_id"],
+                data["type"],
+                data["payload"]
+            )
+
+    def ends_frame(self, data: Buffer, offset: int) -> bool:
+        return data[offset - 1:offset] == b"\n"
+
+# Length-prefixed frames: <u32 body length><body>. A string frame defines the next entry of the
+# segment's string table, an event frame refers to locker ids, payload keys and payload strings
+# by their table index. Event ids, timestamps and payloads that do not fit the packed layout are
+# stored as text, so any event the JSON codec accepts round-trips unchanged.
+FRAME_LENGTH = struct.Struct("<I")
+STRING_HEADER = struct.Struct("<BI") # kind, table index
+# kind, flags, event_id, occurred_at in microseconds since the epoch, UTC offset in minutes,
+# event type, locker_id, payload entries
+EVENT_HEADER = struct.Struct("<BB16sqhBIB")
+PAYLOAD_ENTRY = struct.Struct("<IBq") # key, value tag, value
+TEXT_LENGTH = struct.Struct("<I")
+
+@functools.cache
+def payload_struct(count: int) -> struct.Struct:
+    return struct.Struct("<" + "IBq" * count)
+
+KIND_STRING = 0
+KIND_EVENT = 1
+
+FLAG_UUID = 1 # event_id is a canonical UUID packed into 16 bytes
+FLAG_TIME = 2 # occurred_at is packed
+FLAG_TIME_ISO = 4 # packed occurred_at is formatted with isoformat() instead of str()
+FLAG_PAYLOAD_JSON = 8 # payload is stored as JSON text
+
+TAG_STRING = 0
+TAG_INT = 1
+
+NAIVE_TIME = -32768 # UTC offset of a timestamp without time zone
+EPOCH = datetime(1970, 1, 1)
+EPOCH_UTC = datetime(1970, 1, 1, tzinfo = timezone.utc)
+INT64_RANGE = range(-(1 << 63), 1 << 63)
+
+EVENT_TYPES = list(EventType)
+EVENT_TYPE_INDEX = {event_type.value: index for index, event_type in enumerate(EVENT_TYPES)}
+UNKNOWN_TYPE = 0xFF
+
+class BinaryCodec(EventCodec):
+    name = CODEC_BINARY
+    stateful = True
+
+    def __init__(self):
+        self._strings: list[str] = []
+        self._string_ids: dict[str, int] = {}
+        self._time_key: tuple[int, int, int] | None = None
+        self._time_parts: tuple[str, str] = ("", "")
+
+    def copy(self) -> "BinaryCodec":
+        codec = BinaryCodec()
+        codec._strings = list(self._strings)
+        codec._string_ids = dict(self._string_ids)
+        return codec
+
+    def encode(self, event: LockerEvent) -> bytes:
+        frames = []
+        flags = 0
+        event_id = str(event.event_id)
+        event_id_bytes, tail = self._pack_uuid(event_id), []
+        if event_id_bytes:
+            flags |= FLAG_UUID
+        else:
+            event_id_bytes = bytes(16)
+            tail.append(self._text(event_id))
+
+        occurred_at = str(event.occurred_at)
+        micros, utc_offset, iso = self._pack_time(occurred_at)
+        if micros is not None:
+            flags |= FLAG_TIME | (FLAG_TIME_ISO if iso else 0)
+        else:
+            micros, utc_offset = 0, NAIVE_TIME
+            tail.append(self._text(occurred_at))
+
+        event_type = event.type.value if isinstance(event.type, EventType) else str(event.type)
+        type_index = EVENT_TYPE_INDEX.get(event_type, UNKNOWN_TYPE)
+        if type_index == UNKNOWN_TYPE:
+            tail.append(self._text(event_type))
+
+        entries = self._pack_payload(event.payload, frames)
+        if entries is None:
+            flags |= FLAG_PAYLOAD_JSON
+            tail.append(self._text(json.dumps(event.payload)))
+            entries = []
+
+        body = b"".join([
+                EVENT_HEADER.pack(KIND_EVENT, flags, event_id_bytes, micros, utc_offset, type_index,
+                                  self._intern(event.locker_id, frames), len(entries)),
+                *entries,
+                *tail
+            ])
+        frames.append(FRAME_LENGTH.pack(len(body)) + body)
+        return b"".join(frames)
+
+    def frame_end(self, data: Buffer, offset: int) -> int | None:
+        if len(data) - offset < FRAME_LENGTH.size:
+            return None
+        end = offset + FRAME_LENGTH.size + FRAME_LENGTH.unpack_from(data, offset)[0]
+        return end if end <= len(data) else None
+
+    def decode(self, frame: Buffer) -> LockerEvent | None:
+        if frame[FRAME_LENGTH.size] == KIND_STRING:
+            _, index = STRING_HEADER.unpack_from(frame, FRAME_LENGTH.size)
+            self._define(index, str(frame[FRAME_LENGTH.size + STRING_HEADER.size:], "utf-8"))
+            return None
+
+        _, flags, event_id, micros, utc_offset, type_index, locker_ref, count = \
+            EVENT_HEADER.unpack_from(frame, FRAME_LENGTH.size)
+        offset = FRAME_LENGTH.size + EVENT_HEADER.size
+        strings = self._strings
+        payload = {}
+        if count:
+            entries = payload_struct(count)
+            fields = entries.unpack_from(frame, offset)
+            offset += entries.size
+            for index in range(0, len(fields), 3):
+                key_ref, tag, value = fields[index:index + 3]
+                payload[strings[key_ref]] = strings[value] if tag == TAG_STRING else value
+
+        if flags & FLAG_UUID:
+            h = event_id.hex()
+            event_id = f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+        else:
+            event_id, offset = self._read_text(frame, offset)
+        if flags & FLAG_TIME:
+            occurred_at = self._decode_time(micros, utc_offset, flags & FLAG_TIME_ISO)
+        else:
+            occurred_at, offset = self._read_text(frame, offset)
+        if type_index == UNKNOWN_TYPE:
+            event_type, offset = self._read_text(frame, offset)
+        else:
+            event_type = EVENT_TYPES[type_index].value
+        if flags & FLAG_PAYLOAD_JSON:
+            payload_json, offset = self._read_text(frame, offset)
+            payload = json.loads(payload_json)
+        return LockerEvent(event_id, occurred_at, strings[locker_ref], event_type, payload)
+
+    # index of `value` in the string table, defining it with a frame appended to `frames` if new
+    def _intern(self, value: str, frames: list[bytes]) -> int:
+        index = self._string_ids.get(value)
+        if index is None:
+            index = len(self._strings)
+            body = STRING_HEADER.pack(KIND_STRING, index) + value.encode("utf-8")
+            frames.append(FRAME_LENGTH.pack(len(body)) + body)
+            self._define(index, value)
+        return index
+
+    # frames may be decoded more than once, a known index is left as it is
+    def _define(self, index: int, value: str) -> None:
+        if index < len(self._strings):
+            return
+        if index > len(self._strings):
+            raise ValueError(f"string {index} defined before string {len(self._strings)}")
+        self._strings.append(value)
+        self._string_ids[value] = index
+
+    # None when the payload needs the JSON fallback
+    def _pack_payload(self, payload: dict, frames: list[bytes]) -> list[bytes] | None:
+        if len(payload) > 0xFF:
+            return None
+        entries = []
+        for key, value in payload.items():
+            if not isinstance(key, str):
+                return None
+            if isinstance(value, str):
+                tag = TAG_STRING
+            elif isinstance(value, int) and not isinstance(value, bool) and value in INT64_RANGE:
+                tag = TAG_INT
+            else:
+                return None
+            key = key.value if isinstance(key, PayloadType) else key
+            entries.append((key, tag, value))
+        return [PAYLOAD_ENTRY.pack(self._intern(key, frames), tag,
+                                   self._intern(value, frames) if tag == TAG_STRING else value)
+                for key, tag, value in entries]
+
+    @staticmethod
+    def _pack_uuid(event_id: str) -> bytes | None:
+        try:
+            packed = uuid.UUID(event_id)
+        except ValueError:
+            return None
+        # only the canonical form can be restored from the 16 bytes
+        return packed.bytes if str(packed) == event_id else None
+
+    @staticmethod
+    def _pack_time(occurred_at: str) -> tuple[int | None, int, bool]:
+        try:
+            moment = datetime.fromisoformat(occurred_at)
+        except ValueError:
+            return None, NAIVE_TIME, False
+        utc_offset = moment.utcoffset()
+        if utc_offset is None:
+            micros, offset_minutes = (moment - EPOCH) // timedelta(microseconds = 1), NAIVE_TIME
+        else:
+            micros, offset_minutes = (moment - EPOCH_UTC) // timedelta(microseconds = 1), utc_offset // timedelta(minutes = 1)
+        # only pack timestamps that format back to exactly the same text
+        for iso in (True, False):
+            if micros in INT64_RANGE and BinaryCodec._format_time(micros, offset_minutes, iso) == occurred_at:
+                return micros, offset_minutes, iso
+        return None, NAIVE_TIME, False
+
+    # consecutive events mostly fall into the same second, only their fraction is formatted
+    def _decode_time(self, micros: int, offset_minutes: int, iso: int) -> str:
+        seconds, fraction = divmod(micros, 1_000_000)
+        key = (seconds, offset_minutes, iso)
+        if key != self._time_key:
+            text = self._format_time(seconds * 1_000_000, offset_minutes, iso)
+            # the UTC offset follows the fraction
+            split = len(text) if offset_minutes == NAIVE_TIME else len(text) - 6
+            self._time_key, self._time_parts = key, (text[:split], text[split:])
+        prefix, suffix = self._time_parts
+        return f"{prefix}.{fraction:06d}{suffix}" if fraction else prefix + suffix
+
+    @staticmethod
+    def _format_time(micros: int, offset_minutes: int, iso: bool) -> str:
+        if offset_minutes == NAIVE_TIME:
+            moment = EPOCH + timedelta(microseconds = micros)
+        else:
+            moment = (EPOCH_UTC + timedelta(microseconds = micros)).astimezone(timezone(timedelta(minutes = offset_minutes)))
+        return moment.isoformat() if iso else str(moment)
+
+    @staticmethod
+    def _text(value: str) -> bytes:
+        data = value.encode("utf-8")
+        return TEXT_LENGTH.pack(len(data)) + data
+
+    @staticmethod
+    def _read_text(frame: Buffer, offset: int) -> tuple[str, int]:
+        length = TEXT_LENGTH.unpack_from(frame, offset)[0]
+        offset += TEXT_LENGTH.size
+        return str(frame[offset:offset + length], "utf-8"), offset + length
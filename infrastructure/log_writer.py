@@ -0,0 +1,178 @@
+import os, threading, time
+from collections.abc import Callable
+from pathlib import Path
+
+# always: fsync before a write is acknowledged
+# interval: acknowledge once written to the OS, fsync every `interval_ms` or `interval_events`
+# none: acknowledge once written to the OS, never fsync
+DURABILITY_ALWAYS = "always"
+DURABILITY_INTERVAL = "interval"
+DURABILITY_NONE = "none"
+DURABILITY_MODES = (DURABILITY_ALWAYS, DURABILITY_INTERVAL, DURABILITY_NONE)
+
+class PendingWrite:
+    def __init__(self, data: bytes, offset: int, on_written: Callable[[int], None] | None,
+                 new_path: Path | None = None):
+        self.data = data
+        self.offset = offset
+        self.on_written = on_written
+        self.new_path = new_path # switch to this file before writing `data`
+        self.error: BaseException | None = None
+        self._done = threading.Event()
+
+    # block until the write meets the writer's durability guarantee
+    def wait(self) -> int:
+        self._done.wait()
+        if self.error:
+            raise self.error
+        return self.offset
+
+class GroupCommitWriter:
+    def __init__(self, path: str | Path, durability: str = DURABILITY_ALWAYS,
+                 interval_ms: int = 50, interval_events: int = 1000):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"unknown durability mode: {durability}")
+        self.durability = durability
+        self.interval_ms = interval_ms
+        self.interval_events = interval_events
+        self._file = Path(path).open("ab")
+        self._end = self._file.tell() # offset the next submitted write will start at
+        self._queue: list[PendingWrite] = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._unsynced_events = 0
+        self._last_sync = time.monotonic()
+        # a write failed: writes queued behind it were given offsets past it, so they fail as well
+        # until a write starts a new file
+        self._failed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def end(self) -> int:
+        with self._cond:
+            return self._end
+
+    # queue `data` behind every earlier write; offsets are assigned in submission order and
+    # `on_written` runs on the writer thread, in log order, once the write met the durability guarantee,
+    # so it never runs for a write that fails. With `new_path` the current file is synced and closed
+    # and `data` starts the new file.
+    def submit(self, data: bytes, on_written: Callable[[int], None] | None = None,
+               new_path: Path | None = None) -> PendingWrite:
+        with self._cond:
+            if self._closed:
+                raise ValueError("writer is closed")
+            if new_path is not None:
+                self._end = 0
+            pending = PendingWrite(data, self._end, on_written, new_path)
+            self._end += len(data)
+            self._queue.append(pending)
+            self._cond.notify()
+        return pending
+
+    def write(self, data: bytes, on_written: Callable[[int], None] | None = None) -> int:
+        return self.submit(data, on_written).wait()
+
+    # the file was truncated or rewritten behind the writer, continue at its current end;
+    # only valid while no write is in flight
+    def reposition(self) -> None:
+        with self._cond:
+            self._end = os.fstat(self._file.fileno()).st_size
+
+    def close(self) -> None:
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self._file.close()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    if not self._cond.wait(self._sync_timeout()):
+                        break
+                batch, self._queue = self._queue, []
+                closed = self._closed
+
+            if batch:
+                self._commit(batch)
+            elif self._unsynced_events:
+                self._sync_if_due(force = closed)
+            if closed and not batch:
+                return
+
+    def _commit(self, batch: list[PendingWrite]) -> None:
+        if self._failed:
+            resume = next((index for index, pending in enumerate(batch) if pending.new_path is not None), len(batch))
+            self._finish(batch[:resume], OSError("an earlier write to the log failed"))
+            batch = batch[resume:]
+            if not batch:
+                return
+        # writes before `start` went to files that were synced and closed by a roll
+        start = 0
+        error = None
+        try:
+            for index, pending in enumerate(batch):
+                if pending.new_path is not None:
+                    self._write_run(batch[start:index])
+                    self._roll(pending.new_path)
+                    self._failed = False
+                    start = index
+            self._write_run(batch[start:])
+            self._unsynced_events += len(batch)
+            self._sync_if_due()
+            start = len(batch)
+        except BaseException as e:
+            error = e
+            self._failed = True
+            self._discard(batch[start].offset)
+        for pending in batch[:start]:
+            if pending.on_written:
+                pending.on_written(pending.offset)
+        self._finish(batch[:start], None)
+        self._finish(batch[start:], error)
+
+    def _finish(self, batch: list[PendingWrite], error: BaseException | None) -> None:
+        for pending in batch:
+            pending.error = error
+            pending._done.set()
+
+    def _write_run(self, run: list[PendingWrite]) -> None:
+        if not run:
+            return
+        self._file.write(b"".join(pending.data for pending in run))
+        self._file.flush()
+
+    # drop what failed writes left behind `offset`, so no reader or restart finds records reported as failed
+    def _discard(self, offset: int) -> None:
+        try:
+            self._file.truncate(offset)
+        except (OSError, ValueError):
+            pass
+
+    def _roll(self, path: Path) -> None:
+        # already closed when an earlier roll failed to open its file
+        if self.durability != DURABILITY_NONE and not self._file.closed:
+            os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = Path(path).open("ab")
+
+    def _sync_if_due(self, force: bool = False) -> None:
+        due = force or self.durability == DURABILITY_ALWAYS
+        if self.durability == DURABILITY_INTERVAL:
+            elapsed_ms = (time.monotonic() - self._last_sync) * 1000
+            due = due or self._unsynced_events >= self.interval_events or elapsed_ms >= self.interval_ms
+        if due and self.durability != DURABILITY_NONE:
+            os.fsync(self._file.fileno())
+        if due:
+            self._unsynced_events = 0
+            self._last_sync = time.monotonic()
+
+    # wake up in interval mode so unsynced writes are fsynced even when no new write arrives
+    def _sync_timeout(self) -> float | None:
+        if self.durability != DURABILITY_INTERVAL or not self._unsynced_events:
+            return None
+        return max(self.interval_ms / 1000 - (time.monotonic() - self._last_sync), 0)
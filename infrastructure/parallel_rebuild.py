@@ -0,0 +1,99 @@
+import heapq, zlib
+from concurrent.futures import ProcessPoolExecutor
+from domain.models import EventResult, EventType, PayloadType, Snapshot
+from infrastructure.file_event_store import FileEventStore
+from infrastructure.in_memory_projection import InMemoryProjection
+from infrastructure.log_codec import EventCodec
+from infrastructure.replay_projection import ReplayProjection
+
+# Every rule except reservation-id uniqueness is scoped to one locker, so the log can be
+# replayed per shard of lockers and the shard states merged. A shard only knows its own
+# reservation ids, so it accepts a superset of what a sequential replay accepts:
+#   - a failure inside a shard is also a failure in the sequential replay,
+#   - a reservation id created by several shards fails at its second creation.
+# The sequential replay stops at the earliest of those positions, so when one exists
+# the shards are replayed again up to that position and the same result is returned.
+# Lockers folded by compaction are restored from the checkpoint into their shard first,
+# their reservation ids count as created before the first record of the log.
+
+def shard_of(locker_id: str, shards: int) -> int:
+    # crc32 instead of hash() so the partition does not depend on PYTHONHASHSEED
+    return zlib.crc32(locker_id.encode()) % shards
+
+def parallel_rebuild(projection: ReplayProjection, event_store: FileEventStore, workers: int,
+                     checkpoint: Snapshot | None = None) -> int:
+    shard_offsets = [[] for _ in range(workers)]
+    for locker_id, offsets in event_store.get_locker_offsets().items():
+        shard_offsets[shard_of(locker_id, workers)].append(offsets)
+    # merge each shard's lockers back into log order
+    shard_offsets = [list(heapq.merge(*lockers)) for lockers in shard_offsets]
+    shard_states = [_checkpoint_subset(checkpoint, shard, workers) for shard in range(workers)]
+
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        shards = _replay(pool, projection.hash_mode, event_store, shard_offsets, shard_states)
+        stop_position, result = _find_stop(shards)
+        if stop_position is not None:
+            shard_offsets = [[offset for offset in offsets if offset < stop_position] for offsets in shard_offsets]
+            shards = _replay(pool, projection.hash_mode, event_store, shard_offsets, shard_states)
+
+    merged = {"hash_mode": projection.hash_mode, "lockers": [], "open_faults": []}
+    for shard in shards:
+        merged["lockers"].extend(shard["state"]["lockers"])
+        merged["open_faults"].extend(shard["state"]["open_faults"])
+    projection.restore(merged)
+    return result
+
+def _checkpoint_subset(checkpoint: Snapshot | None, shard: int, shards: int) -> dict | None:
+    if not checkpoint:
+        return None
+    return {
+            "hash_mode": checkpoint.state["hash_mode"],
+            "lockers": [entry for entry in checkpoint.state["lockers"] if shard_of(entry["locker_id"], shards) == shard],
+            "open_faults": [fault_key for fault_key in checkpoint.state["open_faults"]
+                            if shard_of(fault_key[0], shards) == shard]
+        }
+
+def _replay(pool: ProcessPoolExecutor, hash_mode: str, event_store: FileEventStore,
+            shard_offsets: list[list[int]], shard_states: list[dict | None]) -> list[dict]:
+    segment_paths = {segment_id: str(path) for segment_id, path in event_store.get_segment_paths().items()}
+    codecs = event_store.get_segment_codecs()
+    futures = [pool.submit(_replay_shard, segment_paths, codecs, offsets, hash_mode, state)
+               for offsets, state in zip(shard_offsets, shard_states)]
+    return [future.result() for future in futures]
+
+def _replay_shard(segment_paths: dict[int, str], codecs: dict[int, EventCodec], offsets: list[int],
+                  hash_mode: str, state: dict | None) -> dict:
+    projection = InMemoryProjection(hash_mode)
+    created: dict[str, int] = {} # key = reservation_id, position of its creation
+    if state:
+        projection.restore(state)
+        created = {compartment[3]: -1 for entry in state["lockers"] for compartment in entry["compartments"]
+                   if compartment[3] is not None}
+    failure = None
+    for position, event in FileEventStore.read_records(segment_paths, offsets, codecs):
+        result = projection.apply(event)
+        if result != EventResult.SUCCESS:
+            failure = (position, result)
+            break
+        if event.type == EventType.RESERVATION_CREATED:
+            created[event.payload.get(PayloadType.RESERVATION_ID)] = position
+    return {"state": projection.snapshot(), "created": created, "failure": failure}
+
+def _find_stop(shards: list[dict]) -> tuple[int | None, int]:
+    stop_position, result = None, EventResult.SUCCESS
+    for shard in shards:
+        if shard["failure"] and (stop_position is None or shard["failure"][0] < stop_position):
+            stop_position, result = shard["failure"]
+
+    # the earliest creation of a reservation id wins, the next one is rejected
+    creations: dict[str, list[int]] = {}
+    for shard in shards:
+        for reservation_id, position in shard["created"].items():
+            creations.setdefault(reservation_id, []).append(position)
+    for positions in creations.values():
+        if len(positions) < 2:
+            continue
+        conflict_position = sorted(positions)[1]
+        if stop_position is None or conflict_position < stop_position:
+            stop_position, result = conflict_position, EventResult.VALIDATION_ERROR
+    return stop_position, result
@@ -0,0 +1,143 @@
+from abc import abstractmethod
+from domain.models import EventResult, LockerEvent, Snapshot, SnapshotCapture
+from domain.repositories import EventStore, SnapshotStore, Projection
+from infrastructure.state_hash import HASH_MODES
+
+# Rebuild shared by the projections: restore the checkpoint or a snapshot, then replay the log.
+# Subclasses only provide the state, snapshot/restore use one format so their snapshots,
+# checkpoints and parallel rebuild shards are interchangeable.
+class ReplayProjection(Projection):
+    def __init__(self, hash_mode: str, rebuild_workers: int = 1):
+        if hash_mode not in HASH_MODES:
+            raise ValueError(f"unknown state hash mode: {hash_mode}")
+        self.hash_mode = hash_mode
+        # worker processes used by a full rebuild of a FileEventStore, 1 replays sequentially
+        self.rebuild_workers = rebuild_workers
+        # per-event metrics are off while the log is replayed, the rebuild is timed as a whole
+        self.record_metrics = True
+        # the snapshot being captured, apply preserves the rows it is about to change
+        self._capture: SnapshotCapture | None = None
+
+    @abstractmethod
+    def _clear(self) -> None: ...
+    # the snapshot row of one locker, None for an unknown locker
+    @abstractmethod
+    def _snapshot_locker(self, locker_id: str) -> dict | None: ...
+    @abstractmethod
+    def _snapshot_locker_ids(self) -> list[str]: ...
+    @abstractmethod
+    def _snapshot_open_faults(self, locker_ids: set[str] | None = None) -> list[list[str]]: ...
+    # drop everything the projection holds about the locker
+    @abstractmethod
+    def _remove_locker(self, locker_id: str) -> None: ...
+    # add one snapshot row of a locker that is not in the projection, with its open faults
+    @abstractmethod
+    def _restore_locker(self, locker_data: dict, open_faults: list[list[str]]) -> None: ...
+
+    def snapshot(self, locker_ids: set[str] | None = None) -> dict:
+        lockers = [self._snapshot_locker(locker_id) for locker_id in self._snapshot_locker_ids()
+                   if locker_ids is None or locker_id in locker_ids]
+        return {"hash_mode": self.hash_mode, "lockers": lockers, "open_faults": self._snapshot_open_faults(locker_ids)}
+
+    def begin_snapshot(self) -> SnapshotCapture:
+        self._cancel_snapshot()
+        self._capture = SnapshotCapture(self.hash_mode, self._snapshot_locker_ids(), self._snapshot_open_faults())
+        return self._capture
+
+    def snapshot_locker(self, capture: SnapshotCapture, locker_id: str) -> dict:
+        row = capture.preserved.get(locker_id)
+        return row if row is not None else self._snapshot_locker(locker_id)
+
+    def end_snapshot(self, capture: SnapshotCapture, lockers: list[dict]) -> dict:
+        if self._capture is capture:
+            self._capture = None
+        return {"hash_mode": capture.hash_mode, "lockers": lockers, "open_faults": capture.open_faults}
+
+    # called by apply before it changes the locker, keeps the row the running capture still has to read
+    def _preserve(self, locker_id: str) -> None:
+        capture = self._capture
+        if capture is not None and locker_id not in capture.preserved:
+            row = self._snapshot_locker(locker_id)
+            # a locker registered after begin_snapshot is not part of it
+            if row is not None:
+                capture.preserved[locker_id] = row
+
+    # the captured state is gone, e.g. cleared for a rebuild
+    def _cancel_snapshot(self) -> None:
+        if self._capture is not None:
+            self._capture.cancelled = True
+            self._capture = None
+
+    # the locker's checkpoint row, if compaction folded it, followed by its records in the log
+    def reload_locker(self, locker_id: str, event_store: EventStore) -> None:
+        checkpoint = event_store.load_checkpoint()
+        state = checkpoint.state if checkpoint else {"lockers": [], "open_faults": []}
+        locker_data = next((entry for entry in state["lockers"] if entry["locker_id"] == locker_id), None)
+        open_faults = [fault_key for fault_key in state["open_faults"] if fault_key[0] == locker_id]
+        # read before the locker is taken apart, so it is rebuilt without waiting on the store
+        events = event_store.load_by_locker(locker_id)
+        self._reload_locker(locker_id, locker_data, open_faults, events)
+
+    def _reload_locker(self, locker_id: str, locker_data: dict | None, open_faults: list[list[str]],
+                       events: list[LockerEvent]) -> None:
+        # a running capture still has to read the locker as it was at begin_snapshot
+        if self._capture is not None:
+            self._preserve(locker_id)
+        self._remove_locker(locker_id)
+        if locker_data is not None:
+            self._restore_locker(locker_data, open_faults)
+        for event in events:
+            self.apply(event)
+
+    def rebuild(self, event_store: EventStore, snapshot_store: SnapshotStore | None = None) -> int:
+        self.record_metrics = False
+        try:
+            return self._replay(event_store, snapshot_store)
+        finally:
+            self.record_metrics = True
+
+    def _replay(self, event_store: EventStore, snapshot_store: SnapshotStore | None) -> int:
+        self._clear()
+        position = 0
+        restored = False
+        # lockers folded by compaction only exist in the checkpoint, a snapshot older than it
+        # points into segments that were rewritten since
+        checkpoint = event_store.load_checkpoint()
+        # start from the newest snapshot that still matches the event store, replay only the tail
+        if snapshot_store:
+            for snapshot in snapshot_store.load_all():
+                if checkpoint and snapshot.position < checkpoint.position:
+                    continue
+                if not self._is_valid_snapshot(snapshot, event_store):
+                    continue
+                try:
+                    self.restore(snapshot.state)
+                except (KeyError, TypeError, ValueError):
+                    self._clear()
+                    continue
+                position = snapshot.position
+                restored = True
+                break
+
+        if not restored and self.rebuild_workers > 1:
+            from infrastructure.file_event_store import FileEventStore
+            from infrastructure.parallel_rebuild import parallel_rebuild
+            if isinstance(event_store, FileEventStore):
+                return parallel_rebuild(self, event_store, self.rebuild_workers, checkpoint)
+
+        if not restored and checkpoint:
+            self.restore(checkpoint.state)
+        # stream the log so memory stays flat regardless of its length
+        for event in event_store.iter_all(position):
+            result = self.apply(event)
+            if result != EventResult.SUCCESS:
+                return result
+        return EventResult.SUCCESS
+
+    def _is_valid_snapshot(self, snapshot: Snapshot, event_store: EventStore) -> bool:
+        # the log must still contain the last event the snapshot covers
+        if snapshot.position > event_store.get_position():
+            return False
+        if snapshot.last_event_id is None:
+            return snapshot.position == 0
+        return event_store.contains(snapshot.last_event_id)
@@ -0,0 +1,235 @@
+import json, logging, os, sqlite3, threading, time
+from collections.abc import Iterator
+from domain.models import EventResult, EventType, LockerEvent, Snapshot
+from domain.repositories import EventStore, Projection
+from infrastructure.log_writer import DURABILITY_ALWAYS, DURABILITY_INTERVAL, DURABILITY_NONE, DURABILITY_MODES
+
+# A position is the seq of the last record it covers, records after it have a larger seq.
+# AUTOINCREMENT never hands out a seq twice, so positions keep growing after compaction deletes rows.
+
+# always: every commit is synced, none: never synced,
+# interval: commits are not synced by SQLite (NORMAL syncs the WAL only at checkpoints), a background
+# thread fsyncs the WAL every `sync_interval_ms` or `sync_interval_events` like the file store's writer
+SYNCHRONOUS = {DURABILITY_ALWAYS: "FULL", DURABILITY_INTERVAL: "NORMAL", DURABILITY_NONE: "OFF"}
+
+logger = logging.getLogger("locker.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id TEXT NOT NULL,
+    occurred_at TEXT NOT NULL,
+    locker_id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS events_event_id ON events (event_id);
+CREATE INDEX IF NOT EXISTS events_locker_seq ON events (locker_id, seq);
+-- event ids of records folded into the checkpoint, retries of them are still duplicates
+CREATE TABLE IF NOT EXISTS folded_events (event_id TEXT PRIMARY KEY) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS checkpoint (id INTEGER PRIMARY KEY CHECK (id = 0), position INTEGER NOT NULL, state TEXT NOT NULL);
+"""
+
+INSERT = """
+INSERT OR IGNORE INTO events (event_id, occurred_at, locker_id, type, payload)
+SELECT ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM folded_events WHERE event_id = ?)
+"""
+
+class SqliteEventStore(EventStore):
+    def __init__(self, db_path: str = "events.db", durability: str = DURABILITY_ALWAYS, fetch_size: int = 1000,
+                 sync_interval_ms: int = 50, sync_interval_events: int = 1000):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"unknown durability mode: {durability}")
+        self.db_path = db_path
+        self.durability = durability
+        self.sync_interval_ms = sync_interval_ms
+        self.sync_interval_events = sync_interval_events
+        # rows fetched per round trip while streaming the log
+        self.fetch_size = fetch_size
+        self._lock = threading.Lock()
+        # every write and short read goes through one connection, long scans open their own
+        self._db = self._connect()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(f"PRAGMA synchronous={SYNCHRONOUS[durability]}")
+        self._db.executescript(SCHEMA)
+        self._sync_cond = threading.Condition()
+        self._unsynced_events = 0
+        self._last_sync = time.monotonic()
+        self._closed = False
+        self._sync_thread: threading.Thread | None = None
+        if durability == DURABILITY_INTERVAL:
+            self._sync_thread = threading.Thread(target = self._run_sync, daemon = True)
+            self._sync_thread.start()
+
+    def load_all(self, from_position: int = 0) -> list[LockerEvent]:
+        return list(self.iter_all(from_position))
+
+    def load_by_locker(self, locker_id: str) -> list[LockerEvent]:
+        return list(self.iter_by_locker(locker_id))
+
+    def iter_all(self, from_position: int | None = None) -> Iterator[LockerEvent]:
+        # a separate connection reads one WAL snapshot while appends continue
+        yield from self._stream("SELECT event_id, occurred_at, locker_id, type, payload FROM events "
+                                "WHERE seq > ? ORDER BY seq", (from_position or 0,))
+
+    def iter_by_locker(self, locker_id: str) -> Iterator[LockerEvent]:
+        yield from self._stream("SELECT event_id, occurred_at, locker_id, type, payload FROM events "
+                                "WHERE locker_id = ? ORDER BY seq", (locker_id,))
+
+    def append(self, event: LockerEvent) -> int:
+        return self.append_batch([event])[0]
+
+    # all accepted events of the batch are inserted in one transaction
+    def append_batch(self, events: list[LockerEvent]) -> list[int]:
+        results = []
+        with self._lock, self._db:
+            for event in events:
+                event_id = str(event.event_id)
+                # the unique index rejects an event_id already stored, also earlier in the batch
+                cursor = self._db.execute(INSERT, (
+                        event_id,
+                        str(event.occurred_at),
+                        event.locker_id,
+                        event.type.value if isinstance(event.type, EventType) else event.type,
+                        json.dumps(event.payload),
+                        event_id
+                    ))
+                results.append(EventResult.SUCCESS if cursor.rowcount else EventResult.DUPLICATE)
+        self._count_unsynced(results.count(EventResult.SUCCESS))
+        return results
+
+    def contains(self, event_id: str) -> bool:
+        with self._lock:
+            row = self._db.execute("SELECT EXISTS (SELECT 1 FROM events WHERE event_id = ?) "
+                                   "OR EXISTS (SELECT 1 FROM folded_events WHERE event_id = ?)",
+                                   (str(event_id), str(event_id))).fetchone()
+        return bool(row[0])
+
+    def get_position(self) -> int:
+        with self._lock:
+            return self._read_position()
+
+    # seq values are never reused, so the position counts every event inserted, including folded ones
+    def get_stats(self) -> dict[str, int]:
+        with self._lock:
+            events = self._read_position()
+        paths = [self.db_path, f"{self.db_path}-wal"]
+        return {"events": events, "bytes": sum(os.path.getsize(path) for path in paths if os.path.exists(path))}
+
+    def load_checkpoint(self) -> Snapshot | None:
+        with self._lock:
+            return self._read_checkpoint()
+
+    # Fold every locker whose reservations are all terminal into the checkpoint and delete its
+    # records. `projection` must reflect exactly this store and no event may be appended or
+    # applied meanwhile. Returns the number of records deleted.
+    def compact(self, projection: Projection) -> int:
+        with self._lock, self._db:
+            checkpoint = self._read_checkpoint()
+            checkpoint_state = checkpoint.state if checkpoint else {"lockers": [], "open_faults": []}
+            locker_ids = {row[0] for row in self._db.execute("SELECT DISTINCT locker_id FROM events")}
+            locker_ids.update(entry["locker_id"] for entry in checkpoint_state["lockers"])
+            folded_lockers = set()
+            for locker_id in locker_ids:
+                locker = projection.query_locker(locker_id)
+                if locker and not locker.has_open_reservation():
+                    folded_lockers.add(locker_id)
+            if not folded_lockers:
+                return 0
+
+            state = projection.snapshot(folded_lockers)
+            state["lockers"].extend(entry for entry in checkpoint_state["lockers"]
+                                    if entry["locker_id"] not in folded_lockers)
+            state["open_faults"].extend(fault_key for fault_key in checkpoint_state["open_faults"]
+                                        if fault_key[0] not in folded_lockers)
+            position = self._read_position()
+
+            folded = 0
+            for locker_id in folded_lockers:
+                self._db.execute("INSERT OR IGNORE INTO folded_events (event_id) "
+                                 "SELECT event_id FROM events WHERE locker_id = ?", (locker_id,))
+                folded += self._db.execute("DELETE FROM events WHERE locker_id = ?", (locker_id,)).rowcount
+            self._db.execute("INSERT OR REPLACE INTO checkpoint (id, position, state) VALUES (0, ?, ?)",
+                             (position, json.dumps(state)))
+        return folded
+
+    def close(self) -> None:
+        if self._sync_thread is not None:
+            with self._sync_cond:
+                self._closed = True
+                self._sync_cond.notify()
+            self._sync_thread.join()
+            self._sync_thread = None
+        with self._lock:
+            self._db.close()
+
+    def _count_unsynced(self, events: int) -> None:
+        if self._sync_thread is None or not events:
+            return
+        with self._sync_cond:
+            self._unsynced_events += events
+            self._sync_cond.notify()
+
+    # fsync the WAL once `sync_interval_events` commits are unsynced or the oldest is `sync_interval_ms` old,
+    # and once more on close
+    def _run_sync(self) -> None:
+        while True:
+            with self._sync_cond:
+                while not self._closed and not self._sync_due():
+                    self._sync_cond.wait(self._sync_timeout())
+                unsynced, closed = self._unsynced_events, self._closed
+                self._unsynced_events = 0
+                self._last_sync = time.monotonic()
+            if unsynced:
+                self._sync_wal()
+            if closed:
+                return
+
+    def _sync_due(self) -> bool:
+        if not self._unsynced_events:
+            return False
+        elapsed_ms = (time.monotonic() - self._last_sync) * 1000
+        return self._unsynced_events >= self.sync_interval_events or elapsed_ms >= self.sync_interval_ms
+
+    def _sync_timeout(self) -> float | None:
+        if not self._unsynced_events:
+            return None
+        return max(self.sync_interval_ms / 1000 - (time.monotonic() - self._last_sync), 0)
+
+    # committed frames are in the WAL file, the OS page cache only until this fsync
+    def _sync_wal(self) -> None:
+        try:
+            fd = os.open(f"{self.db_path}-wal", os.O_RDONLY)
+        except FileNotFoundError:
+            # checkpointed and removed, the checkpoint synced it
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            logger.exception("fsync of %s-wal failed", self.db_path)
+        finally:
+            os.close(fd)
+
+    # the largest seq handed out so far
+    def _read_position(self) -> int:
+        row = self._db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'events'").fetchone()
+        return row[0] if row else 0
+
+    def _read_checkpoint(self) -> Snapshot | None:
+        row = self._db.execute("SELECT position, state FROM checkpoint").fetchone()
+        if not row:
+            return None
+        return Snapshot(row[0], None, json.loads(row[1]))
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, check_same_thread = False, isolation_level = "DEFERRED")
+
+    def _stream(self, query: str, params: tuple) -> Iterator[LockerEvent]:
+        db = self._connect()
+        try:
+            cursor = db.execute(query, params)
+            while rows := cursor.fetchmany(self.fetch_size):
+                for event_id, occurred_at, locker_id, type, payload in rows:
+                    yield LockerEvent(event_id, occurred_at, locker_id, type, json.loads(payload))
+        finally:
+            db.close()
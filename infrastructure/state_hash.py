@@ -0,0 +1,28 @@
+import json, hashlib
+
+# "legacy" hashes the whole locker dict on every event (the original format),
+# "incremental" keeps one digest per compartment and only rehashes the touched one
+HASH_MODE_LEGACY = "legacy"
+HASH_MODE_INCREMENTAL = "incremental"
+HASH_MODES = (HASH_MODE_LEGACY, HASH_MODE_INCREMENTAL)
+
+# compartment digests are combined by addition modulo 2^256,
+# which is commutative so the result does not depend on compartment order
+_DIGEST_MODULUS = 1 << 256
+
+def legacy_state_hash(locker_dict: dict) -> str:
+    state_json = json.dumps(locker_dict, sort_keys=True)
+    return hashlib.sha256(state_json.encode()).hexdigest()
+
+def compartment_digest(compartment_id: str, fault: bool, degraded: bool,
+                       reservation_id: str | None, status: str | None) -> int:
+    entry = json.dumps([compartment_id, fault, degraded, reservation_id, status])
+    return int.from_bytes(hashlib.sha256(entry.encode()).digest(), "big")
+
+def combine_digests(combined: int, old_digest: int, new_digest: int) -> int:
+    return (combined - old_digest + new_digest) % _DIGEST_MODULUS
+
+def incremental_state_hash(locker_id: str, num_compartment: int, num_reservation: int,
+                           num_degraded: int, combined: int) -> str:
+    header = json.dumps([locker_id, num_compartment, num_reservation, num_degraded, f"{combined:064x}"])
+    return hashlib.sha256(header.encode()).hexdigest()
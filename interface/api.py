@@ -1,49 +1,309 @@
-from fastapi import FastAPI, Response, status
-from domain.models import EventResult, LockerEvent
+import os, json, secrets
+from contextlib import asynccontextmanager
+from typing import Any
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, Query, Response, status
+from pydantic import ValidationError
+from domain.models import CompartmentFilter, EventResult, LockerCounts, LockerEvent, Compartment
+from domain.repositories import EventStore, Projection
+from application.metrics import REGISTRY, Gauge
+from application.profiling import Profiler, annotate, record_span_since_start
+from application.expiry import ExpiryScheduler
 from application.use_cases import LockerService
+from infrastructure.columnar_projection import ColumnarProjection
 from infrastructure.in_memory_projection import InMemoryProjection
 from infrastructure.file_event_store import FileEventStore
-from interface.schemas import Event, LockerSummary, CompartmentStatus, ReservationStatus
+from infrastructure.file_snapshot_store import FileSnapshotStore
+from infrastructure.sqlite_event_store import SqliteEventStore
+from infrastructure.log_writer import DURABILITY_ALWAYS
+from infrastructure.state_hash import HASH_MODE_INCREMENTAL
+from interface.response_cache import ResponseCache, etag_for, etag_matches
+from interface.schemas import (Event, EventOutcome, BatchOutcome, LockerSummary, LockerList, CompartmentStatus,
+                               CompartmentPage, FreeCompartments, ReservationStatus)
 
 # initialize
-app = FastAPI()
-projection = InMemoryProjection()
-event_store = FileEventStore()
-service = LockerService(projection, event_store)
+# STATE_HASH_MODE=legacy keeps the original full-locker state_hash format
+# REBUILD_WORKERS > 1 replays a full rebuild in parallel, sharded by locker_id
+# PROJECTION: memory (one object per compartment) or columnar (array columns, less memory)
+projection: Projection
+if os.environ.get("PROJECTION", "memory") == "columnar":
+    projection = ColumnarProjection(os.environ.get("STATE_HASH_MODE", HASH_MODE_INCREMENTAL),
+                                    rebuild_workers = int(os.environ.get("REBUILD_WORKERS", "1")))
+else:
+    projection = InMemoryProjection(os.environ.get("STATE_HASH_MODE", HASH_MODE_INCREMENTAL),
+                                    rebuild_workers = int(os.environ.get("REBUILD_WORKERS", "1")))
+# EVENT_STORE: file (segmented log) or sqlite
+# LOG_DURABILITY: always (fsync before acknowledging), interval or none
+# LOG_CODEC: json or binary for a new log, an existing log keeps its codec when unset
+event_store: EventStore
+if os.environ.get("EVENT_STORE", "file") == "sqlite":
+    event_store = SqliteEventStore(os.environ.get("SQLITE_PATH", "events.db"),
+                                   durability = os.environ.get("LOG_DURABILITY", DURABILITY_ALWAYS),
+                                   sync_interval_ms = int(os.environ.get("LOG_SYNC_INTERVAL_MS", "50")),
+                                   sync_interval_events = int(os.environ.get("LOG_SYNC_INTERVAL_EVENTS", "1000")))
+else:
+    event_store = FileEventStore(os.environ.get("LOG_PATH", "events.jsonl"),
+                                 durability = os.environ.get("LOG_DURABILITY", DURABILITY_ALWAYS),
+                                 sync_interval_ms = int(os.environ.get("LOG_SYNC_INTERVAL_MS", "50")),
+                                 sync_interval_events = int(os.environ.get("LOG_SYNC_INTERVAL_EVENTS", "1000")),
+                                 segment_max_bytes = int(os.environ.get("LOG_SEGMENT_MAX_BYTES", str(64 << 20))),
+                                 codec = os.environ.get("LOG_CODEC"))
+snapshot_store = FileSnapshotStore(os.environ.get("SNAPSHOT_DIR", "snapshots"))
+service = LockerService(projection, event_store, snapshot_store,
+                        snapshot_interval = int(os.environ.get("SNAPSHOT_INTERVAL", "10000")))
+
+# RESERVATION_TTL_SECONDS > 0 expires reservations still CREATED that long after their ReservationCreated,
+# checked every EXPIRY_CHECK_INTERVAL_SECONDS and issued in batches of EXPIRY_BATCH_SIZE events
+expiry_scheduler: ExpiryScheduler | None = None
+if float(os.environ.get("RESERVATION_TTL_SECONDS", "0")) > 0:
+    expiry_scheduler = ExpiryScheduler(service, float(os.environ["RESERVATION_TTL_SECONDS"]),
+                                       batch_size = int(os.environ.get("EXPIRY_BATCH_SIZE", "500")),
+                                       check_interval = float(os.environ.get("EXPIRY_CHECK_INTERVAL_SECONDS", "1")))
+    # the service hands accepted ReservationCreated events to the scheduler and reschedules after rebuilds
+    service.expiry_scheduler = expiry_scheduler
+
+# sizes read at every scrape of GET /metrics
+REGISTRY.register(Gauge("locker_log_bytes", "Size of the event log on disk",
+                        lambda: event_store.get_stats()["bytes"]))
+REGISTRY.register(Gauge("locker_log_events", "Events accepted into the event log, including compacted ones",
+                        lambda: event_store.get_stats()["events"]))
+REGISTRY.register(Gauge("locker_lockers", "Lockers in the projection",
+                        lambda: projection.get_stats()["lockers"]))
+REGISTRY.register(Gauge("locker_reservations", "Reservations tracked by id in the projection",
+                        lambda: projection.get_stats()["reservations"]))
+
+# RESPONSE_CACHE_SIZE: serialized locker and compartment responses kept for polling clients, 0 disables the cache
+response_cache = ResponseCache(int(os.environ.get("RESPONSE_CACHE_SIZE", "100000")))
+
+# slow requests are logged with the size of the locker they touched
+def describe_slow_request(attributes: dict) -> dict:
+    locker = service.get_locker_counts([attributes["locker_id"]])[0] if "locker_id" in attributes else None
+    return {"locker_compartments": locker.num_compartment} if locker else {}
+
+# SLOW_REQUEST_MS > 0 traces requests from startup and logs those slower than it, PUT /admin/tracing changes it
+profiler = Profiler(float(os.environ.get("SLOW_REQUEST_MS", "0")), describe = describe_slow_request)
+
+if expiry_scheduler is not None:
+    REGISTRY.register(Gauge("locker_expiries_scheduled", "Reservation expiries waiting in the scheduler heap",
+                            lambda: len(expiry_scheduler)))
+
+# restore the newest snapshot and replay the tail of the log before serving traffic
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    service.rebuild_events()
+    if expiry_scheduler is not None:
+        expiry_scheduler.start()
+    yield
+    if expiry_scheduler is not None:
+        expiry_scheduler.stop()
+
+app = FastAPI(lifespan = lifespan)
+
+# plain ASGI middleware, a request costs one attribute check while tracing is off
+class RequestTracing:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not profiler.tracing:
+            return await self.app(scope, receive, send)
+        with profiler.trace(f"{scope['method']} {scope['path']}") as trace:
+            async def send_with_status(message):
+                if message["type"] == "http.response.start":
+                    trace.attributes["status"] = message["status"]
+                await send(message)
+            await self.app(scope, receive, send_with_status)
+
+app.add_middleware(RequestTracing)
 
 @app.put("/rebuild")
 def rebuild_events() -> None:
     service.rebuild_events()
 
+# fold lockers without open reservations out of the closed log segments
+@app.put("/compact")
+def compact_events() -> None:
+    service.compact()
+
+# Prometheus text exposition format
+@app.get("/metrics")
+def get_metrics() -> Response:
+    return Response(content = REGISTRY.render(), media_type = "text/plain; version=0.0.4")
+
+# ADMIN_TOKEN: bearer token required by the /admin endpoints, unset leaves them disabled (404)
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+def require_admin(authorization: str | None = Header(default = None)) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status.HTTP_404_NOT_FOUND)
+    if authorization is None or not secrets.compare_digest(authorization.encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, headers = {"WWW-Authenticate": "Bearer"})
+
+# runtime switches of the request tracing and the cProfile sampling
+admin = APIRouter(prefix = "/admin", dependencies = [Depends(require_admin)])
+
+@admin.get("/profiling")
+def get_profiling() -> dict:
+    return profiler.status()
+
+@admin.put("/tracing")
+def set_tracing(slow_request_ms: float) -> dict:
+    profiler.slow_request_ms = slow_request_ms
+    return profiler.status()
+
+@admin.get("/traces/slow")
+def get_slow_requests() -> list[dict]:
+    return list(profiler.slow_requests)
+
+# profile the handling of the next `requests` event requests, one in every `sample_every`
+@admin.post("/profile")
+def start_profile(requests: int = 100, sample_every: int = 1) -> dict:
+    profiler.start_profile(requests, sample_every)
+    return profiler.status()
+
+# load with pstats.Stats("profile.pstats") or snakeviz
+@admin.get("/profile/download")
+def download_profile() -> Response:
+    data = profiler.dump_stats()
+    if data is None:
+        return Response(status_code = status.HTTP_404_NOT_FOUND)
+    return Response(content = data, media_type = "application/octet-stream",
+                    headers = {"Content-Disposition": 'attachment; filename="profile.pstats"'})
+
+app.include_router(admin)
+
+# status code and description returned for each EventResult
+EVENT_RESPONSES = {
+    EventResult.SUCCESS: (status.HTTP_202_ACCEPTED, "Event accepted"),
+    EventResult.DUPLICATE: (status.HTTP_200_OK, "Duplicate event (idempotent)"),
+    EventResult.DOMAIN_VIOLATION: (status.HTTP_409_CONFLICT, "Domain rule violation"),
+    EventResult.VALIDATION_ERROR: (status.HTTP_422_UNPROCESSABLE_CONTENT, "Validation error"),
+}
+
+def to_locker_event(event: Event) -> LockerEvent:
+    return LockerEvent(event.event_id, event.occurred_at, event.locker_id, event.type, event.payload)
+
 @app.post("/events")
 def handle_event(event: Event) -> Response:
-    locker_event = LockerEvent(event.event_id, event.occurred_at, event.locker_id, event.type, event.payload)
-    result = service.handle_event(locker_event)
-    if result == EventResult.SUCCESS:
-        content = '{"description": "Event accepted"}'
-        status_code = status.HTTP_202_ACCEPTED
-    elif result == EventResult.DUPLICATE:
-        content = '{"description": "Duplicate event (idempotent)"}'
-        status_code = status.HTTP_200_OK
-    elif result == EventResult.DOMAIN_VIOLATION:
-        content = '{"description": "Domain rule violation"}'
-        status_code = status.HTTP_409_CONFLICT
-    elif result == EventResult.VALIDATION_ERROR:
-        content = '{"description": "Validation error"}'
-        status_code = status.HTTP_422_UNPROCESSABLE_CONTENT
-
+    # routing, body parsing and validation, up to the handler running in its worker thread
+    record_span_since_start("validation")
+    annotate(event_type = event.type.value, locker_id = event.locker_id)
+    with profiler.profile():
+        result = service.handle_event(to_locker_event(event))
+    status_code, description = EVENT_RESPONSES[result]
     return Response(
-        content = content,
+        content = json.dumps({"description": description}),
         status_code = status_code,
         media_type = "application/json"
     )
 
-@app.get("/lockers/{locker_id}")
-def get_locker(locker_id: str) -> LockerSummary | None:
-    locker = service.get_locker_state(locker_id)
+# MAX_BATCH_EVENTS: events per POST /events:batch, a batch holds its lockers' locks until it is applied and logged
+MAX_BATCH_EVENTS = int(os.environ.get("MAX_BATCH_EVENTS", "1000"))
+
+# events are validated one by one so an invalid event only fails its own entry
+@app.post("/events:batch")
+def handle_events(batch: list[dict[str, Any]]) -> BatchOutcome:
+    if len(batch) > MAX_BATCH_EVENTS:
+        raise HTTPException(status.HTTP_413_CONTENT_TOO_LARGE, f"at most {MAX_BATCH_EVENTS} events per batch")
+    annotate(events = len(batch))
+    outcomes: list[EventOutcome | None] = [None] * len(batch)
+    valid: list[tuple[int, LockerEvent]] = []
+    for index, item in enumerate(batch):
+        try:
+            valid.append((index, to_locker_event(Event.model_validate(item))))
+        except ValidationError:
+            status_code, description = EVENT_RESPONSES[EventResult.VALIDATION_ERROR]
+            event_id = item.get("event_id")
+            outcomes[index] = EventOutcome(
+                    event_id = str(event_id) if event_id is not None else None,
+                    status_code = status_code,
+                    description = description
+                )
+
+    # the events are validated one by one in the handler
+    record_span_since_start("validation")
+    with profiler.profile():
+        results = service.handle_events([locker_event for _, locker_event in valid])
+    for (index, locker_event), result in zip(valid, results):
+        status_code, description = EVENT_RESPONSES[result]
+        outcomes[index] = EventOutcome(
+                event_id = locker_event.event_id,
+                status_code = status_code,
+                description = description
+            )
+    return BatchOutcome(results = outcomes)
+
+# ids per GET /lockers request
+MAX_BULK_IDS = 1000
+
+# one request for a fleet view, e.g. GET /lockers?ids=L1,L2,L3
+@app.get("/lockers")
+def get_lockers(ids: str) -> LockerList:
+    locker_ids = list(dict.fromkeys(locker_id for locker_id in ids.split(",") if locker_id))
+    if len(locker_ids) > MAX_BULK_IDS:
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_CONTENT, f"at most {MAX_BULK_IDS} ids per request")
+    lockers = service.get_locker_counts(locker_ids)
+    return LockerList(
+            lockers = [to_locker_summary(locker) for locker in lockers if locker is not None],
+            missing = [locker_id for locker_id, locker in zip(locker_ids, lockers) if locker is None]
+        )
+
+# compartments in registration order, or in the order they entered `status` when filtered
+@app.get("/lockers/{locker_id}/compartments")
+def list_compartments(locker_id: str, compartment_filter: CompartmentFilter | None = Query(None, alias = "status"),
+                      offset: int = Query(0, ge = 0),
+                      limit: int = Query(100, ge = 1, le = 1000)) -> CompartmentPage | None:
+    listing = service.list_compartments(locker_id, compartment_filter, offset, limit)
+    if listing is None:
+        return None
+    compartments, total = listing
+    return CompartmentPage(
+            compartments = [to_compartment_status(compartment) for compartment in compartments],
+            total = total,
+            next_offset = offset + limit if offset + limit < total else None
+        )
+
+# the next `count` compartments that can take a ReservationCreated, longest free first
+@app.get("/lockers/{locker_id}/free-compartments")
+def get_free_compartments(locker_id: str, count: int = Query(1, ge = 1, le = 1000)) -> FreeCompartments | None:
+    free = service.get_free_compartments(locker_id, count)
+    if free is None:
+        return None
+    compartment_ids, total = free
+    return FreeCompartments(compartment_ids = compartment_ids, free = total)
+
+# the locker's state_hash is the ETag of the locker and its compartments: a poll of an unchanged
+# locker is answered with 304 or with the cached bytes, without building or serializing a response
+def cached_response(key: tuple, state_hash: str, if_none_match: str | None, render) -> Response:
+    # a cached body also proves the resource exists, a compartment shares the ETag of its locker
+    # and must not be answered with 304 when it does not exist
+    body = response_cache.get(key, state_hash)
+    if body is None:
+        model = render()
+        if model is None:
+            return Response(content = b"null", media_type = "application/json")
+        body = model.model_dump_json().encode()
+        response_cache.put(key, state_hash, body)
+    etag = etag_for(state_hash)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code = status.HTTP_304_NOT_MODIFIED, headers = headers)
+    return Response(content = body, media_type = "application/json", headers = headers)
+
+@app.get("/lockers/{locker_id}", response_model = LockerSummary | None)
+def get_locker(locker_id: str, if_none_match: str | None = Header(default = None)) -> Response:
+    # read before the state it tags, so a cached body is never older than its ETag
+    state_hash = service.get_state_hash(locker_id)
+    if state_hash is None:
+        return Response(content = b"null", media_type = "application/json")
+    return cached_response(("locker", locker_id), state_hash, if_none_match, lambda: render_locker(locker_id))
+
+def render_locker(locker_id: str) -> LockerSummary | None:
+    locker = service.get_locker_counts([locker_id])[0]
     if locker is None:
         return None
-    
+    return to_locker_summary(locker)
+
+def to_locker_summary(locker: LockerCounts) -> LockerSummary:
     return LockerSummary(
             locker_id = locker.locker_id,
             compartments = locker.num_compartment,
@@ -52,12 +312,22 @@ def get_locker(locker_id: str) -> LockerSummary | None:
             state_hash = locker.state_hash
         )
 
-@app.get("/lockers/{locker_id}/compartments/{compartment_id}")
-def get_compartment(locker_id: str, compartment_id: str) -> CompartmentStatus | None:
+@app.get("/lockers/{locker_id}/compartments/{compartment_id}", response_model = CompartmentStatus | None)
+def get_compartment(locker_id: str, compartment_id: str,
+                    if_none_match: str | None = Header(default = None)) -> Response:
+    state_hash = service.get_state_hash(locker_id)
+    if state_hash is None:
+        return Response(content = b"null", media_type = "application/json")
+    return cached_response(("compartment", locker_id, compartment_id), state_hash, if_none_match,
+                           lambda: render_compartment(locker_id, compartment_id))
+
+def render_compartment(locker_id: str, compartment_id: str) -> CompartmentStatus | None:
     compartment = service.get_compartment_state(locker_id, compartment_id)
     if compartment is None:
         return None
-    
+    return to_compartment_status(compartment)
+
+def to_compartment_status(compartment: Compartment) -> CompartmentStatus:
     return CompartmentStatus(
             compartment_id = compartment.compartment_id,
             degraded = compartment.degraded,
@@ -0,0 +1,45 @@
+import threading
+from collections import OrderedDict
+
+# Serialized GET responses keyed by resource, each tagged with the state_hash of the locker it was
+# rendered from. An entry is only served while the locker still has that hash, so an applied
+# event, a rebuild or a hash mode change invalidates it without the projection knowing about the cache.
+class ResponseCache:
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[str, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, state_hash: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != state_hash:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: tuple, state_hash: str, body: bytes) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (state_hash, body)
+            self._entries.move_to_end(key)
+            # least recently served first
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+# a strong ETag; If-None-Match may list several tags, W/ marks a weak one that still matches a GET
+def etag_for(state_hash: str) -> str:
+    return f'"{state_hash}"'
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
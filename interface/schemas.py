@@ -11,6 +11,15 @@ class Event(BaseModel):
     type: EventType
     payload: dict[str, Any]
 
+# result of one event of a POST /events:batch, using the status codes of POST /events
+class EventOutcome(BaseModel):
+    event_id: str | None = None
+    status_code: int
+    description: str
+
+class BatchOutcome(BaseModel):
+    results: list[EventOutcome]
+
 class LockerSummary(BaseModel):
     locker_id: str
     compartments: int
@@ -18,12 +27,28 @@ class LockerSummary(BaseModel):
     degraded_compartments: int
     state_hash: str
 
+# GET /lockers?ids=..., ids without a locker are listed in `missing`
+class LockerList(BaseModel):
+    lockers: list[LockerSummary]
+    missing: list[str]
+
 # If the compartment has an active reservation, active_reservation = reservation_id
 class CompartmentStatus(BaseModel):
     compartment_id: str
     degraded: bool
     active_reservation: str | None = None
 
+# next_offset is None on the last page
+class CompartmentPage(BaseModel):
+    compartments: list[CompartmentStatus]
+    total: int
+    next_offset: int | None = None
+
+# compartments to try for a new reservation, `free` counts all free compartments of the locker
+class FreeCompartments(BaseModel):
+    compartment_ids: list[str]
+    free: int
+
 class ReservationStatus(BaseModel):
     reservation_id: str
     status: ResvStatus
\ No newline at end of file
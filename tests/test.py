@@ -1,18 +1,37 @@
 import uuid
 from datetime import datetime
 import pytest
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
 from domain.models import EventType, ResvStatus, PayloadType
-from interface.api import app
 from pathlib import Path
 
-event_file = Path("events.jsonl")
-event_file.write_text("")
+# the API reads its settings at import, so it is imported once with its log, database and snapshots
+# in a temporary directory instead of the working tree
+@pytest.fixture(scope = "session")
+def app(tmp_path_factory: pytest.TempPathFactory) -> FastAPI:
+    directory = tmp_path_factory.mktemp("api")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("LOG_PATH", str(directory / "events.jsonl"))
+        monkeypatch.setenv("SQLITE_PATH", str(directory / "events.db"))
+        monkeypatch.setenv("SNAPSHOT_DIR", str(directory / "snapshots"))
+        monkeypatch.setenv("ADMIN_TOKEN", "test-admin-token")
+        from interface.api import app
+    return app
 
 @pytest.fixture
-def client() -> TestClient:
+def client(app: FastAPI) -> TestClient:
     return TestClient(app)
 
+# tests of projection behaviour run against every Projection implementation
+@pytest.fixture(params = ["memory", "columnar"])
+def projection_class(request: pytest.FixtureRequest) -> type:
+    if request.param == "columnar":
+        from infrastructure.columnar_projection import ColumnarProjection
+        return ColumnarProjection
+    from infrastructure.in_memory_projection import InMemoryProjection
+    return InMemoryProjection
+
 def test_api_flow(client: TestClient) -> None:
     locker1_id = "L1"
 
@@ -248,3 +267,994 @@ def test_api_flow(client: TestClient) -> None:
     assert state_hash1 == state_hash2
 
 
+
+def test_event_id_index_survives_restart(tmp_path: Path) -> None:
+    from domain.models import EventResult, LockerEvent
+    from infrastructure.file_event_store import FileEventStore
+
+    log_path = tmp_path / "events.jsonl"
+    store = FileEventStore(str(log_path))
+    event = LockerEvent(str(uuid.uuid4()), datetime.now().isoformat(), "L1",
+                        EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C1"})
+    assert store.append(event) == EventResult.SUCCESS
+    assert store.append(event) == EventResult.DUPLICATE
+
+    # restored from the sidecar
+    store = FileEventStore(str(log_path))
+    assert store.append(event) == EventResult.DUPLICATE
+
+    # a stale sidecar is rebuilt from the log
+    store.index_path.write_text("")
+    store = FileEventStore(str(log_path))
+    assert store.append(event) == EventResult.DUPLICATE
+
+    # the log was truncated behind the store's back
+    log_path.write_text("")
+    assert store.append(event) == EventResult.SUCCESS
+
+def test_load_by_locker_uses_offset_index(tmp_path: Path) -> None:
+    from domain.models import LockerEvent
+    from infrastructure.file_event_store import FileEventStore
+
+    log_path = tmp_path / "events.jsonl"
+    store = FileEventStore(str(log_path))
+    for i in range(6):
+        store.append(LockerEvent(str(uuid.uuid4()), datetime.now().isoformat(), f"L{i % 2}",
+                                 EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: f"C{i}"}))
+
+    expected = ["C0", "C2", "C4"]
+    assert [e.payload["compartment_id"] for e in store.load_by_locker("L0")] == expected
+    store = FileEventStore(str(log_path))
+    assert [e.payload["compartment_id"] for e in store.load_by_locker("L0")] == expected
+    assert store.load_by_locker("L9") == []
+
+def _locker_event(locker_id: str, type: EventType, payload: dict, event_id: str | None = None):
+    from domain.models import LockerEvent
+    return LockerEvent(event_id or str(uuid.uuid4()), datetime.now().isoformat(), locker_id, type, payload)
+
+def _sample_events() -> list:
+    reported_id = str(uuid.uuid4())
+    return [
+        _locker_event("L1", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C1"}),
+        _locker_event("L1", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C2"}),
+        _locker_event("L2", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C1"}),
+        _locker_event("L1", EventType.RESERVATION_CREATED,
+                      {PayloadType.COMPARTMENT_ID: "C1", PayloadType.RESERVATION_ID: "R1"}),
+        _locker_event("L1", EventType.PARCEL_DEPOSITED,
+                      {PayloadType.COMPARTMENT_ID: "C1", PayloadType.RESERVATION_ID: "R1"}),
+        _locker_event("L2", EventType.FAULT_REPORTED,
+                      {PayloadType.COMPARTMENT_ID: "C1", PayloadType.SEVERITY: 3}, reported_id),
+        _locker_event("L2", EventType.FAULT_CLEARED,
+                      {PayloadType.COMPARTMENT_ID: "C1", PayloadType.REPORTED_EVENT_ID: reported_id}),
+        _locker_event("L2", EventType.RESERVATION_CREATED,
+                      {PayloadType.COMPARTMENT_ID: "C1", PayloadType.RESERVATION_ID: "R2"}),
+        _locker_event("L1", EventType.PARCEL_PICKED_UP,
+                      {PayloadType.COMPARTMENT_ID: "C1", PayloadType.RESERVATION_ID: "R1"}),
+    ]
+
+def test_incremental_state_hash_matches_rebuild_and_migration(tmp_path: Path, projection_class: type) -> None:
+    from domain.models import EventResult
+    from application.use_cases import LockerService
+    from infrastructure.file_event_store import FileEventStore
+    from infrastructure.state_hash import HASH_MODE_LEGACY, HASH_MODE_INCREMENTAL
+
+    store = FileEventStore(str(tmp_path / "events.jsonl"))
+    service = LockerService(projection_class(), store)
+    legacy = projection_class(HASH_MODE_LEGACY)
+    for event in _sample_events():
+        assert service.handle_event(event) == EventResult.SUCCESS
+        assert legacy.apply(event) == EventResult.SUCCESS
+    hashes = {l: service.get_locker_state(l).state_hash for l in ("L1", "L2")}
+
+    rebuilt = projection_class()
+    assert rebuilt.rebuild(store) == EventResult.SUCCESS
+    assert {l: rebuilt.query_locker(l).state_hash for l in ("L1", "L2")} == hashes
+
+    # migrating between formats gives the same hashes as replaying in that format
+    rebuilt.set_hash_mode(HASH_MODE_LEGACY)
+    assert {l: rebuilt.query_locker(l).state_hash for l in ("L1", "L2")} == \
+        {l: legacy.query_locker(l).state_hash for l in ("L1", "L2")}
+    rebuilt.set_hash_mode(HASH_MODE_INCREMENTAL)
+    assert {l: rebuilt.query_locker(l).state_hash for l in ("L1", "L2")} == hashes
+
+def test_rebuild_from_snapshot_replays_only_tail(tmp_path: Path, projection_class: type) -> None:
+    from domain.models import EventResult
+    from application.use_cases import LockerService
+    from infrastructure.file_event_store import FileEventStore
+    from infrastructure.file_snapshot_store import FileSnapshotStore
+
+    store = FileEventStore(str(tmp_path / "events.jsonl"))
+    snapshot_store = FileSnapshotStore(str(tmp_path / "snapshots"))
+    service = LockerService(projection_class(), store, snapshot_store, snapshot_interval = 4)
+    for event in _sample_events():
+        assert service.handle_event(event) == EventResult.SUCCESS
+        if service._snapshot_thread:
+            service._snapshot_thread.join()
+    hashes = {l: service.get_locker_state(l).state_hash for l in ("L1", "L2")}
+
+    snapshot = next(snapshot_store.load_all())
+    assert 0 < snapshot.position < store.get_position()
+
+    restored = LockerService(projection_class(), store, snapshot_store)
+    assert restored.rebuild_events() == EventResult.SUCCESS
+    assert {l: restored.get_locker_state(l).state_hash for l in ("L1", "L2")} == hashes
+    assert restored.get_reservation_state("R1").status == ResvStatus.PICKED_UP
+
+    # snapshots that no longer match the log are ignored
+    (tmp_path / "events.jsonl").write_text("")
+    assert restored.rebuild_events() == EventResult.SUCCESS
+    assert restored.get_locker_state("L1") is None
+
+def test_snapshot_capture_is_copy_on_write(projection_class: type) -> None:
+    from domain.models import EventResult
+
+    events = _sample_events()
+    projection = projection_class()
+    for event in events[:6]:
+        assert projection.apply(event) == EventResult.SUCCESS
+    expected = projection.snapshot()
+    capture = projection.begin_snapshot()
+    # both lockers change and a new one is registered while the capture runs
+    for event in events[6:] + [_locker_event("L3", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C1"})]:
+        assert projection.apply(event) == EventResult.SUCCESS
+    assert set(capture.preserved) == {"L1", "L2"}
+    lockers = [projection.snapshot_locker(capture, locker_id) for locker_id in capture.locker_ids]
+    assert projection.end_snapshot(capture, lockers) == expected
+    assert projection.snapshot() != expected
+
+    # a restore replaces the state being captured
+    capture = projection.begin_snapshot()
+    projection.restore(expected)
+    assert capture.cancelled
+    assert projection.apply(events[6]) == EventResult.SUCCESS and not capture.preserved
+
+def test_iter_all_streams_complete_records(tmp_path: Path) -> None:
+    from infrastructure.file_event_store import FileEventStore
+
+    log_path = tmp_path / "events.jsonl"
+    store = FileEventStore(str(log_path))
+    events = _sample_events()
+    for event in events:
+        store.append(event)
+    middle = store.get_position()
+    store.append(_locker_event("L3", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C1"}))
+
+    # a record still being written is not returned
+    with log_path.open("a") as f:
+        f.write('{"event_id": "partial')
+
+    assert [e.event_id for e in store.iter_all()][:len(events)] == [e.event_id for e in events]
+    assert [e.locker_id for e in store.iter_all(middle)] == ["L3"]
+    assert [e.event_id for e in store.iter_by_locker("L2")] == \
+        [e.event_id for e in events if e.locker_id == "L2"]
+
+def test_parallel_rebuild_matches_sequential(tmp_path: Path, projection_class: type) -> None:
+    from domain.models import EventResult
+    from infrastructure.file_event_store import FileEventStore
+    from infrastructure.parallel_rebuild import shard_of
+
+    # two lockers in different shards that both create reservation "R1",
+    # a sequential replay stops at the second creation
+    locker_a = "L1"
+    locker_b = next(f"L{i}" for i in range(2, 100) if shard_of(f"L{i}", 2) != shard_of(locker_a, 2))
+    store = FileEventStore(str(tmp_path / "events.jsonl"))
+    for event in _sample_events() + [
+        _locker_event(locker_b, EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C1"}),
+        _locker_event(locker_b, EventType.RESERVATION_CREATED,
+                      {PayloadType.COMPARTMENT_ID: "C1", PayloadType.RESERVATION_ID: "R1"}),
+        _locker_event(locker_a, EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C9"}),
+    ]:
+        store.append(event)
+
+    sequential = projection_class()
+    parallel = projection_class(rebuild_workers = 2)
+    assert sequential.rebuild(store) == EventResult.VALIDATION_ERROR
+    assert parallel.rebuild(store) == EventResult.VALIDATION_ERROR
+    assert parallel.snapshot()["lockers"] and \
+        sorted(map(str, parallel.snapshot()["lockers"])) == sorted(map(str, sequential.snapshot()["lockers"]))
+    assert parallel.query_compartment(locker_a, "C9") is None
+
+def test_batch_ingestion(client: TestClient) -> None:
+    locker_id = f"L-{uuid.uuid4()}"
+    register_id = str(uuid.uuid4())
+    register = {
+        "event_id": register_id,
+        "occurred_at": datetime.now().isoformat(),
+        "locker_id": locker_id,
+        "type": EventType.COMPARTMENT_REGISTERED,
+        "payload": {PayloadType.COMPARTMENT_ID: "C1"}
+    }
+    batch = [
+        register,
+        dict(register),
+        {**register, "event_id": str(uuid.uuid4())},
+        {**register, "event_id": "not-a-uuid"},
+        {**register, "event_id": str(uuid.uuid4()), "type": EventType.RESERVATION_CREATED,
+         "payload": {PayloadType.COMPARTMENT_ID: "C1"}},
+    ]
+    response = client.post("/events:batch", json = batch)
+    assert response.status_code == 200
+    assert [r["status_code"] for r in response.json()["results"]] == [202, 200, 409, 422, 422]
+    assert response.json()["results"][0]["event_id"] == register_id
+
+    response = client.post("/events", json = register)
+    assert response.status_code == 200
+    response = client.get(f"/lockers/{locker_id}")
+    assert response.json()["compartments"] == 1
+
+    # an oversized batch is rejected as a whole before any event is applied
+    from interface.api import MAX_BATCH_EVENTS
+    oversized = [{**register, "event_id": str(uuid.uuid4()), "payload": {PayloadType.COMPARTMENT_ID: f"C{index}"}}
+                 for index in range(MAX_BATCH_EVENTS + 1)]
+    assert client.post("/events:batch", json = oversized).status_code == 413
+    assert client.get(f"/lockers/{locker_id}").json()["compartments"] == 1
+
+def test_concurrent_appends_are_group_committed(tmp_path: Path) -> None:
+    from concurrent.futures import ThreadPoolExecutor
+    from domain.models import EventResult
+    from infrastructure.file_event_store import FileEventStore
+    from infrastructure.log_writer import DURABILITY_MODES
+
+    for durability in DURABILITY_MODES:
+        log_path = tmp_path / f"events-{durability}.jsonl"
+        store = FileEventStore(str(log_path), durability = durability)
+        events = [_locker_event(f"L{i % 5}", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: f"C{i}"})
+                  for i in range(200)]
+        with ThreadPoolExecutor(max_workers = 8) as pool:
+            results = list(pool.map(store.append, events + events[:20]))
+        assert results.count(EventResult.SUCCESS) == 200
+        assert results.count(EventResult.DUPLICATE) == 20
+        store.close()
+
+        store = FileEventStore(str(log_path))
+        assert sorted(e.event_id for e in store.iter_all()) == sorted(e.event_id for e in events)
+        assert [e.payload["compartment_id"] for e in store.iter_by_locker("L3")] == \
+            [e.payload["compartment_id"] for e in store.iter_all() if e.locker_id == "L3"]
+        store.close()
+
+def test_failed_log_write_is_not_indexed(tmp_path: Path) -> None:
+    from domain.models import EventResult
+    from infrastructure.file_event_store import FileEventStore
+
+    log_path = tmp_path / "events.jsonl"
+    store = FileEventStore(str(log_path))
+    first, second = (_locker_event("L1", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: f"C{i}"})
+                     for i in range(2))
+    assert store.append(first) == EventResult.SUCCESS
+    position = store.get_position()
+
+    # the record reaches the OS but its fsync fails
+    def failing_sync(force: bool = False) -> None:
+        raise OSError("fsync failed")
+    store._writer._sync_if_due = failing_sync
+    with pytest.raises(OSError):
+        store.append(second)
+    assert store.get_position() == position and not store.contains(second.event_id)
+    del store._writer._sync_if_due
+
+    # the retry is the only copy of the event, in the log, the sidecar and after a restart
+    assert store.append(second) == EventResult.SUCCESS
+    store.close()
+    assert len((tmp_path / "events.jsonl.idx").read_text().splitlines()) == 2
+    store = FileEventStore(str(log_path))
+    assert [event.event_id for event in store.iter_all()] == [first.event_id, second.event_id]
+    assert [event.event_id for event in store.iter_by_locker("L1")] == [first.event_id, second.event_id]
+    store.close()
+
+def test_failed_append_leaves_projection_at_the_log(tmp_path: Path, projection_class: type,
+                                                    monkeypatch: pytest.MonkeyPatch) -> None:
+    import os
+    from domain.models import EventResult
+    from application.use_cases import LockerService
+    from infrastructure.file_event_store import FileEventStore
+    from infrastructure.sqlite_event_store import SqliteEventStore
+
+    store = FileEventStore(str(tmp_path / "events.jsonl"))
+    service = LockerService(projection_class(), store)
+    reported_id = str(uuid.uuid4())
+    for event in [
+            _locker_event("L1", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C0"}),
+            _locker_event("L1", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C1"}),
+            _locker_event("L1", EventType.RESERVATION_CREATED,
+                          {PayloadType.COMPARTMENT_ID: "C0", PayloadType.RESERVATION_ID: "R0"}),
+            _locker_event("L1", EventType.FAULT_REPORTED,
+                          {PayloadType.COMPARTMENT_ID: "C1", PayloadType.SEVERITY: 3}, reported_id),
+            _locker_event("L2", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C0"})]:
+        assert service.handle_event(event) == EventResult.SUCCESS
+    hashes = {l: service.get_state_hash(l) for l in ("L1", "L2")}
+    stats = service.projection.get_stats()
+
+    # every record reaches the OS but its fsync fails
+    def failing_fsync(fd: int) -> None:
+        raise OSError(5, "Input/output error")
+    register = _locker_event("L1", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C2"})
+    batch = [
+            _locker_event("L1", EventType.PARCEL_DEPOSITED,
+                          {PayloadType.COMPARTMENT_ID: "C0", PayloadType.RESERVATION_ID: "R0"}),
+            _locker_event("L1", EventType.FAULT_CLEARED,
+                          {PayloadType.COMPARTMENT_ID: "C1", PayloadType.REPORTED_EVENT_ID: reported_id}),
+            _locker_event("L1", EventType.RESERVATION_CREATED,
+                          {PayloadType.COMPARTMENT_ID: "C1", PayloadType.RESERVATION_ID: "R1"}),
+            _locker_event("L3", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C0"})]
+    monkeypatch.setattr(os, "fsync", failing_fsync)
+    with pytest.raises(OSError):
+        service.handle_event(register)
+    with pytest.raises(OSError):
+        service.handle_events(batch)
+    monkeypatch.undo()
+
+    # nothing of the failed events is left in the projection
+    assert service.get_compartment_state("L1", "C2") is None and service.get_locker_state("L3") is None
+    assert service.get_reservation_state("R0").status == ResvStatus.CREATED
+    assert service.get_reservation_state("R1") is None
+    assert {l: service.get_state_hash(l) for l in ("L1", "L2")} == hashes
+    assert service.projection.get_stats() == stats
+
+    # the retries are accepted and persisted, a rebuild reaches the same state
+    assert service.handle_event(register) == EventResult.SUCCESS
+    assert service.handle_events(batch) == [EventResult.SUCCESS] * len(batch)
+    rebuilt = projection_class()
+    assert rebuilt.rebuild(store) == EventResult.SUCCESS
+    assert {l: rebuilt.query_state_hash(l) for l in ("L1", "L2", "L3")} == \
+        {l: service.get_state_hash(l) for l in ("L1", "L2", "L3")}
+    assert rebuilt.get_stats() == service.projection.get_stats()
+    store.close()
+
+    # a locker folded into the checkpoint is reloaded from its checkpoint row
+    store = SqliteEventStore(str(tmp_path / "events.db"))
+    service = LockerService(projection_class(), store)
+    for event in _sample_events():
+        assert service.handle_event(event) == EventResult.SUCCESS
+    assert service.compact() > 0 and store.load_by_locker("L1") == []
+    hash_l1 = service.get_state_hash("L1")
+    def failing_append_batch(events: list) -> list:
+        raise OSError("disk I/O error")
+    monkeypatch.setattr(store, "append_batch", failing_append_batch)
+    with pytest.raises(OSError):
+        service.handle_event(_locker_event("L1", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C3"}))
+    monkeypatch.undo()
+    assert service.get_state_hash("L1") == hash_l1 and service.get_compartment_state("L1", "C3") is None
+    assert service.get_reservation_state("R1").status == ResvStatus.PICKED_UP
+    store.close()
+
+def test_concurrent_handle_event_matches_rebuild(tmp_path: Path, projection_class: type) -> None:
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+    from domain.models import EventResult
+    from application.use_cases import LockerService
+    from infrastructure.file_event_store import FileEventStore
+
+    rng = random.Random(7)
+    lockers = [f"L{i}" for i in range(12)]
+    streams = []
+    for locker_id in lockers:
+        events = []
+        for c in range(8):
+            comp = {PayloadType.COMPARTMENT_ID: f"C{c}"}
+            # reservation ids collide across lockers, only one locker may win each of them
+            resv = {**comp, PayloadType.RESERVATION_ID: f"R{c}-{rng.randrange(3)}"}
+            events.append(_locker_event(locker_id, EventType.COMPARTMENT_REGISTERED, comp))
+            events.append(_locker_event(locker_id, EventType.RESERVATION_CREATED, resv))
+            events.append(_locker_event(locker_id, EventType.PARCEL_DEPOSITED, resv))
+            if rng.random() < 0.5:
+                events.append(_locker_event(locker_id, EventType.PARCEL_PICKED_UP, resv))
+            if rng.random() < 0.3:
+                events.append(_locker_event(locker_id, EventType.FAULT_REPORTED,
+                                            {**comp, PayloadType.SEVERITY: rng.randrange(1, 5)}))
+        streams.append(events)
+
+    store = FileEventStore(str(tmp_path / "events.jsonl"), durability = "none")
+    service = LockerService(projection_class(), store)
+
+    # retries of already sent events are mixed in
+    retries = [rng.sample(events, 3) for events in streams]
+
+    def run_stream(events: list, retried: list) -> list:
+        return [service.handle_event(e) for e in events + retried]
+
+    def run_batches(events: list, retried: list) -> list:
+        return service.handle_events(events[:5] + retried) + [service.handle_event(e) for e in events[5:]]
+
+    with ThreadPoolExecutor(max_workers = 8) as pool:
+        futures = [pool.submit(run_stream if i % 2 else run_batches, events, retried)
+                   for i, (events, retried) in enumerate(zip(streams, retries))]
+        results = [r for f in futures for r in f.result()]
+
+    assert results.count(EventResult.SUCCESS) == len(store.load_all())
+    rebuilt = projection_class()
+    assert rebuilt.rebuild(store) == EventResult.SUCCESS
+    for locker_id in lockers:
+        assert rebuilt.query_locker(locker_id).state_hash == service.get_locker_state(locker_id).state_hash
+    for reservation_id in (f"R{c}-{k}" for c in range(8) for k in range(3)):
+        live, replayed = service.get_reservation_state(reservation_id), rebuilt.query_reservation(reservation_id)
+        assert (live and live.status) == (replayed and replayed.status)
+
+def test_event_queued_behind_a_failed_append_sees_the_logged_state(tmp_path: Path, projection_class: type) -> None:
+    import threading, time
+    from domain.models import EventResult
+    from application.use_cases import LockerService
+    from infrastructure.file_event_store import FileEventStore
+
+    store = FileEventStore(str(tmp_path / "events.jsonl"))
+    service = LockerService(projection_class(), store)
+    assert service.handle_event(
+        _locker_event("L1", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C0"})) == EventResult.SUCCESS
+
+    # the first append fails once the second event waits for the locker
+    appending, waiting = threading.Event(), threading.Event()
+    append = store.append
+    def failing_append(event):
+        store.append = append
+        appending.set()
+        waiting.wait()
+        time.sleep(0.05)
+        raise OSError("fsync failed")
+    store.append = failing_append
+
+    register = _locker_event("L1", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C1"})
+    reserve = _locker_event("L1", EventType.RESERVATION_CREATED,
+                            {PayloadType.COMPARTMENT_ID: "C1", PayloadType.RESERVATION_ID: "R1"})
+    errors = []
+    def register_compartment() -> None:
+        try:
+            service.handle_event(register)
+        except OSError as e:
+            errors.append(e)
+    thread = threading.Thread(target=register_compartment)
+    thread.start()
+    appending.wait()
+    waiting.set()
+    # C1 never reached the log, so the reservation is validated against a locker without it
+    assert service.handle_event(reserve) == EventResult.DOMAIN_VIOLATION
+    thread.join()
+    assert len(errors) == 1 and service.get_reservation_state("R1") is None
+
+    assert service.handle_event(register) == EventResult.SUCCESS
+    assert service.handle_event(reserve) == EventResult.SUCCESS
+    rebuilt = projection_class()
+    assert rebuilt.rebuild(store) == EventResult.SUCCESS
+    assert rebuilt.query_state_hash("L1") == service.get_state_hash("L1")
+    store.close()
+
+def test_segmented_log_compaction(tmp_path: Path, projection_class: type) -> None:
+    from domain.models import EventResult
+    from application.use_cases import LockerService
+    from infrastructure.file_event_store import FileEventStore
+
+    # small segments so nearly every record starts a new one
+    store = FileEventStore(str(tmp_path / "events.jsonl"), segment_max_bytes = 300)
+    service = LockerService(projection_class(), store)
+    events = _sample_events() + [
+        _locker_event("L3", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C1"})]
+    for event in events:
+        assert service.handle_event(event) == EventResult.SUCCESS
+    assert len(store.get_segment_paths()) > 1
+    hashes = {l: service.get_locker_state(l).state_hash for l in ("L1", "L2", "L3")}
+
+    # L1 is done, L2 still has a created reservation and L3 is in the active segment
+    folded = service.compact()
+    assert folded == len([event for event in events if event.locker_id == "L1"])
+    assert store.load_by_locker("L1") == []
+    assert [e.event_id for e in store.load_all()] == [e.event_id for e in events if e.locker_id != "L1"]
+    assert service.handle_event(events[0]) == EventResult.DUPLICATE
+
+    for workers in (1, 2):
+        rebuilt = projection_class(rebuild_workers = workers)
+        assert rebuilt.rebuild(store) == EventResult.SUCCESS
+        assert {l: rebuilt.query_locker(l).state_hash for l in ("L1", "L2", "L3")} == hashes
+        # a reservation id folded into the checkpoint is still taken
+        assert rebuilt.query_reservation("R1").status == ResvStatus.PICKED_UP
+
+    # the manifest, checkpoint and folded event ids survive a restart
+    store.close()
+    reopened = FileEventStore(str(tmp_path / "events.jsonl"), segment_max_bytes = 300)
+    assert reopened.contains(events[0].event_id)
+    rebuilt = projection_class()
+    assert rebuilt.rebuild(reopened) == EventResult.SUCCESS
+    assert {l: rebuilt.query_locker(l).state_hash for l in ("L1", "L2", "L3")} == hashes
+    reopened.close()
+
+def test_binary_codec_round_trips_and_converts(tmp_path: Path, projection_class: type) -> None:
+    from domain.models import EventResult, LockerEvent
+    from infrastructure.convert_log import convert_log
+    from infrastructure.file_event_store import FileEventStore, split_position
+
+    events = _sample_events() + [
+        # fields that do not fit the packed layout are kept as text
+        _locker_event("L3", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C1", "note": [1]}, "e-1")]
+    json_store = FileEventStore(str(tmp_path / "events.jsonl"))
+    json_store.append_batch(events)
+    binary_store = FileEventStore(str(tmp_path / "events.bin"), segment_max_bytes = 200, codec = "binary")
+    for event in events:
+        binary_store.append(event)
+    assert len(binary_store.get_segment_paths()) > 1
+
+    def encoded(store):
+        return [{name: getattr(e, name) for name in LockerEvent.__slots__} for e in store.iter_all()]
+
+    assert encoded(binary_store) == encoded(json_store)
+    # a read from the middle of a segment decodes with its own copy of the segment's codec
+    positions = sorted(position for offsets in binary_store.get_locker_offsets().values() for position in offsets)
+    index, mid_segment = next((index, position) for index, position in enumerate(positions) if split_position(position)[1])
+    shared = binary_store._segment_codec(split_position(mid_segment)[0])
+    state = (shared._time_key, list(shared._strings))
+    assert [e.event_id for e in binary_store.iter_all(mid_segment)] == [e.event_id for e in events[index:]]
+    assert (shared._time_key, shared._strings) == state
+    assert [e.event_id for e in binary_store.load_by_locker("L2")] == [e.event_id for e in events if e.locker_id == "L2"]
+
+    # a partially written record is dropped on restart, the string table is rebuilt from the segment
+    binary_store.close()
+    with open(binary_store.get_segment_paths()[max(binary_store.get_segment_paths())], "ab") as f:
+        f.write(b"\x40\x00\x00\x00\x01")
+    reopened = FileEventStore(str(tmp_path / "events.bin"), segment_max_bytes = 200)
+    assert reopened.codec == "binary"
+    assert encoded(reopened) == encoded(json_store)
+    extra = _locker_event("L3", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C2"})
+    assert reopened.append(extra) == EventResult.SUCCESS
+    assert reopened.load_by_locker("L3")[-1].payload == {"compartment_id": "C2"}
+    reopened.close()
+
+    # converting keeps every record and the state they rebuild to
+    json_store.close()
+    assert convert_log(str(tmp_path / "events.jsonl"), str(tmp_path / "converted.bin"), "binary") == len(events)
+    converted = FileEventStore(str(tmp_path / "converted.bin"))
+    assert converted.codec == "binary"
+    assert (tmp_path / "converted.bin").stat().st_size < (tmp_path / "events.jsonl").stat().st_size
+    expected, rebuilt = projection_class(), projection_class()
+    assert expected.rebuild(FileEventStore(str(tmp_path / "events.jsonl"))) == EventResult.SUCCESS
+    assert rebuilt.rebuild(converted) == EventResult.SUCCESS
+    assert expected.snapshot() == rebuilt.snapshot()
+    with pytest.raises(ValueError):
+        FileEventStore(str(tmp_path / "converted.bin"), codec = "json")
+
+def test_mapped_reads_while_appending(tmp_path: Path) -> None:
+    import threading
+    from infrastructure.file_event_store import FileEventStore
+
+    for codec in ("json", "binary"):
+        store = FileEventStore(str(tmp_path / f"events-{codec}.log"), durability = "none", codec = codec)
+        events = [_locker_event(f"L{i % 3}", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: f"C{i}"})
+                  for i in range(300)]
+        writer = threading.Thread(target = lambda: [store.append(event) for event in events])
+        writer.start()
+        # every read sees a prefix of the appended events, never a partially written record
+        while writer.is_alive():
+            read = [e.event_id for e in store.iter_all()]
+            assert read == [e.event_id for e in events[:len(read)]]
+            by_locker = [e.event_id for e in store.iter_by_locker("L1")]
+            assert by_locker == [e.event_id for e in events if e.locker_id == "L1"][:len(by_locker)]
+        writer.join()
+        assert [e.event_id for e in store.iter_all()] == [e.event_id for e in events]
+        store.close()
+
+@pytest.mark.parametrize("backend", ["file", "sqlite"])
+def test_event_store_backends(tmp_path: Path, backend: str, projection_class: type) -> None:
+    from domain.models import EventResult
+    from application.use_cases import LockerService
+    from infrastructure.file_event_store import FileEventStore
+    from infrastructure.file_snapshot_store import FileSnapshotStore
+    from infrastructure.sqlite_event_store import SqliteEventStore
+
+    def open_store():
+        if backend == "sqlite":
+            return SqliteEventStore(str(tmp_path / "events.db"))
+        return FileEventStore(str(tmp_path / "events.jsonl"), segment_max_bytes = 300)
+
+    store = open_store()
+    snapshot_store = FileSnapshotStore(str(tmp_path / "snapshots"))
+    service = LockerService(projection_class(), store, snapshot_store)
+    # L3 goes last so L1's records end up in closed segments of the file store
+    events = _sample_events() + [
+        _locker_event("L3", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C1"})]
+    assert service.handle_events(events[:4]) == [EventResult.SUCCESS] * 4
+    assert service.handle_events([events[0], events[4], events[4]]) == \
+        [EventResult.DUPLICATE, EventResult.SUCCESS, EventResult.DUPLICATE]
+    service.take_snapshot().join()
+    for event in events[5:]:
+        assert service.handle_event(event) == EventResult.SUCCESS
+    assert service.handle_event(events[-1]) == EventResult.DUPLICATE
+    assert [e.event_id for e in store.load_by_locker("L2")] == [e.event_id for e in events if e.locker_id == "L2"]
+    hashes = {l: service.get_locker_state(l).state_hash for l in ("L1", "L2")}
+
+    # L1 is done and folded, its event ids stay known
+    assert service.compact() > 0
+    assert store.load_by_locker("L1") == []
+    assert store.contains(events[0].event_id)
+    store.close()
+
+    store = open_store()
+    for snapshots in (None, snapshot_store):
+        rebuilt = projection_class()
+        assert rebuilt.rebuild(store, snapshots) == EventResult.SUCCESS
+        assert {l: rebuilt.query_locker(l).state_hash for l in ("L1", "L2")} == hashes
+    assert store.append(events[0]) == EventResult.DUPLICATE
+    store.close()
+
+def test_sqlite_interval_durability_syncs_the_wal(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    import os, threading
+    from domain.models import EventResult
+    from infrastructure.sqlite_event_store import SqliteEventStore
+
+    synced = threading.Semaphore(0)
+    fsync = os.fsync
+    def counting_fsync(fd: int) -> None:
+        fsync(fd)
+        synced.release()
+    monkeypatch.setattr(os, "fsync", counting_fsync)
+
+    store = SqliteEventStore(str(tmp_path / "events.db"), durability = "interval",
+                             sync_interval_ms = 60_000, sync_interval_events = 2)
+    events = [_locker_event("L1", EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: f"C{i}"})
+              for i in range(3)]
+    # the first event is not due yet, the second one is
+    assert store.append(events[0]) == EventResult.SUCCESS
+    assert not synced.acquire(timeout = 0.1)
+    assert store.append(events[1]) == EventResult.SUCCESS
+    assert synced.acquire(timeout = 5)
+    # what is unsynced on close is synced before the store closes
+    assert store.append(events[2]) == EventResult.SUCCESS
+    store.close()
+    assert synced.acquire(timeout = 0)
+
+def test_compact_domain_model() -> None:
+    from domain.models import EventResult, Locker
+
+    first, second = Locker("".join(["L", "1"])), Locker("".join(["L", "2"]))
+    for locker in (first, second):
+        assert locker.add_compartment("".join(["C", "1"])) == EventResult.SUCCESS
+        assert locker.add_reservation("C1", f"R-{locker.locker_id}") == EventResult.SUCCESS
+    assert first.get_compartment_ids()[0] is second.get_compartment_ids()[0]
+    assert first.locker_id is Locker("L1").locker_id
+    assert not hasattr(first.get_compartment("C1"), "__dict__")
+
+    reservation = first.get_reservation("C1")
+    assert reservation.status is ResvStatus.CREATED
+    assert first.deposite_parcel("C1", "R-L1") == EventResult.SUCCESS
+    assert reservation.status is ResvStatus.DEPOSITED and reservation.status == "DEPOSITED"
+    assert first.has_open_reservation()
+    assert first.pick_up_parcel("C1", "R-L1") == EventResult.SUCCESS
+    assert not first.has_open_reservation()
+    assert first.get_locker_dict()["compartments"]["C1"]["reservation"]["status"] == ResvStatus.PICKED_UP
+
+@pytest.mark.parametrize("hash_mode", ["incremental", "legacy"])
+def test_columnar_projection_matches_in_memory(hash_mode: str) -> None:
+    import random
+    from domain.models import LockerEvent
+    from infrastructure.columnar_projection import ColumnarProjection
+    from infrastructure.in_memory_projection import InMemoryProjection
+
+    rng = random.Random(7)
+    memory, columnar = InMemoryProjection(hash_mode), ColumnarProjection(hash_mode)
+    fault_ids = []
+    for i in range(3000):
+        event_type = rng.choice(list(EventType))
+        payload = {PayloadType.COMPARTMENT_ID: f"C{rng.randrange(6)}",
+                   PayloadType.RESERVATION_ID: f"R{rng.randrange(40)}",
+                   PayloadType.SEVERITY: rng.randrange(5)}
+        if event_type == EventType.FAULT_CLEARED and fault_ids:
+            payload[PayloadType.REPORTED_EVENT_ID] = rng.choice(fault_ids)
+        event = LockerEvent(f"E{i}", "2026-01-01T00:00:00", f"L{rng.randrange(4)}", event_type, payload)
+        assert columnar.apply(event) == memory.apply(event)
+        if event_type == EventType.FAULT_REPORTED:
+            fault_ids.append(event.event_id)
+
+    def normalized(state):
+        return {**state, "open_faults": sorted(state["open_faults"])}
+    assert normalized(columnar.snapshot()) == normalized(memory.snapshot())
+    for locker_id in ("L0", "L1", "L2", "L3", "L9"):
+        expected, actual = memory.query_locker(locker_id), columnar.query_locker(locker_id)
+        assert (actual and (actual.get_locker_dict(), actual.state_hash)) == \
+            (expected and (expected.get_locker_dict(), expected.state_hash))
+    assert columnar.query_reservation("R1").status == memory.query_reservation("R1").status
+
+    totals = columnar.fleet_totals()
+    assert totals["degraded_compartments"] and totals["active_reservations"]
+    compartments = [compartment for entry in memory.snapshot()["lockers"] for compartment in entry["compartments"]]
+    assert totals["compartments"] == len(compartments)
+    assert totals["degraded_compartments"] == sum(compartment[2] for compartment in compartments)
+    assert totals["active_reservations"] == sum(compartment[4] in ("CREATED", "DEPOSITED") for compartment in compartments)
+
+    # filtered listings: same members in both projections and after a restore, as derived from the snapshot
+    from domain.models import CompartmentFilter, RESV_STATUS_CODES, ResvStatus, compartment_filters
+    restored = InMemoryProjection(hash_mode)
+    restored.restore(memory.snapshot())
+    for entry in memory.snapshot()["lockers"]:
+        for compartment_filter in (None, *CompartmentFilter):
+            expected = {compartment[0] for compartment in entry["compartments"] if compartment_filter is None or
+                        compartment_filter in compartment_filters(compartment[1], compartment[2],
+                            RESV_STATUS_CODES[ResvStatus(compartment[4])] if compartment[4] else None)}
+            for projection in (memory, columnar, restored):
+                page, total = projection.query_compartments(entry["locker_id"], compartment_filter, 0, 100)
+                assert {compartment.compartment_id for compartment in page} == expected and total == len(expected)
+    for locker_id in ("L0", "L1", "L2", "L3"):
+        free_ids, free = memory.query_free_compartments(locker_id, 100)
+        assert columnar.query_free_compartments(locker_id, 100) == (free_ids, free) and len(free_ids) == free
+        assert columnar.query_locker(locker_id).get_free_compartment_ids() == free_ids
+        assert set(restored.query_free_compartments(locker_id, 100)[0]) == set(free_ids)
+    assert memory.query_free_compartments("L9", 1) is None and columnar.query_free_compartments("L9", 1) is None
+    assert memory.query_compartments("L9", None, 0, 10) is None and columnar.query_compartments("L9", None, 0, 10) is None
+    assert [locker and locker.locker_id for locker in columnar.query_lockers(["L1", "L9"])] == ["L1", None]
+    # summary counters straight from the columns, no compartment built
+    def counts(projection) -> list:
+        return [locker and (locker.locker_id, locker.num_compartment, locker.num_reservation, locker.num_degraded,
+                            locker.state_hash) for locker in projection.query_locker_counts(["L0", "L1", "L9"])]
+    assert counts(columnar) == counts(memory) and counts(memory)[-1] is None
+    locker = memory.query_locker("L1")
+    assert counts(memory)[1] == ("L1", locker.num_compartment, locker.num_reservation, locker.num_degraded,
+                                 locker.state_hash)
+
+def test_benchmark_workload_and_baseline_comparison() -> None:
+    from domain.models import EventResult
+    from infrastructure.in_memory_projection import InMemoryProjection
+    from benchmarks.suite import compare
+    from benchmarks.workload import Workload
+
+    workload = Workload(lockers = 5, compartments = 4, events = 300, fault_rate = 0.2, seed = 3)
+    events = list(workload.iter_events())
+    assert [e.event_id for e in events] == [e.event_id for e in Workload(5, 4, 300, fault_rate = 0.2, seed = 3).iter_events()]
+    assert len(events) == 300 and {e.type for e in events} == set(EventType)
+    projection = InMemoryProjection()
+    assert all(projection.apply(e) == EventResult.SUCCESS for e in events)
+
+    baseline = {"metrics": {"ingest_events_per_s": 1000, "rebuild_s": 1.0}, "tolerances": {"rebuild_s": 0.5}}
+    rows = {row["metric"]: row["regressed"] for row in compare({"ingest_events_per_s": 700, "rebuild_s": 1.4}, baseline)}
+    assert rows == {"ingest_events_per_s": True, "rebuild_s": False}
+
+def test_metrics_endpoint(client: TestClient) -> None:
+    from application.metrics import APPLY_SECONDS, EVENTS_TOTAL
+
+    accepted = EVENTS_TOTAL.value("SUCCESS")
+    applied = APPLY_SECONDS.count("CompartmentRegistered", "SUCCESS")
+    event = {"event_id": str(uuid.uuid4()), "occurred_at": datetime.now().isoformat(), "locker_id": "L-metrics",
+             "type": EventType.COMPARTMENT_REGISTERED, "payload": {PayloadType.COMPARTMENT_ID: "C1"}}
+    assert client.post("/events", json = event).status_code == 202
+    assert client.post("/events", json = event).status_code == 200
+    assert EVENTS_TOTAL.value("SUCCESS") == accepted + 1
+    assert APPLY_SECONDS.count("CompartmentRegistered", "SUCCESS") == applied + 1
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    assert "# TYPE locker_handle_event_seconds histogram" in lines
+    assert any(line.startswith('locker_handle_event_seconds_bucket{result="DUPLICATE",le="+Inf"}') for line in lines)
+    assert any(line.startswith('locker_event_store_append_seconds_count{phase="write"}') for line in lines)
+    assert any(line.startswith('locker_state_hash_seconds_count{mode="incremental"}') for line in lines)
+    gauges = {line.split()[0]: float(line.split()[1]) for line in lines
+              if line.split()[0] in ("locker_log_bytes", "locker_log_events", "locker_lockers", "locker_reservations")}
+    assert gauges["locker_log_events"] >= 1 and gauges["locker_log_bytes"] > 0 and gauges["locker_lockers"] >= 1
+
+def test_profiling_hooks(client: TestClient, monkeypatch: pytest.MonkeyPatch) -> None:
+    import pstats, tempfile
+    from pathlib import Path
+    from interface import api
+
+    # the admin endpoints need the token, and do not exist without one
+    assert client.get("/admin/profiling").status_code == 401
+    assert client.get("/admin/profiling", headers = {"Authorization": "Bearer wrong"}).status_code == 401
+    with monkeypatch.context() as disabled:
+        disabled.setattr(api, "ADMIN_TOKEN", None)
+        assert client.get("/admin/profiling", headers = {"Authorization": "Bearer test-admin-token"}).status_code == 404
+    client.headers["Authorization"] = "Bearer test-admin-token"
+
+    def event(compartment_id: str) -> dict:
+        return {"event_id": str(uuid.uuid4()), "occurred_at": datetime.now().isoformat(), "locker_id": "L-profiling",
+                "type": EventType.COMPARTMENT_REGISTERED, "payload": {PayloadType.COMPARTMENT_ID: compartment_id}}
+
+    assert client.get("/admin/profile/download").status_code in (200, 404)
+    assert client.post("/admin/profile", params = {"requests": 2}).json()["profile_remaining"] == 2
+    for index in range(3):
+        assert client.post("/events", json = event(f"C{index}")).status_code == 202
+    profiling = client.get("/admin/profiling").json()
+    assert profiling["profile_remaining"] == 0 and profiling["profiled_requests"] == 2
+
+    response = client.get("/admin/profile/download")
+    assert response.status_code == 200
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "profile.pstats"
+        path.write_bytes(response.content)
+        stats = pstats.Stats(str(path))
+    assert any(function == "handle_event" for _, _, function in stats.stats)
+
+    # every request is slower than the threshold
+    client.put("/admin/tracing", params = {"slow_request_ms": 0.001})
+    try:
+        assert client.post("/events", json = event("C9")).status_code == 202
+    finally:
+        client.put("/admin/tracing", params = {"slow_request_ms": 0})
+    slow = [entry for entry in client.get("/admin/traces/slow").json() if entry["request"] == "POST /events"][-1]
+    assert slow["event_type"] == EventType.COMPARTMENT_REGISTERED.value and slow["status"] == 202
+    assert slow["locker_compartments"] == 4
+    assert {"validation", "apply", "hash", "dedup", "write"} <= set(slow["spans_ms"])
+    assert slow["duration_ms"] >= sum(slow["spans_ms"][span] for span in ("validation", "apply", "dedup", "write"))
+
+def test_conditional_get_by_state_hash(client: TestClient) -> None:
+    from interface.api import response_cache
+    from interface.response_cache import etag_matches
+
+    locker_id = f"L-etag-{uuid.uuid4()}"
+    def post(event_type: EventType, payload: dict) -> None:
+        event = {"event_id": str(uuid.uuid4()), "occurred_at": datetime.now().isoformat(), "locker_id": locker_id,
+                 "type": event_type, "payload": payload}
+        assert client.post("/events", json = event).status_code == 202
+
+    post(EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: "C1"})
+    response = client.get(f"/lockers/{locker_id}")
+    etag = response.headers["etag"]
+    assert response.status_code == 200 and etag == f'"{response.json()["state_hash"]}"'
+    assert response_cache.get(("locker", locker_id), response.json()["state_hash"]) == response.content
+
+    # an unchanged locker answers with 304 and no body, a cached poll returns the same bytes
+    not_modified = client.get(f"/lockers/{locker_id}", headers = {"If-None-Match": etag})
+    assert not_modified.status_code == 304 and not_modified.content == b"" and not_modified.headers["etag"] == etag
+    assert client.get(f"/lockers/{locker_id}").content == response.content
+    compartment = client.get(f"/lockers/{locker_id}/compartments/C1")
+    assert compartment.headers["etag"] == etag and compartment.json()["active_reservation"] is None
+    assert client.get(f"/lockers/{locker_id}/compartments/C1",
+                      headers = {"If-None-Match": f'W/"other", {etag}'}).status_code == 304
+    # a missing compartment of the locker is not "not modified", whatever the ETag
+    missing = client.get(f"/lockers/{locker_id}/compartments/C9", headers = {"If-None-Match": etag})
+    assert missing.status_code == 200 and missing.json() is None and "etag" not in missing.headers
+
+    # an applied event changes the state_hash, which invalidates the ETag and the cached bytes
+    post(EventType.RESERVATION_CREATED, {PayloadType.COMPARTMENT_ID: "C1", PayloadType.RESERVATION_ID: "R-etag"})
+    changed = client.get(f"/lockers/{locker_id}", headers = {"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert changed.json()["active_reservations"] == 1
+    compartment = client.get(f"/lockers/{locker_id}/compartments/C1", headers = {"If-None-Match": etag})
+    assert compartment.status_code == 200 and compartment.json()["active_reservation"] == "R-etag"
+
+    assert client.get("/lockers/L-etag-missing").json() is None
+    assert etag_matches("*", etag) and not etag_matches(None, etag) and not etag_matches('"other"', etag)
+
+def test_bulk_lockers_and_compartment_listing(client: TestClient) -> None:
+    locker_id = f"L-list-{uuid.uuid4()}"
+    def post(event_type: EventType, payload: dict) -> str:
+        event_id = str(uuid.uuid4())
+        event = {"event_id": event_id, "occurred_at": datetime.now().isoformat(), "locker_id": locker_id,
+                 "type": event_type, "payload": payload}
+        assert client.post("/events", json = event).status_code == 202
+        return event_id
+
+    for index in range(5):
+        post(EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: f"C{index}"})
+    post(EventType.RESERVATION_CREATED, {PayloadType.COMPARTMENT_ID: "C1", PayloadType.RESERVATION_ID: f"R-{locker_id}"})
+    post(EventType.FAULT_REPORTED, {PayloadType.COMPARTMENT_ID: "C3", PayloadType.SEVERITY: 4})
+    fault_id = post(EventType.FAULT_REPORTED, {PayloadType.COMPARTMENT_ID: "C4", PayloadType.SEVERITY: 1})
+
+    response = client.get("/lockers", params = {"ids": f"{locker_id},L-list-missing,{locker_id}"}).json()
+    assert [locker["locker_id"] for locker in response["lockers"]] == [locker_id]
+    assert response["lockers"][0]["compartments"] == 5 and response["missing"] == ["L-list-missing"]
+
+    def listed(**params) -> dict:
+        return client.get(f"/lockers/{locker_id}/compartments", params = params).json()
+    assert [compartment["compartment_id"] for compartment in listed(status = "free")["compartments"]] == ["C0", "C2", "C4"]
+    assert listed(status = "reserved")["compartments"][0]["active_reservation"] == f"R-{locker_id}"
+    assert [compartment["compartment_id"] for compartment in listed(status = "degraded")["compartments"]] == ["C3"]
+    assert {compartment["compartment_id"] for compartment in listed(status = "faulted")["compartments"]} == {"C3", "C4"}
+
+    first, second = listed(limit = 3), listed(limit = 3, offset = 3)
+    assert first["total"] == 5 and first["next_offset"] == 3 and second["next_offset"] is None
+    assert [compartment["compartment_id"] for compartment in first["compartments"] + second["compartments"]] == \
+        [f"C{index}" for index in range(5)]
+
+    free = client.get(f"/lockers/{locker_id}/free-compartments", params = {"count": 2}).json()
+    assert free == {"compartment_ids": ["C0", "C2"], "free": 3}
+    assert client.get("/lockers/L-list-missing/free-compartments").json() is None
+
+    post(EventType.FAULT_CLEARED, {PayloadType.COMPARTMENT_ID: "C4", PayloadType.REPORTED_EVENT_ID: fault_id})
+    assert [compartment["compartment_id"] for compartment in listed(status = "faulted")["compartments"]] == ["C3"]
+    assert client.get(f"/lockers/{locker_id}/compartments", params = {"status": "broken"}).status_code == 422
+    assert client.get("/lockers/L-list-missing/compartments").json() is None
+
+def test_locker_free_set() -> None:
+    from domain.models import EventResult, Locker
+
+    locker = Locker("L-free")
+    for compartment_id in ("C1", "C2", "C3"):
+        locker.add_compartment(compartment_id)
+    assert locker.get_free_compartment_ids() == ["C1", "C2", "C3"] and locker.num_free == 3
+    assert locker.get_free_compartment_ids(2) == ["C1", "C2"]
+
+    assert locker.add_reservation("C1", "R1") == EventResult.SUCCESS
+    assert locker.report_fault_compartment("C2", 3) == EventResult.SUCCESS
+    assert locker.get_free_compartment_ids() == ["C3"]
+    # a minor fault leaves the compartment usable, a finished reservation still occupies it
+    assert locker.report_fault_compartment("C3", 1) == EventResult.SUCCESS
+    locker.deposite_parcel("C1", "R1")
+    locker.pick_up_parcel("C1", "R1")
+    assert locker.get_free_compartment_ids() == ["C3"]
+    # a cleared compartment is free again, behind the ones that stayed free
+    assert locker.clear_fault_compartment("C2") == EventResult.SUCCESS
+    assert locker.get_free_compartment_ids() == ["C3", "C2"] and locker.num_free == 2
+
+def test_expiry_scheduler(tmp_path: Path, projection_class: type, caplog: pytest.LogCaptureFixture) -> None:
+    import logging, time
+    from datetime import timezone
+    from domain.models import EventResult, LockerEvent
+    from application.expiry import EXPIRY_NAMESPACE, ExpiryScheduler
+    from application.use_cases import LockerService
+    from infrastructure.file_event_store import FileEventStore
+
+    created = datetime(2026, 1, 1, tzinfo = timezone.utc)
+    start = created.timestamp()
+    def event(event_type: EventType, payload: dict) -> LockerEvent:
+        return LockerEvent(str(uuid.uuid4()), created.isoformat(), "L1", event_type, payload)
+
+    store = FileEventStore(str(tmp_path / "events.jsonl"))
+    service = LockerService(projection_class(), store)
+    scheduler = ExpiryScheduler(service, ttl_seconds = 60, batch_size = 2)
+    service.expiry_scheduler = scheduler
+    events = [event(EventType.COMPARTMENT_REGISTERED, {PayloadType.COMPARTMENT_ID: f"C{index}"}) for index in range(5)]
+    events += [event(EventType.RESERVATION_CREATED, {PayloadType.COMPARTMENT_ID: f"C{index}",
+                                                     PayloadType.RESERVATION_ID: f"R{index}"}) for index in range(4)]
+    assert service.handle_events(events) == [EventResult.SUCCESS] * 9
+    assert service.handle_event(event(EventType.PARCEL_DEPOSITED, {PayloadType.COMPARTMENT_ID: "C0",
+                                                                   PayloadType.RESERVATION_ID: "R0"})) == EventResult.SUCCESS
+    assert len(scheduler) == 4
+
+    # a batch that fails goes back on the heap, and the thread logs the failure and keeps checking
+    expire_reservations = service.expire_reservations
+    def failing_expire_reservations(events: list[LockerEvent]) -> list[int]:
+        raise OSError("log write failed")
+    service.expire_reservations = failing_expire_reservations
+    with pytest.raises(OSError):
+        scheduler.run_due(start + 60)
+    # the deposited R0 was dropped on the way, R1 and R2 are back
+    assert len(scheduler) == 3
+    scheduler.check_interval = 0.01
+    with caplog.at_level(logging.ERROR, logger = "locker.expiry"):
+        scheduler.start()
+        time.sleep(0.1)
+        assert scheduler._thread.is_alive()
+        scheduler.stop()
+    assert "issuing due reservation expiries failed" in caplog.text and len(scheduler) == 3
+    service.expire_reservations = expire_reservations
+
+    assert scheduler.run_due(start + 59) == 0
+    # R1 is deposited after it was taken off the heap as CREATED, it must not be expired
+    take_due = scheduler._take_due
+    def take_due_then_deposit(now: float) -> tuple:
+        scheduler._take_due = take_due
+        taken = take_due(now)
+        assert service.handle_event(event(EventType.PARCEL_DEPOSITED, {PayloadType.COMPARTMENT_ID: "C1",
+                                                                       PayloadType.RESERVATION_ID: "R1"})) == EventResult.SUCCESS
+        return taken
+    scheduler._take_due = take_due_then_deposit
+    # the others expire in batches of two
+    assert scheduler.run_due(start + 60) == 2 and len(scheduler) == 0
+    assert [service.get_reservation_state(f"R{index}").status for index in range(4)] == \
+        [ResvStatus.DEPOSITED, ResvStatus.DEPOSITED, ResvStatus.EXPIRED, ResvStatus.EXPIRED]
+    expiry = list(store.iter_all())[-1]
+    assert expiry.type == EventType.RESERVATION_EXPIRED and expiry.occurred_at == "2026-01-01T00:01:00+00:00"
+
+    # a rebuild schedules the reservations that are still CREATED, from their created_at
+    assert service.handle_event(event(EventType.RESERVATION_CREATED, {PayloadType.COMPARTMENT_ID: "C4",
+                                                                      PayloadType.RESERVATION_ID: "R4"})) == EventResult.SUCCESS
+    restarted = LockerService(projection_class(), store)
+    restarted_scheduler = ExpiryScheduler(restarted, ttl_seconds = 60)
+    restarted.expiry_scheduler = restarted_scheduler
+    assert restarted.rebuild_events() == EventResult.SUCCESS and len(restarted_scheduler) == 1
+    assert restarted.get_reservation_state("R4").created_at == start
+    assert restarted_scheduler.run_due(start + 60) == 1
+    assert restarted.get_reservation_state("R4").status == ResvStatus.EXPIRED
+
+    # expiry event ids are derived from the reservation, issuing one again is a duplicate
+    expiry = list(store.iter_all())[-1]
+    assert expiry.event_id == str(uuid.uuid5(EXPIRY_NAMESPACE, "R4"))
+    assert restarted.handle_event(LockerEvent(expiry.event_id, expiry.occurred_at, "L1", EventType.RESERVATION_EXPIRED,
+                                              expiry.payload)) == EventResult.DUPLICATE
+    store.close()
+
+def test_restore_accepts_rows_without_created_at(projection_class: type) -> None:
+    projection = projection_class()
+    for event in _sample_events():
+        projection.apply(event)
+    state = projection.snapshot()
+    hashes = {entry["locker_id"]: entry["state_hash"] for entry in state["lockers"]}
+    for entry in state["lockers"]:
+        entry["compartments"] = [compartment[:5] for compartment in entry["compartments"]]
+    restored = projection_class()
+    restored.restore(state)
+    assert {locker_id: restored.query_locker(locker_id).state_hash for locker_id in hashes} == hashes
+    assert restored.query_reservation("R1").created_at is None